@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Compares the collection (isPartOf) bookkeeping of the gather stage done with
+the former list scans and with ckanext.datajson.collection_index, on a
+synthetic catalog harvested before.
+
+    python bin/benchmark_collections.py [datasets] [collections]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ckanext', 'datajson'))
+
+from collection_index import CollectionIndex
+
+
+def make_catalog(n_datasets, n_collections):
+    # a catalog of n_datasets, n_collections of them collections with the
+    # others spread over them, and the datasets of the previous harvest: a
+    # tenth of the collections are new, a tenth of the old ones were demoted
+    # and a few datasets were promoted
+    rnd = random.Random(42)
+    parents = ['collection-%d' % i for i in range(n_collections)]
+    datasets = [{'identifier': identifier} for identifier in parents]
+    for i in range(n_datasets - n_collections):
+        datasets.append({'identifier': 'dataset-%d' % i, 'isPartOf': rnd.choice(parents)})
+    parent_identifiers = set(parents)
+    child_identifiers = set(d['identifier'] for d in datasets if d.get('isPartOf'))
+
+    existing = {}
+    for dataset in datasets:
+        identifier = dataset['identifier']
+        existing[identifier] = {'id': 'pkg-' + identifier, 'state': 'active', 'source_hash': '',
+                                'collection_metadata': 'true' if identifier in parent_identifiers else None}
+    for identifier in parents[:n_collections // 10]:
+        del existing[identifier]
+    for i in range(n_collections // 10):
+        existing['dataset-%d' % i]['collection_metadata'] = 'true'
+    for identifier in parents[n_collections // 10:n_collections // 10 + 50]:
+        existing[identifier]['collection_metadata'] = None
+    return datasets, parent_identifiers, child_identifiers, existing
+
+
+def scanned(datasets, parent_identifiers, child_identifiers, existing_datasets):
+    # the bookkeeping as gather_stage did it before
+    existing_parents = {}
+    for sid, pkg in existing_datasets.iteritems():
+        if pkg["collection_metadata"] and pkg["state"] == "active":
+            existing_parents[sid] = pkg
+    existing_parents_demoted = set(
+        identifier for identifier in existing_parents.keys()
+        if identifier not in parent_identifiers)
+    existing_datasets_promoted = set(
+        identifier for identifier in existing_datasets.keys()
+        if identifier in parent_identifiers
+        and identifier not in existing_parents.keys())
+    nested = parent_identifiers & child_identifiers
+    new_parents = set(identifier for identifier in parent_identifiers
+                      if identifier not in existing_parents.keys())
+    waiting, updated = [], []
+    for dataset in datasets:
+        if parent_identifiers and new_parents \
+                and dataset['identifier'] not in parent_identifiers \
+                and dataset.get('isPartOf') in new_parents:
+            waiting.append(dataset['identifier'])
+        elif dataset['identifier'] in existing_parents_demoted \
+                or dataset['identifier'] in existing_datasets_promoted:
+            updated.append(dataset['identifier'])
+    return nested, new_parents, existing_parents_demoted, existing_datasets_promoted, waiting, updated
+
+
+def indexed(datasets, parent_identifiers, child_identifiers, existing_datasets):
+    collections = CollectionIndex(parent_identifiers, child_identifiers, existing_datasets)
+    waiting, updated = [], []
+    for dataset in datasets:
+        if collections.waits_for_parent(dataset):
+            waiting.append(dataset['identifier'])
+        elif dataset['identifier'] in collections.role_changed:
+            updated.append(dataset['identifier'])
+    return (collections.nested, collections.new_parents, collections.demoted, collections.promoted,
+            waiting, updated)
+
+
+def timed(f, *args):
+    started = time.time()
+    result = f(*args)
+    return result, time.time() - started
+
+
+def main(n_datasets, n_collections):
+    catalog = make_catalog(n_datasets, n_collections)
+    print '%d datasets, %d collections' % (n_datasets, n_collections)
+    old, old_time = timed(scanned, *catalog)
+    new, new_time = timed(indexed, *catalog)
+    assert old == new
+    print '%-12s %10s' % ('', 'seconds')
+    print '%-12s %10.3f' % ('list scans', old_time)
+    print '%-12s %10.3f' % ('indexed', new_time)
+    print 'speedup %.0fx (%d waiting for their collection, %d changed role)' % (
+        old_time / new_time, len(new[4]), len(new[5]))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 5000)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Compares how the import stage flags the previous harvest objects of a package
+as not current: loading all of them and saving them one at a time, as it was
+done before, and with one UPDATE of the rows still flagged, with and without
+the (package_id, current) index. Runs on an in-memory SQLite copy of the
+harvest_object table where every package was harvested many times, so it
+leaves out the ORM overhead the former loop also had.
+
+    python bin/benchmark_current_flags.py [packages] [harvests] [imports]
+"""
+import sqlite3
+import sys
+import time
+
+
+def make_history(n_packages, n_harvests, indexed):
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE harvest_object (id INTEGER PRIMARY KEY, package_id TEXT, current BOOLEAN)')
+    # every harvest left an object per package, the last one is current
+    db.executemany('INSERT INTO harvest_object (package_id, current) VALUES (?, ?)',
+                   (('pkg-%d' % p, h == n_harvests - 1) for h in range(n_harvests) for p in range(n_packages)))
+    # with or without the index below, package_id alone is indexed
+    db.execute('CREATE INDEX harvest_object_package_id_idx ON harvest_object (package_id)')
+    if indexed:
+        db.execute('CREATE INDEX idx_datajson_harvest_object_package_current '
+                   'ON harvest_object (package_id, current)')
+    db.commit()
+    return db
+
+
+def new_object(db):
+    return db.execute('INSERT INTO harvest_object (package_id, current) VALUES (NULL, 0)').lastrowid
+
+
+def row_by_row(db, package_id, object_id):
+    # for ob in Session.query(HarvestObject).filter_by(package_id=...): ob.current = False; ob.save()
+    for row in db.execute('SELECT id, package_id, current FROM harvest_object WHERE package_id = ?',
+                          (package_id,)).fetchall():
+        db.execute('UPDATE harvest_object SET package_id = ?, current = 0 WHERE id = ?', (row[1], row[0]))
+        db.commit()
+    db.execute('UPDATE harvest_object SET package_id = ?, current = 1 WHERE id = ?', (package_id, object_id))
+    db.commit()
+
+
+def set_based(db, package_id, object_id):
+    db.execute('UPDATE harvest_object SET current = 0 WHERE package_id = ? AND current = 1 AND id != ?',
+               (package_id, object_id))
+    db.execute('UPDATE harvest_object SET package_id = ?, current = 1 WHERE id = ?', (package_id, object_id))
+    db.commit()
+
+
+def timed(n_packages, n_harvests, n_imports, flag, indexed):
+    db = make_history(n_packages, n_harvests, indexed)
+    package_ids = ['pkg-%d' % (i % n_packages) for i in range(n_imports)]
+    started = time.time()
+    for package_id in package_ids:
+        flag(db, package_id, new_object(db))
+    elapsed = time.time() - started
+    current = db.execute('SELECT COUNT(*) FROM harvest_object WHERE current = 1').fetchone()[0]
+    assert current == n_packages, current
+    db.close()
+    return elapsed
+
+
+def main(n_packages, n_harvests, n_imports):
+    print '%d packages harvested %d times, %d imports' % (n_packages, n_harvests, n_imports)
+    print '%-28s %10s %12s' % ('', 'seconds', 'ms/import')
+    results = []
+    for label, flag, indexed in [('row by row', row_by_row, False),
+                                 ('one UPDATE', set_based, False),
+                                 ('one UPDATE, indexed', set_based, True)]:
+        elapsed = timed(n_packages, n_harvests, n_imports, flag, indexed)
+        results.append(elapsed)
+        print '%-28s %10.3f %12.3f' % (label, elapsed, elapsed * 1000 / n_imports)
+    print 'speedup %.0fx' % (results[0] / results[-1])
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 200,
+         int(sys.argv[3]) if len(sys.argv) > 3 else 2000)
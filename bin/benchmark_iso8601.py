@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Compares the modified / temporal checks of the validator done with the old
+ISO 8601 regexes and with ckanext.datajson.parse_iso8601.
+
+    python bin/benchmark_iso8601.py [repeat]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ckanext', 'datajson'))
+
+import datajsonvalidator as v
+import parse_iso8601
+
+
+def regex_modified(s):
+    return bool(v.MODIFIED_REGEX_1.match(s) or v.MODIFIED_REGEX_2.match(s) or v.MODIFIED_REGEX_3.match(s))
+
+
+def regex_temporal(s):
+    return bool(v.TEMPORAL_REGEX_1.match(s) or v.TEMPORAL_REGEX_2.match(s) or v.TEMPORAL_REGEX_3.match(s))
+
+
+CASES = [
+    ('modified', regex_modified, parse_iso8601.is_modified, [
+        '2015-01-01', '2015-01-01T10:20:30Z', '2015-01-01T10:20:30.123-05:00', 'R/P1Y', '2015-W05-3',
+        'not a date', '2015-13-45',
+    ]),
+    ('temporal', regex_temporal, parse_iso8601.is_temporal, [
+        '2015-01-01/2016-01-01', '2010-01-01T00:00:00Z/2016-12-31T23:59:59Z', 'R/2015-01-01/P1Y',
+        'P1Y/2016-01-01', 'garbage/garbage',
+    ]),
+]
+
+LONG_CASES = [
+    ('modified', regex_modified, parse_iso8601.is_modified, lambda n: 'P' + '1' * n + 'X'),
+    ('modified', regex_modified, parse_iso8601.is_modified, lambda n: '2015-01-01T10:20:30.' + '1' * n + ':'),
+    ('temporal', regex_temporal, parse_iso8601.is_temporal, lambda n: '2015-01-01/' + '1' * n),
+]
+
+
+def per_call(f, value, number):
+    return min(timeit.repeat(lambda: f(value), number=number, repeat=3)) / number * 1e6
+
+
+def main(number):
+    print '%-10s %-45s %10s %10s' % ('field', 'value', 'regex us', 'parser us')
+    for field, regex, parser, values in CASES:
+        for value in values:
+            assert regex(value) == parser(value)
+            print '%-10s %-45s %10.2f %10.2f' % (field, value, per_call(regex, value, number),
+                                                 per_call(parser, value, number))
+    print
+    for field, regex, parser, make in LONG_CASES:
+        for n in (100, 1000, 10000):
+            value = make(n)
+            assert regex(value) == parser(value)
+            label = '%s... (%d chars)' % (value[:20], len(value))
+            print '%-10s %-45s %10.2f %10.2f' % (field, label, per_call(regex, value, 100),
+                                                 per_call(parser, value, 100))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
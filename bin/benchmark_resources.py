@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Compares matching the resources of a harvested dataset to those of the
+package it updates with the former nested loop over both lists and with
+ckanext.datajson.resource_index.
+
+    python bin/benchmark_resources.py [resources]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ckanext', 'datajson'))
+
+from resource_index import ResourceIndex, resource_unchanged
+
+
+def make_resources(n_resources):
+    # a time series of files, the harvested copy adds one and drops the first
+    existing = [{'id': 'res-%d' % i, 'url': 'http://example.gov/series/%d.csv' % i, 'name': 'File %d' % i,
+                 'format': 'CSV', 'mimetype': 'text/csv', 'description': ''} for i in range(n_resources)]
+    harvested = [{'url': 'http://example.gov/series/%d.csv' % i, 'name': 'File %d' % i,
+                  'format': 'CSV', 'mimetype': 'text/csv', 'description': ''} for i in range(1, n_resources + 1)]
+    return existing, harvested
+
+
+def nested_loop(existing, harvested):
+    ids = []
+    for res in harvested:
+        res_id = None
+        for existing_res in existing:
+            if res["url"] == existing_res["url"]:
+                res_id = existing_res["id"]
+        ids.append(res_id)
+    return ids
+
+
+def indexed(existing, harvested):
+    matches = ResourceIndex(existing).match(harvested)
+    # the unchanged check is part of the new matching
+    [resource_unchanged(res, existing_res) for res, existing_res in zip(harvested, matches) if existing_res]
+    return [existing_res and existing_res['id'] for existing_res in matches]
+
+
+def timed(f, *args):
+    started = time.time()
+    result = f(*args)
+    return result, time.time() - started
+
+
+def main(n_resources):
+    existing, harvested = make_resources(n_resources)
+    print '%d resources' % n_resources
+    old, old_time = timed(nested_loop, existing, harvested)
+    new, new_time = timed(indexed, existing, harvested)
+    assert old == new
+    print '%-12s %10s' % ('', 'seconds')
+    print '%-12s %10.3f' % ('nested loop', old_time)
+    print '%-12s %10.3f' % ('indexed', new_time)
+    print 'speedup %.0fx' % (old_time / new_time)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
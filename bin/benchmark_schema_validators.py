@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+"""
+Compares the interpreted jsonschema validator and the compiled one from
+ckanext.datajson.schema_compiler on the datasets of a data.json file.
+
+    python bin/benchmark_schema_validators.py [data.json] [repeat]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ckanext', 'datajson'))
+
+from schema_validators import SCHEMA_FILES, get_schema_validator
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ckanext', 'datajson', 'tests',
+                      'datajson-samples', 'arm.data.json')
+
+
+def per_dataset(validator, datasets, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.time()
+        for dataset in datasets:
+            list(validator.iter_errors(dataset))
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(datasets) * 1e6
+
+
+def main(path, repeat):
+    with open(path) as f:
+        catalog = json.load(f)
+    datasets = catalog['dataset'] if isinstance(catalog, dict) else catalog
+    print '%d datasets from %s' % (len(datasets), path)
+    print '%-20s %15s %15s %8s' % ('schema', 'interpreted us', 'compiled us', 'speedup')
+    for variant in sorted(SCHEMA_FILES):
+        interpreted = per_dataset(get_schema_validator(variant, compiled=False), datasets, repeat)
+        compiled = per_dataset(get_schema_validator(variant), datasets, repeat)
+        print '%-20s %15.1f %15.1f %7.1fx' % (variant, interpreted, compiled, interpreted / compiled)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else SAMPLE, int(sys.argv[2]) if len(sys.argv) > 2 else 3)
@@ -0,0 +1,302 @@
+"""
+Downloads the remote catalogs of pending harvest jobs ahead of their gather
+stage.
+
+The gather consumer handles one job at a time, and used to download each
+catalog itself, so a slow agency server held up every job queued behind it.
+The prefetch_catalogs command (see commands.py) downloads the catalogs of all
+the data.json jobs that have not been gathered yet at the same time, a few per
+host and within an optional global bandwidth limit, into a spool directory.
+The gather stage of each job then reads its catalog from there; jobs whose
+catalog is still being downloaded wait for it.
+"""
+import datetime
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import urllib2
+import urlparse
+
+from http_client import download
+
+try:
+    from pylons import config
+except ImportError:
+    # used outside of a CKAN process
+    config = {}
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+DEFAULT_PER_HOST = 2
+# prefetched catalogs nobody has gathered in this many seconds are removed
+DEFAULT_MAX_AGE = 24 * 3600
+# seconds the gather stage waits for a prefetch whose part file stopped
+# growing, longer than a download stalls before it is retried
+DEFAULT_WAIT = 120
+FETCHED_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class CatalogSpool:
+    """
+    Prefetched catalogs, one <job id>.json file per harvest job with its
+    response status, headers and digest in <job id>.meta. The .meta file is
+    written last, so a catalog is complete once it exists. While a catalog is
+    downloaded it is written to <job id>.part.
+    """
+
+    def __init__(self, directory, max_age=DEFAULT_MAX_AGE):
+        self.directory = directory
+        self.max_age = max_age
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # another process created it in the meantime
+                if not os.path.isdir(directory):
+                    raise
+
+    def _path(self, job_id, extension):
+        return os.path.join(self.directory, '%s.%s' % (job_id, extension))
+
+    def open_part(self, job_id):
+        """
+        :param job_id: str
+        :return: file open for writing the catalog of the job
+        """
+        return open(self._path(job_id, 'part'), 'w+b')
+
+    def put(self, job_id, fetch):
+        """
+        Publishes the catalog written to the part file of the job
+        :param job_id: str
+        :param fetch: dict, url, config_digest, headers (the request headers
+            sent), status, etag, last_modified, digest and fetched (datetime)
+        """
+        fetch = dict(fetch, fetched=fetch['fetched'].strftime(FETCHED_FORMAT))
+        if fetch['status'] == 200:
+            os.rename(self._path(job_id, 'part'), self._path(job_id, 'json'))
+        else:
+            self.discard(job_id)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(fetch, f)
+        os.rename(tmp_path, self._path(job_id, 'meta'))
+
+    def discard(self, job_id):
+        for extension in ('part', 'json', 'meta'):
+            try:
+                os.remove(self._path(job_id, extension))
+            except OSError:
+                pass
+
+    def take(self, job_id, wait=None):
+        """
+        Removes the catalog of a job from the spool. Waits for it while it is
+        being downloaded, unless its part file has not grown for wait seconds.
+        :param job_id: str
+        :param wait: float|None, seconds, ckanext.datajson.harvest.prefetch_wait
+            if None
+        :return: (file, dict) the catalog, None for a 304 response, and the
+            fetch passed to put; or None if the job has no catalog
+        """
+        if wait is None:
+            wait = float(config.get('ckanext.datajson.harvest.prefetch_wait', DEFAULT_WAIT))
+        part_path = self._path(job_id, 'part')
+        meta_path = self._path(job_id, 'meta')
+        while not os.path.exists(meta_path):
+            try:
+                idle = time.time() - os.path.getmtime(part_path)
+            except OSError:
+                idle = None
+            # the meta file may have appeared with the part file renamed
+            if os.path.exists(meta_path):
+                break
+            if idle is None or idle > wait:
+                return None
+            time.sleep(min(1, wait))
+
+        try:
+            with open(meta_path) as f:
+                fetch = json.load(f)
+        except (IOError, ValueError) as e:
+            log.warn('Prefetched catalog of job %s is not readable: %s', job_id, e)
+            self.discard(job_id)
+            return None
+        fetch['fetched'] = datetime.datetime.strptime(fetch['fetched'], FETCHED_FORMAT)
+        catalog = None
+        if fetch['status'] == 200:
+            # the open file stays readable once removed
+            catalog = open(self._path(job_id, 'json'), 'rb')
+        self.discard(job_id)
+        return catalog, fetch
+
+    def prune(self):
+        """
+        Removes the files of catalogs older than max_age seconds
+        """
+        cutoff = time.time() - self.max_age
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+class BandwidthLimiter:
+    """
+    Keeps the downloads of all threads together under rate bytes per second,
+    by making each read wait for its share of the time.
+    """
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def __call__(self, size):
+        with self._lock:
+            now = time.time()
+            self._next = max(self._next, now) + size / self.rate
+            delay = self._next - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class FetchScheduler:
+    """
+    Downloads catalogs into a CatalogSpool with a pool of threads, running at
+    most per_host downloads from the same host at a time.
+    """
+
+    def __init__(self, spool, workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST, bandwidth=None, timeout=None):
+        """
+        :param spool: CatalogSpool
+        :param workers: int, downloads running at the same time
+        :param per_host: int, downloads running at the same time per host
+        :param bandwidth: int|None, bytes per second for all downloads together
+        :param timeout: float|None, see http_client.open_url
+        """
+        self.spool = spool
+        self.workers = workers
+        self.per_host = per_host
+        self.throttle = BandwidthLimiter(bandwidth) if bandwidth else None
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._pending = []
+        self._active = {}
+        self._results = {}
+
+    def run(self, fetches):
+        """
+        Downloads the catalogs, returning once they all are done
+        :param fetches: list of dicts, job_id, url, headers and config_digest
+        :return: dict, job id to None or the exception its download failed with
+        """
+        self._pending = list(fetches)
+        self._results = {}
+        threads = [threading.Thread(target=self._work) for _ in range(min(self.workers, len(fetches)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self._results
+
+    def _next(self):
+        # the first pending fetch whose host is not busy, None once all started
+        with self._cond:
+            while self._pending:
+                for index, fetch in enumerate(self._pending):
+                    host = _host(fetch['url'])
+                    if self._active.get(host, 0) < self.per_host:
+                        del self._pending[index]
+                        self._active[host] = self._active.get(host, 0) + 1
+                        return fetch
+                self._cond.wait()
+            return None
+
+    def _work(self):
+        while True:
+            fetch = self._next()
+            if fetch is None:
+                return
+            try:
+                self._results[fetch['job_id']] = self._fetch(fetch)
+            except Exception as e:
+                log.warn('Could not prefetch %s for job %s: %s', fetch['url'], fetch['job_id'], e)
+                self.spool.discard(fetch['job_id'])
+                self._results[fetch['job_id']] = e
+            finally:
+                with self._cond:
+                    self._active[_host(fetch['url'])] -= 1
+                    self._cond.notify_all()
+
+    def _fetch(self, fetch):
+        job_id = fetch['job_id']
+        fetch = dict((key, fetch[key]) for key in ('url', 'headers', 'config_digest'))
+        fetch['fetched'] = datetime.datetime.utcnow()
+        started = time.time()
+        with self.spool.open_part(job_id) as part:
+            try:
+                response, fetch['digest'] = download(fetch['url'], part, fetch['headers'], self.timeout,
+                                                     throttle=self.throttle)
+                fetch['status'] = 200
+                fetch['etag'] = response.info().getheader('ETag')
+                fetch['last_modified'] = response.info().getheader('Last-Modified')
+            except urllib2.HTTPError as e:
+                if e.code != 304:
+                    raise
+                fetch.update(status=304, digest=None, etag=None, last_modified=None)
+        self.spool.put(job_id, fetch)
+        log.info('Prefetched %s for job %s in %.1fs', fetch['url'], job_id, time.time() - started)
+
+
+def _host(url):
+    return (urlparse.urlsplit(url).hostname or '').lower()
+
+
+def get_catalog_spool():
+    directory = config.get('ckanext.datajson.harvest.spool_dir') or \
+        os.path.join(tempfile.gettempdir(), 'ckanext-datajson', 'catalogs')
+    return CatalogSpool(directory)
+
+
+def prefetch_pending_jobs():
+    """
+    Downloads the catalogs of the data.json harvest jobs that are waiting to
+    be gathered
+    :return: dict, job id to None or the exception its download failed with
+    """
+    from ckan import model
+    from ckanext.harvest.model import HarvestJob, HarvestSource
+    from ckanext.datajson.harvester_datajson import DataJsonHarvester
+
+    jobs = model.Session.query(HarvestJob).join(HarvestSource, HarvestJob.source_id == HarvestSource.id) \
+        .filter(HarvestSource.type == u'datajson') \
+        .filter(HarvestSource.active == True) \
+        .filter(HarvestJob.status.in_([u'New', u'Running'])) \
+        .filter(HarvestJob.gather_started == None) \
+        .all()
+
+    harvester = DataJsonHarvester()
+    fetches = []
+    for job in jobs:
+        previous, config_digest, headers = harvester._fetch_plan(job.source)
+        fetches.append({'job_id': job.id, 'url': job.source.url, 'headers': headers,
+                        'config_digest': config_digest})
+    model.Session.remove()
+
+    spool = get_catalog_spool()
+    spool.prune()
+    bandwidth = config.get('ckanext.datajson.harvest.prefetch_bandwidth')
+    scheduler = FetchScheduler(spool,
+                               workers=int(config.get('ckanext.datajson.harvest.prefetch_workers', DEFAULT_WORKERS)),
+                               per_host=int(config.get('ckanext.datajson.harvest.prefetch_per_host', DEFAULT_PER_HOST)),
+                               bandwidth=int(bandwidth) if bandwidth else None)
+    return scheduler.run(fetches)
@@ -0,0 +1,51 @@
+"""
+Collection (isPartOf) bookkeeping of the data.json gather stage.
+"""
+
+
+class CollectionIndex(object):
+    """
+    Which identifiers of a catalog are collections, and how that compares to
+    the datasets harvested before, computed with set operations once per
+    gather so the loop over the catalog only does hashed lookups.
+
+    :ivar existing_parents: dict, identifier to the existing active datasets
+        that are collections
+    :ivar nested: set, collections that are part of another collection
+    :ivar new_parents: set, collections of the catalog not harvested as one yet
+    :ivar demoted: set, existing collections that are no longer one
+    :ivar promoted: set, existing datasets that became collections
+    """
+
+    def __init__(self, parent_identifiers, child_identifiers, existing_datasets):
+        """
+        :param parent_identifiers: set, the isPartOf values of the catalog
+        :param child_identifiers: set, identifiers of the datasets with an isPartOf
+        :param existing_datasets: dict, as returned by _existing_datasets
+        """
+        self.parent_identifiers = parent_identifiers
+        self.child_identifiers = child_identifiers
+        self.existing_parents = dict((identifier, pkg) for identifier, pkg in existing_datasets.iteritems()
+                                     if pkg["collection_metadata"] and pkg["state"] == "active")
+        existing_parent_identifiers = frozenset(self.existing_parents)
+
+        self.nested = parent_identifiers & child_identifiers
+        self.new_parents = parent_identifiers - existing_parent_identifiers
+        self.demoted = existing_parent_identifiers - parent_identifiers
+        self.promoted = set(identifier for identifier in self.new_parents if identifier in existing_datasets)
+        # datasets to update even if their metadata did not change
+        self.role_changed = self.demoted | self.promoted
+
+    def waits_for_parent(self, dataset):
+        """
+        Whether a dataset is part of a collection that has not been harvested yet
+        :param dataset: dict
+        """
+        return dataset.get('isPartOf') in self.new_parents and dataset['identifier'] not in self.parent_identifiers
+
+    def parent_package_id(self, dataset):
+        """
+        Package id of the existing collection a dataset is part of
+        :param dataset: dict
+        """
+        return self.existing_parents[dataset.get('isPartOf')]['id']
@@ -0,0 +1,79 @@
+import sys
+
+from ckan.lib.cli import CkanCommand
+
+
+class DatajsonCommand(CkanCommand):
+    '''
+    Maintenance commands for ckanext-datajson
+
+    Usage:
+
+      datajson rebuild_identifier_index
+        - refills the site wide POD identifier index used to detect
+          duplicate identifiers on export
+
+      datajson create_indexes
+        - creates the indexes the harvest needs on large tables: the one on
+          harvest_object the import stage uses to find the current harvest
+          objects of a dataset, and those for looking up package names by
+          prefix; on PostgreSQL they are built without blocking writes
+
+      datajson prefetch_catalogs
+        - downloads the catalogs of the data.json harvest jobs waiting to be
+          gathered, all at the same time; run it right after
+          `harvester run`, e.g. from the same cron job
+
+    The commands should be run from the ckanext-datajson directory and expect
+    a development.ini file to be present. Most of the time you will
+    specify the config explicitly though::
+
+        paster --plugin=ckanext-datajson datajson rebuild_identifier_index --config=../ckan/development.ini
+    '''
+
+    summary = __doc__.split('\n')[0]
+    usage = __doc__
+    max_args = 1
+    min_args = 0
+
+    def command(self):
+        self._load_config()
+
+        if not self.args:
+            print self.usage
+            sys.exit(1)
+
+        cmd = self.args[0]
+        if cmd == 'rebuild_identifier_index':
+            self.rebuild_identifier_index()
+        elif cmd == 'create_indexes':
+            self.create_indexes()
+        elif cmd == 'prefetch_catalogs':
+            self.prefetch_catalogs()
+        else:
+            print 'Command %s not recognized' % cmd
+            sys.exit(1)
+
+    def rebuild_identifier_index(self):
+        from ckanext.datajson.db import rebuild_identifier_index
+
+        count = rebuild_identifier_index()
+        print '%d packages indexed' % count
+
+    def create_indexes(self):
+        from ckanext.datajson.db import create_indexes
+
+        created = create_indexes()
+        for name in created:
+            print 'index %s created' % name
+        if not created:
+            print 'the indexes exist already'
+
+    def prefetch_catalogs(self):
+        from ckanext.datajson.catalog_prefetch import prefetch_pending_jobs
+
+        results = prefetch_pending_jobs()
+        failed = [job_id for job_id, error in results.items() if error is not None]
+        print '%d catalogs prefetched, %d failed' % (len(results) - len(failed), len(failed))
+        for job_id in failed:
+            print '  job %s: %s' % (job_id, results[job_id])
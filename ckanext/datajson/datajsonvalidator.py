@@ -1,11 +1,16 @@
 import re
 import rfc3987 as rfc3987_url
 
+from jsonstream import JsonStreamParser
+from parse_iso8601 import is_modified, is_temporal, is_issued
+
 # from the iso8601 package, plus ^ and $ on the edges
 ISO8601_REGEX = re.compile(r"^([0-9]{4})(-([0-9]{1,2})(-([0-9]{1,2})"
                            r"((.)([0-9]{2}):([0-9]{2})(:([0-9]{2})(\.([0-9]+))?)?"
                            r"(Z|(([-+])([0-9]{2}):([0-9]{2})))?)?)?)?$")
 
+# the grammar of the modified, temporal and issued checks, which use the
+# equivalent (and linear time) recognizers of parse_iso8601
 TEMPORAL_REGEX_1 = re.compile(
     r'^([\+-]?\d{4}(?!\d{2}\b))((-?)((0[1-9]|1[0-2])(\3([12]\d|0[1-9]|3[01]))?|W([0-4]\d|5[0-2])(-?[1-7])?'
     r'|(00[1-9]|0[1-9]\d|[12]\d{2}|3([0-5]\d|6[1-6])))([T\s]((([01]\d|2[0-3])((:?)[0-5]\d)?|24\:?00)([\.,]'
@@ -55,6 +60,9 @@ ISSUED_REGEX = re.compile(
     r'\d+(?!:))?)?(\17[0-5]\d([\.,]\d+)?)?([zZ]|([\+-])([01]\d|2[0-3]):?([0-5]\d)?)?)?)?$'
 )
 
+# bump whenever the checks below change, it invalidates cached validation results
+RULES_VERSION = '1'
+
 PROGRAM_CODE_REGEX = re.compile(r"^[0-9]{3}:[0-9]{3}$")
 
 IANA_MIME_REGEX = re.compile(r"^[-\w]+/[-\w]+(\.[-\w]+)*([+][-\w]+)?$")
@@ -109,296 +117,354 @@ def do_validation(doc, errors_array, seen_identifiers):
         add_error(errs, 0, "Catalog Is Empty", "There are no entries in your file.")
     else:
         for i, item in enumerate(doc):
-            # Required
+            validate_dataset(item, i, errs, seen_identifiers)
+
+    format_errors(errs, errors_array)
 
-            dataset_name = "dataset %d" % (i + 1)
 
-            # title
-            if check_required_string_field(item, "title", 1, dataset_name, errs):
-                dataset_name = '"%s"' % item.get("title", "").strip()
+def do_incremental_validation(datasets, errors_array, seen_identifiers):
+    """
+    Same checks as do_validation for an iterable of datasets, e.g. one parsed
+    from a stream, so the catalog never has to be in memory as a whole.
+    Returns the number of datasets seen.
+    """
+    errs = {}
+    count = 0
+    for item in datasets:
+        validate_dataset(item, count, errs, seen_identifiers)
+        count += 1
+    if count == 0:
+        add_error(errs, 0, "Catalog Is Empty", "There are no entries in your file.")
 
-            # accessLevel # required
-            if check_required_string_field(item, "accessLevel", 3, dataset_name, errs):
-                if item["accessLevel"] not in ("public", "restricted public", "non-public"):
+    format_errors(errs, errors_array)
+    return count
+
+
+def do_stream_validation(fileobj, errors_array, seen_identifiers):
+    """
+    do_validation for a document read from a stream, parsed and checked one
+    dataset at a time. Reports the same errors as json.load followed by
+    do_validation would: invalid JSON, then anything but an array at the top
+    level, catalog objects included, then the checks of the datasets.
+    Returns the number of datasets seen.
+    """
+    parser = JsonStreamParser(fileobj)
+    state = {'invalid_json': None}
+
+    def datasets():
+        try:
+            for kind, value in parser.events():
+                # datasets of anything but an array are parsed for the
+                # syntax check only
+                if kind == 'dataset' and parser.top_level == '[':
+                    yield value
+        except ValueError as e:
+            state['invalid_json'] = e
+
+    errors = []
+    count = do_incremental_validation(datasets(), errors, seen_identifiers)
+    if state['invalid_json'] is not None:
+        errors = [("Invalid JSON", ["The file does not meet basic JSON syntax requirements: " + unicode(
+            state['invalid_json']) + ". Try using JSONLint.com."])]
+    elif parser.top_level != '[':
+        errs = {}
+        add_error(errs, 0, "Bad JSON Structure",
+                  "The file must be an array at its top level. "
+                  "That means the file starts with an open bracket [ and ends with a close bracket ].")
+        errors = []
+        format_errors(errs, errors)
+    errors_array.extend(errors)
+    return count
+
+
+def validate_dataset(item, i, errs, seen_identifiers):
+    # Required
+
+    dataset_name = "dataset %d" % (i + 1)
+
+    # title
+    if check_required_string_field(item, "title", 1, dataset_name, errs):
+        dataset_name = '"%s"' % item.get("title", "").strip()
+
+    # accessLevel # required
+    if check_required_string_field(item, "accessLevel", 3, dataset_name, errs):
+        if item["accessLevel"] not in ("public", "restricted public", "non-public"):
+            add_error(errs, 5, "Invalid Required Field Value",
+                      "The field 'accessLevel' had an invalid value: \"%s\"" % item["accessLevel"],
+                      dataset_name)
+
+    # bureauCode # required
+    if not is_redacted(item.get('bureauCode')):
+        if check_required_field(item, "bureauCode", list, dataset_name, errs):
+            for bc in item["bureauCode"]:
+                if not isinstance(bc, (str, unicode)):
+                    add_error(errs, 5, "Invalid Required Field Value", "Each bureauCode must be a string",
+                              dataset_name)
+                elif ":" not in bc:
                     add_error(errs, 5, "Invalid Required Field Value",
-                              "The field 'accessLevel' had an invalid value: \"%s\"" % item["accessLevel"],
+                              "The bureau code \"%s\" is invalid. "
+                              "Start with the agency code, then a colon, then the bureau code." % bc,
+                              dataset_name)
+                elif bc not in omb_burueau_codes:
+                    add_error(errs, 5, "Invalid Required Field Value",
+                              "The bureau code \"%s\" was not found in our list "
+                              "(https://project-open-data.cio.gov/data/omb_bureau_codes.csv)." % bc,
                               dataset_name)
 
-            # bureauCode # required
-            if not is_redacted(item.get('bureauCode')):
-                if check_required_field(item, "bureauCode", list, dataset_name, errs):
-                    for bc in item["bureauCode"]:
-                        if not isinstance(bc, (str, unicode)):
-                            add_error(errs, 5, "Invalid Required Field Value", "Each bureauCode must be a string",
-                                      dataset_name)
-                        elif ":" not in bc:
-                            add_error(errs, 5, "Invalid Required Field Value",
-                                      "The bureau code \"%s\" is invalid. "
-                                      "Start with the agency code, then a colon, then the bureau code." % bc,
-                                      dataset_name)
-                        elif bc not in omb_burueau_codes:
-                            add_error(errs, 5, "Invalid Required Field Value",
-                                      "The bureau code \"%s\" was not found in our list "
-                                      "(https://project-open-data.cio.gov/data/omb_bureau_codes.csv)." % bc,
-                                      dataset_name)
-
-            # contactPoint # required
-            if check_required_field(item, "contactPoint", dict, dataset_name, errs):
-                cp = item["contactPoint"]
-                # contactPoint - fn # required
-                check_required_string_field(cp, "fn", 1, dataset_name, errs)
-
-                # contactPoint - hasEmail # required
-                if check_required_string_field(cp, "hasEmail", 9, dataset_name, errs):
-                    if not is_redacted(cp.get('hasEmail')):
-                        email = cp["hasEmail"].replace('mailto:', '')
-                        if not email_validator(email):
-                            add_error(errs, 5, "Invalid Required Field Value",
-                                      "The email address \"%s\" is not a valid email address." % email,
-                                      dataset_name)
-
-            # description # required
-            check_required_string_field(item, "description", 1, dataset_name, errs)
-
-            # identifier #required
-            if check_required_string_field(item, "identifier", 1, dataset_name, errs):
-                if item["identifier"] in seen_identifiers:
+    # contactPoint # required
+    if check_required_field(item, "contactPoint", dict, dataset_name, errs):
+        cp = item["contactPoint"]
+        # contactPoint - fn # required
+        check_required_string_field(cp, "fn", 1, dataset_name, errs)
+
+        # contactPoint - hasEmail # required
+        if check_required_string_field(cp, "hasEmail", 9, dataset_name, errs):
+            if not is_redacted(cp.get('hasEmail')):
+                email = cp["hasEmail"].replace('mailto:', '')
+                if not email_validator(email):
                     add_error(errs, 5, "Invalid Required Field Value",
-                              "The dataset identifier \"%s\" is used more than once." % item["identifier"],
+                              "The email address \"%s\" is not a valid email address." % email,
                               dataset_name)
-                seen_identifiers.add(item["identifier"])
-
-            # keyword # required
-            if isinstance(item.get("keyword"), (str, unicode)):
-                if not is_redacted(item.get("keyword")):
-                    add_error(errs, 5, "Update Your File!",
-                              "The keyword field used to be a string but now it must be an array.", dataset_name)
-            elif check_required_field(item, "keyword", list, dataset_name, errs):
-                for kw in item["keyword"]:
-                    if not isinstance(kw, (str, unicode)):
-                        add_error(errs, 5, "Invalid Required Field Value",
-                                  "Each keyword in the keyword array must be a string", dataset_name)
-                    elif len(kw.strip()) == 0:
-                        add_error(errs, 5, "Invalid Required Field Value",
-                                  "A keyword in the keyword array was an empty string.", dataset_name)
-
-            # modified # required
-            if check_required_string_field(item, "modified", 1, dataset_name, errs):
-                if not is_redacted(item['modified']) \
-                        and not MODIFIED_REGEX_1.match(item['modified']) \
-                        and not MODIFIED_REGEX_2.match(item['modified']) \
-                        and not MODIFIED_REGEX_3.match(item['modified']):
+
+    # description # required
+    check_required_string_field(item, "description", 1, dataset_name, errs)
+
+    # identifier #required
+    if check_required_string_field(item, "identifier", 1, dataset_name, errs):
+        if item["identifier"] in seen_identifiers:
+            add_error(errs, 5, "Invalid Required Field Value",
+                      "The dataset identifier \"%s\" is used more than once." % item["identifier"],
+                      dataset_name)
+        seen_identifiers.add(item["identifier"])
+
+    # keyword # required
+    if isinstance(item.get("keyword"), (str, unicode)):
+        if not is_redacted(item.get("keyword")):
+            add_error(errs, 5, "Update Your File!",
+                      "The keyword field used to be a string but now it must be an array.", dataset_name)
+    elif check_required_field(item, "keyword", list, dataset_name, errs):
+        for kw in item["keyword"]:
+            if not isinstance(kw, (str, unicode)):
+                add_error(errs, 5, "Invalid Required Field Value",
+                          "Each keyword in the keyword array must be a string", dataset_name)
+            elif len(kw.strip()) == 0:
+                add_error(errs, 5, "Invalid Required Field Value",
+                          "A keyword in the keyword array was an empty string.", dataset_name)
+
+    # modified # required
+    if check_required_string_field(item, "modified", 1, dataset_name, errs):
+        if not is_redacted(item['modified']) and not is_modified(item['modified']):
+            add_error(errs, 5, "Invalid Required Field Value",
+                      "The field \"modified\" is not in valid format: \"%s\"" % item['modified'], dataset_name)
+
+    # programCode # required
+    if not is_redacted(item.get('programCode')):
+        if check_required_field(item, "programCode", list, dataset_name, errs):
+            for pc in item["programCode"]:
+                if not isinstance(pc, (str, unicode)):
                     add_error(errs, 5, "Invalid Required Field Value",
-                              "The field \"modified\" is not in valid format: \"%s\"" % item['modified'], dataset_name)
-
-            # programCode # required
-            if not is_redacted(item.get('programCode')):
-                if check_required_field(item, "programCode", list, dataset_name, errs):
-                    for pc in item["programCode"]:
-                        if not isinstance(pc, (str, unicode)):
-                            add_error(errs, 5, "Invalid Required Field Value",
-                                      "Each programCode in the programCode array must be a string", dataset_name)
-                        elif not PROGRAM_CODE_REGEX.match(pc):
-                            add_error(errs, 50, "Invalid Field Value (Optional Fields)",
-                                      "One of programCodes is not in valid format (ex. 018:001): \"%s\"" % pc,
-                                      dataset_name)
-
-            # publisher # required
-            if check_required_field(item, "publisher", dict, dataset_name, errs):
-                # publisher - name # required
-                check_required_string_field(item["publisher"], "name", 1, dataset_name, errs)
-
-            # Required-If-Applicable
-
-            # dataQuality # Required-If-Applicable
-            if item.get("dataQuality") is None or is_redacted(item.get("dataQuality")):
-                pass  # not required or REDACTED
-            elif not isinstance(item["dataQuality"], bool):
-                add_error(errs, 50, "Invalid Field Value (Optional Fields)",
-                          "The field 'dataQuality' must be true or false, "
-                          "as a JSON boolean literal (not the string \"true\" or \"false\").",
-                          dataset_name)
-
-            # distribution # Required-If-Applicable
-            if item.get("distribution") is None:
-                pass  # not required
-            elif not isinstance(item["distribution"], list):
-                if isinstance(item["distribution"], (str, unicode)) and is_redacted(item.get("distribution")):
-                    pass
-                else:
+                              "Each programCode in the programCode array must be a string", dataset_name)
+                elif not PROGRAM_CODE_REGEX.match(pc):
                     add_error(errs, 50, "Invalid Field Value (Optional Fields)",
-                              "The field 'distribution' must be an array, if present.", dataset_name)
-            else:
-                for j, dt in enumerate(item["distribution"]):
-                    if isinstance(dt, (str, unicode)):
-                        if is_redacted(dt):
-                            continue
-                    distribution_name = dataset_name + (" distribution %d" % (j + 1))
-                    # distribution - downloadURL # Required-If-Applicable
-                    check_url_field(False, dt, "downloadURL", distribution_name, errs, allow_redacted=True)
-
-                    # distribution - mediaType # Required-If-Applicable
-                    if 'downloadURL' in dt:
-                        if check_required_string_field(dt, "mediaType", 1, distribution_name, errs):
-                            if not IANA_MIME_REGEX.match(dt["mediaType"]) \
-                                    and not is_redacted(dt["mediaType"]):
-                                add_error(errs, 5, "Invalid Field Value",
-                                          "The distribution mediaType \"%s\" is invalid. "
-                                          "It must be in IANA MIME format." % dt["mediaType"],
-                                          distribution_name)
-
-                    # distribution - accessURL # optional
-                    check_url_field(False, dt, "accessURL", distribution_name, errs, allow_redacted=True)
-
-                    # distribution - conformsTo # optional
-                    check_url_field(False, dt, "conformsTo", distribution_name, errs, allow_redacted=True)
-
-                    # distribution - describedBy # optional
-                    check_url_field(False, dt, "describedBy", distribution_name, errs, allow_redacted=True)
-
-                    # distribution - describedByType # optional
-                    if dt.get("describedByType") is None or is_redacted(dt.get("describedByType")):
-                        pass  # not required or REDACTED
-                    elif not IANA_MIME_REGEX.match(dt["describedByType"]):
-                        add_error(errs, 5, "Invalid Field Value",
-                                  "The describedByType \"%s\" is invalid. "
-                                  "It must be in IANA MIME format." % dt["describedByType"],
-                                  distribution_name)
-
-                    # distribution - description # optional
-                    if dt.get("description") is not None:
-                        check_required_string_field(dt, "description", 1, distribution_name, errs)
-
-                    # distribution - format # optional
-                    if dt.get("format") is not None:
-                        check_required_string_field(dt, "format", 1, distribution_name, errs)
-
-                    # distribution - title # optional
-                    if dt.get("title") is not None:
-                        check_required_string_field(dt, "title", 1, distribution_name, errs)
+                              "One of programCodes is not in valid format (ex. 018:001): \"%s\"" % pc,
+                              dataset_name)
 
-            # license # Required-If-Applicable
-            check_url_field(False, item, "license", dataset_name, errs, allow_redacted=True)
+    # publisher # required
+    if check_required_field(item, "publisher", dict, dataset_name, errs):
+        # publisher - name # required
+        check_required_string_field(item["publisher"], "name", 1, dataset_name, errs)
 
-            # rights # Required-If-Applicable
-            # TODO move to warnings
-            # if item.get("accessLevel") != "public":
-            # check_string_field(item, "rights", 1, dataset_name, errs)
+    # Required-If-Applicable
 
-            # spatial # Required-If-Applicable
-            # TODO: There are more requirements than it be a string.
-            if item.get("spatial") is not None and not isinstance(item.get("spatial"), (str, unicode)):
-                add_error(errs, 50, "Invalid Field Value (Optional Fields)",
-                          "The field 'spatial' must be a string value if specified.", dataset_name)
-
-            # temporal # Required-If-Applicable
-            if item.get("temporal") is None or is_redacted(item.get("temporal")):
-                pass  # not required or REDACTED
-            elif not isinstance(item["temporal"], (str, unicode)):
-                add_error(errs, 10, "Invalid Field Value (Optional Fields)",
-                          "The field 'temporal' must be a string value if specified.", dataset_name)
-            elif "/" not in item["temporal"]:
-                add_error(errs, 10, "Invalid Field Value (Optional Fields)",
-                          "The field 'temporal' must be two dates separated by a forward slash.", dataset_name)
-            elif not TEMPORAL_REGEX_1.match(item['temporal']) \
-                    and not TEMPORAL_REGEX_2.match(item['temporal']) \
-                    and not TEMPORAL_REGEX_3.match(item['temporal']):
-                add_error(errs, 50, "Invalid Field Value (Optional Fields)",
-                          "The field 'temporal' has an invalid start or end date.", dataset_name)
+    # dataQuality # Required-If-Applicable
+    if item.get("dataQuality") is None or is_redacted(item.get("dataQuality")):
+        pass  # not required or REDACTED
+    elif not isinstance(item["dataQuality"], bool):
+        add_error(errs, 50, "Invalid Field Value (Optional Fields)",
+                  "The field 'dataQuality' must be true or false, "
+                  "as a JSON boolean literal (not the string \"true\" or \"false\").",
+                  dataset_name)
 
-            # Expanded Fields
+    # distribution # Required-If-Applicable
+    if item.get("distribution") is None:
+        pass  # not required
+    elif not isinstance(item["distribution"], list):
+        if isinstance(item["distribution"], (str, unicode)) and is_redacted(item.get("distribution")):
+            pass
+        else:
+            add_error(errs, 50, "Invalid Field Value (Optional Fields)",
+                      "The field 'distribution' must be an array, if present.", dataset_name)
+    else:
+        for j, dt in enumerate(item["distribution"]):
+            if isinstance(dt, (str, unicode)):
+                if is_redacted(dt):
+                    continue
+            distribution_name = dataset_name + (" distribution %d" % (j + 1))
+            # distribution - downloadURL # Required-If-Applicable
+            check_url_field(False, dt, "downloadURL", distribution_name, errs, allow_redacted=True)
+
+            # distribution - mediaType # Required-If-Applicable
+            if 'downloadURL' in dt:
+                if check_required_string_field(dt, "mediaType", 1, distribution_name, errs):
+                    if not IANA_MIME_REGEX.match(dt["mediaType"]) \
+                            and not is_redacted(dt["mediaType"]):
+                        add_error(errs, 5, "Invalid Field Value",
+                                  "The distribution mediaType \"%s\" is invalid. "
+                                  "It must be in IANA MIME format." % dt["mediaType"],
+                                  distribution_name)
 
-            # accrualPeriodicity # optional
-            if item.get("accrualPeriodicity") not in ACCRUAL_PERIODICITY_VALUES \
-                    and not is_redacted(item.get("accrualPeriodicity")):
-                add_error(errs, 50, "Invalid Field Value (Optional Fields)",
-                          "The field 'accrualPeriodicity' had an invalid value.", dataset_name)
+            # distribution - accessURL # optional
+            check_url_field(False, dt, "accessURL", distribution_name, errs, allow_redacted=True)
 
-            # conformsTo # optional
-            check_url_field(False, item, "conformsTo", dataset_name, errs, allow_redacted=True)
+            # distribution - conformsTo # optional
+            check_url_field(False, dt, "conformsTo", distribution_name, errs, allow_redacted=True)
 
-            # describedBy # optional
-            check_url_field(False, item, "describedBy", dataset_name, errs, allow_redacted=True)
+            # distribution - describedBy # optional
+            check_url_field(False, dt, "describedBy", distribution_name, errs, allow_redacted=True)
 
-            # describedByType # optional
-            if item.get("describedByType") is None or is_redacted(item.get("describedByType")):
+            # distribution - describedByType # optional
+            if dt.get("describedByType") is None or is_redacted(dt.get("describedByType")):
                 pass  # not required or REDACTED
-            elif not IANA_MIME_REGEX.match(item["describedByType"]):
+            elif not IANA_MIME_REGEX.match(dt["describedByType"]):
                 add_error(errs, 5, "Invalid Field Value",
                           "The describedByType \"%s\" is invalid. "
-                          "It must be in IANA MIME format." % item["describedByType"],
-                          dataset_name)
+                          "It must be in IANA MIME format." % dt["describedByType"],
+                          distribution_name)
+
+            # distribution - description # optional
+            if dt.get("description") is not None:
+                check_required_string_field(dt, "description", 1, distribution_name, errs)
+
+            # distribution - format # optional
+            if dt.get("format") is not None:
+                check_required_string_field(dt, "format", 1, distribution_name, errs)
+
+            # distribution - title # optional
+            if dt.get("title") is not None:
+                check_required_string_field(dt, "title", 1, distribution_name, errs)
+
+    # license # Required-If-Applicable
+    check_url_field(False, item, "license", dataset_name, errs, allow_redacted=True)
+
+    # rights # Required-If-Applicable
+    # TODO move to warnings
+    # if item.get("accessLevel") != "public":
+    # check_string_field(item, "rights", 1, dataset_name, errs)
+
+    # spatial # Required-If-Applicable
+    # TODO: There are more requirements than it be a string.
+    if item.get("spatial") is not None and not isinstance(item.get("spatial"), (str, unicode)):
+        add_error(errs, 50, "Invalid Field Value (Optional Fields)",
+                  "The field 'spatial' must be a string value if specified.", dataset_name)
+
+    # temporal # Required-If-Applicable
+    if item.get("temporal") is None or is_redacted(item.get("temporal")):
+        pass  # not required or REDACTED
+    elif not isinstance(item["temporal"], (str, unicode)):
+        add_error(errs, 10, "Invalid Field Value (Optional Fields)",
+                  "The field 'temporal' must be a string value if specified.", dataset_name)
+    elif "/" not in item["temporal"]:
+        add_error(errs, 10, "Invalid Field Value (Optional Fields)",
+                  "The field 'temporal' must be two dates separated by a forward slash.", dataset_name)
+    elif not is_temporal(item['temporal']):
+        add_error(errs, 50, "Invalid Field Value (Optional Fields)",
+                  "The field 'temporal' has an invalid start or end date.", dataset_name)
+
+    # Expanded Fields
+
+    # accrualPeriodicity # optional
+    if item.get("accrualPeriodicity") not in ACCRUAL_PERIODICITY_VALUES \
+            and not is_redacted(item.get("accrualPeriodicity")):
+        add_error(errs, 50, "Invalid Field Value (Optional Fields)",
+                  "The field 'accrualPeriodicity' had an invalid value.", dataset_name)
+
+    # conformsTo # optional
+    check_url_field(False, item, "conformsTo", dataset_name, errs, allow_redacted=True)
+
+    # describedBy # optional
+    check_url_field(False, item, "describedBy", dataset_name, errs, allow_redacted=True)
+
+    # describedByType # optional
+    if item.get("describedByType") is None or is_redacted(item.get("describedByType")):
+        pass  # not required or REDACTED
+    elif not IANA_MIME_REGEX.match(item["describedByType"]):
+        add_error(errs, 5, "Invalid Field Value",
+                  "The describedByType \"%s\" is invalid. "
+                  "It must be in IANA MIME format." % item["describedByType"],
+                  dataset_name)
 
-            # isPartOf # optional
-            if item.get("isPartOf"):
-                check_required_string_field(item, "isPartOf", 1, dataset_name, errs)
+    # isPartOf # optional
+    if item.get("isPartOf"):
+        check_required_string_field(item, "isPartOf", 1, dataset_name, errs)
+
+    # issued # optional
+    if item.get("issued") is not None and not is_redacted(item.get("issued")):
+        if not is_issued(item['issued']):
+            add_error(errs, 50, "Invalid Field Value (Optional Fields)",
+                      "The field 'issued' is not in a valid format.", dataset_name)
+
+    # landingPage # optional
+    check_url_field(False, item, "landingPage", dataset_name, errs, allow_redacted=True)
+
+    # language # optional
+    if item.get("language") is None or is_redacted(item.get("language")):
+        pass  # not required or REDACTED
+    elif not isinstance(item["language"], list):
+        add_error(errs, 50, "Invalid Field Value (Optional Fields)",
+                  "The field 'language' must be an array, if present.", dataset_name)
+    else:
+        for s in item["language"]:
+            if not LANGUAGE_REGEX.match(s) and not is_redacted(s):
+                add_error(errs, 50, "Invalid Field Value (Optional Fields)",
+                          "The field 'language' had an invalid language: \"%s\"" % s, dataset_name)
+
+    # PrimaryITInvestmentUII # optional
+    if item.get("PrimaryITInvestmentUII") is None or is_redacted(item.get("PrimaryITInvestmentUII")):
+        pass  # not required or REDACTED
+    elif not PRIMARY_IT_INVESTMENT_UII_REGEX.match(item["PrimaryITInvestmentUII"]):
+        add_error(errs, 50, "Invalid Field Value (Optional Fields)",
+                  "The field 'PrimaryITInvestmentUII' must be a string "
+                  "in 023-000000001 format, if present.", dataset_name)
+
+    # references # optional
+    if item.get("references") is None:
+        pass  # not required or REDACTED
+    elif not isinstance(item["references"], list):
+        if isinstance(item["references"], (str, unicode)) and is_redacted(item.get("references")):
+            pass
+        else:
+            add_error(errs, 50, "Invalid Field Value (Optional Fields)",
+                      "The field 'references' must be an array, if present.", dataset_name)
+    else:
+        for s in item["references"]:
+            if not rfc3987_url.match(s) and not is_redacted(s):
+                add_error(errs, 50, "Invalid Field Value (Optional Fields)",
+                          "The field 'references' had an invalid rfc3987 URL: \"%s\"" % s, dataset_name)
 
-            # issued # optional
-            if item.get("issued") is not None and not is_redacted(item.get("issued")):
-                if not ISSUED_REGEX.match(item['issued']):
-                    add_error(errs, 50, "Invalid Field Value (Optional Fields)",
-                              "The field 'issued' is not in a valid format.", dataset_name)
+        if len(item["references"]) != len(set(item["references"])):
+            add_error(errs, 50, "Invalid Field Value (Optional Fields)",
+                      "The field 'references' has duplicates", dataset_name)
 
-            # landingPage # optional
-            check_url_field(False, item, "landingPage", dataset_name, errs, allow_redacted=True)
+    # systemOfRecords # optional
+    check_url_field(False, item, "systemOfRecords", dataset_name, errs, allow_redacted=True)
 
-            # language # optional
-            if item.get("language") is None or is_redacted(item.get("language")):
-                pass  # not required or REDACTED
-            elif not isinstance(item["language"], list):
+    # theme #optional
+    if item.get("theme") is None or is_redacted(item.get("theme")):
+        pass  # not required or REDACTED
+    elif not isinstance(item["theme"], list):
+        add_error(errs, 50, "Invalid Field Value (Optional Fields)", "The field 'theme' must be an array.",
+                  dataset_name)
+    else:
+        for s in item["theme"]:
+            if not isinstance(s, (str, unicode)):
                 add_error(errs, 50, "Invalid Field Value (Optional Fields)",
-                          "The field 'language' must be an array, if present.", dataset_name)
-            else:
-                for s in item["language"]:
-                    if not LANGUAGE_REGEX.match(s) and not is_redacted(s):
-                        add_error(errs, 50, "Invalid Field Value (Optional Fields)",
-                                  "The field 'language' had an invalid language: \"%s\"" % s, dataset_name)
-
-            # PrimaryITInvestmentUII # optional
-            if item.get("PrimaryITInvestmentUII") is None or is_redacted(item.get("PrimaryITInvestmentUII")):
-                pass  # not required or REDACTED
-            elif not PRIMARY_IT_INVESTMENT_UII_REGEX.match(item["PrimaryITInvestmentUII"]):
+                          "Each value in the theme array must be a string", dataset_name)
+            elif len(s.strip()) == 0:
                 add_error(errs, 50, "Invalid Field Value (Optional Fields)",
-                          "The field 'PrimaryITInvestmentUII' must be a string "
-                          "in 023-000000001 format, if present.", dataset_name)
+                          "A value in the theme array was an empty string.", dataset_name)
 
-            # references # optional
-            if item.get("references") is None:
-                pass  # not required or REDACTED
-            elif not isinstance(item["references"], list):
-                if isinstance(item["references"], (str, unicode)) and is_redacted(item.get("references")):
-                    pass
-                else:
-                    add_error(errs, 50, "Invalid Field Value (Optional Fields)",
-                              "The field 'references' must be an array, if present.", dataset_name)
-            else:
-                for s in item["references"]:
-                    if not rfc3987_url.match(s) and not is_redacted(s):
-                        add_error(errs, 50, "Invalid Field Value (Optional Fields)",
-                                  "The field 'references' had an invalid rfc3987 URL: \"%s\"" % s, dataset_name)
-
-                if len(item["references"]) != len(set(item["references"])):
-                    add_error(errs, 50, "Invalid Field Value (Optional Fields)",
-                              "The field 'references' has duplicates", dataset_name)
-
-            # systemOfRecords # optional
-            check_url_field(False, item, "systemOfRecords", dataset_name, errs, allow_redacted=True)
-
-            # theme #optional
-            if item.get("theme") is None or is_redacted(item.get("theme")):
-                pass  # not required or REDACTED
-            elif not isinstance(item["theme"], list):
-                add_error(errs, 50, "Invalid Field Value (Optional Fields)", "The field 'theme' must be an array.",
-                          dataset_name)
-            else:
-                for s in item["theme"]:
-                    if not isinstance(s, (str, unicode)):
-                        add_error(errs, 50, "Invalid Field Value (Optional Fields)",
-                                  "Each value in the theme array must be a string", dataset_name)
-                    elif len(s.strip()) == 0:
-                        add_error(errs, 50, "Invalid Field Value (Optional Fields)",
-                                  "A value in the theme array was an empty string.", dataset_name)
 
+def format_errors(errs, errors_array):
     # Form the output data.
     for err_type in sorted(errs):
         errors_array.append((
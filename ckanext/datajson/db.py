@@ -0,0 +1,403 @@
+import datetime
+import json
+import logging
+
+from sqlalchemy import types, Table, Column, Index, inspect, or_, select
+from sqlalchemy.exc import ProgrammingError, IntegrityError
+
+from ckan import model
+from ckan.model.meta import metadata, Session
+try:
+    from ckanext.harvest import model as harvest_model
+except ImportError:
+    # the export does not need ckanext-harvest
+    harvest_model = None
+
+from helpers import get_export_map_json, get_pod_identifier
+
+log = logging.getLogger(__name__)
+
+identifier_table = None
+source_fetch_table = None
+package_name_table = None
+harvest_object_current_index = None
+package_name_pattern_index = None
+
+_initialized = False
+
+# how long a package name stays reserved for a package that was not created
+NAME_RESERVATION_TTL = datetime.timedelta(hours=1)
+# slugs per query of package_names_in_use
+NAME_QUERY_SLUGS = 100
+
+
+def setup():
+    """
+    Creates the extension's tables if they do not exist yet. Cheap to call
+    more than once. The index on harvest_object is created by
+    create_harvest_object_index, not here.
+    """
+    global _initialized
+    if _initialized:
+        return
+    if identifier_table is None:
+        define_tables()
+
+    if model.package_table.exists():
+        if not identifier_table.exists():
+            identifier_table.create()
+            log.debug('datajson identifier index table created')
+        if not source_fetch_table.exists():
+            source_fetch_table.create()
+            log.debug('datajson source fetch table created')
+        if not package_name_table.exists():
+            package_name_table.create()
+            log.debug('datajson package name table created')
+        _initialized = True
+    else:
+        log.debug('datajson tables creation deferred, CKAN tables do not exist yet')
+
+
+def define_tables():
+    global identifier_table, source_fetch_table, package_name_table, harvest_object_current_index, \
+        package_name_pattern_index
+
+    # POD identifier of every active package, so duplicate identifiers can be
+    # found across organizations without scanning the catalog. The package that
+    # registered an identifier first owns it.
+    identifier_table = Table(
+        'datajson_identifier', metadata,
+        Column('package_id', types.UnicodeText, primary_key=True),
+        Column('identifier', types.UnicodeText, nullable=False),
+        Column('owner_org', types.UnicodeText),
+        Column('created', types.DateTime, default=datetime.datetime.utcnow, nullable=False),
+        Index('idx_datajson_identifier_identifier', 'identifier'),
+    )
+
+    # What the last harvest of a source downloaded, so an unchanged catalog
+    # can be recognized (with a conditional request or its digest) and skipped.
+    source_fetch_table = Table(
+        'datajson_source_fetch', metadata,
+        Column('harvest_source_id', types.UnicodeText, primary_key=True),
+        Column('etag', types.UnicodeText),
+        Column('last_modified', types.UnicodeText),
+        Column('digest', types.UnicodeText),
+        # source configuration and harvester version the catalog was gathered with
+        Column('config_digest', types.UnicodeText),
+        Column('fetched', types.DateTime, default=datetime.datetime.utcnow, nullable=False),
+        # JSON list of the gather errors of the catalog, reported again while it does not change
+        Column('gather_errors', types.UnicodeText),
+    )
+
+    # Names of packages being created by the harvest, reserved so import
+    # workers creating packages with the same title at the same time give
+    # them different names. A reservation is removed once its package is
+    # saved. The names are looked up by prefix, see package_names_in_use.
+    package_name_table = Table(
+        'datajson_package_name', metadata,
+        Column('name', types.UnicodeText, primary_key=True),
+        Column('package_id', types.UnicodeText, nullable=False),
+        Column('reserved', types.DateTime, default=datetime.datetime.utcnow, nullable=False),
+        Index('idx_datajson_package_name_name_pattern', 'name', postgresql_ops={'name': 'text_pattern_ops'}),
+    )
+    package_name_pattern_index = Index('idx_datajson_package_name_pattern', model.package_table.c.name,
+                                       postgresql_ops={'name': 'text_pattern_ops'})
+
+    # Each import flags the harvest objects of its package that are still
+    # current as not current anymore, this finds them without going through
+    # the package's whole harvest history. See create_indexes.
+    if harvest_model is not None and harvest_model.harvest_object_table is not None:
+        harvest_object_table = harvest_model.harvest_object_table
+        harvest_object_current_index = Index(
+            'idx_datajson_harvest_object_package_current',
+            harvest_object_table.c.package_id, harvest_object_table.c.current)
+
+
+def create_indexes():
+    """
+    Creates the indexes the harvest needs on tables that can be large, if
+    they do not exist: on the package_id and current columns of
+    harvest_object, and for looking up package names by prefix. On
+    PostgreSQL they are built CONCURRENTLY, so the site and the harvest can
+    go on writing to the tables meanwhile.
+    :return: list of str, the names of the indexes created
+    """
+    from sqlalchemy.schema import CreateIndex
+
+    if package_name_table is None:
+        define_tables()
+    engine = metadata.bind
+    created = []
+    for index in [harvest_object_current_index, package_name_pattern_index] + list(package_name_table.indexes):
+        if index is None or not index.table.exists():
+            continue
+        if index.name in [existing['name'] for existing in inspect(engine).get_indexes(index.table.name)]:
+            continue
+        if engine.dialect.name == 'postgresql':
+            # CONCURRENTLY cannot run inside a transaction
+            connection = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+            try:
+                sql = unicode(CreateIndex(index).compile(dialect=engine.dialect))
+                connection.execute(sql.replace('CREATE INDEX ', 'CREATE INDEX CONCURRENTLY ', 1))
+            finally:
+                connection.close()
+        else:
+            index.create(engine)
+        log.info('datajson index %s created', index.name)
+        created.append(index.name)
+    return created
+
+
+_export_map = None
+
+
+def _default_export_map():
+    # export.map.json, read once per process
+    global _export_map
+    if _export_map is None:
+        _export_map = get_export_map_json('export.map.json')
+    return _export_map
+
+
+def update_identifier_index(pkg_dict, json_export_map=None):
+    """
+    Records (or forgets) the POD identifier of a package after it was saved
+    :param pkg_dict: dict, CKAN package
+    :param json_export_map: dict, export map used to find the identifier
+    """
+    setup()
+    if json_export_map is None:
+        json_export_map = _default_export_map()
+
+    package_id = pkg_dict.get('id')
+    if not package_id:
+        return
+    identifier = None
+    if pkg_dict.get('state', 'active') == 'active':
+        identifier = get_pod_identifier(pkg_dict, json_export_map)
+
+    row = Session.execute(identifier_table.select().where(
+        identifier_table.c.package_id == package_id)).first()
+    if row and row.identifier == identifier and row.owner_org == pkg_dict.get('owner_org'):
+        return
+    if row:
+        Session.execute(identifier_table.delete().where(identifier_table.c.package_id == package_id))
+    if identifier:
+        values = {
+            'package_id': package_id,
+            'identifier': identifier,
+            'owner_org': pkg_dict.get('owner_org'),
+        }
+        if row and row.identifier == identifier:
+            # only the organization changed, keep the claim on the identifier
+            values['created'] = row.created
+        Session.execute(identifier_table.insert().values(**values))
+
+
+def remove_from_identifier_index(package_ids):
+    """
+    :param package_ids: list of str
+    """
+    setup()
+    if package_ids:
+        Session.execute(identifier_table.delete().where(identifier_table.c.package_id.in_(package_ids)))
+
+
+def identifier_owner(identifier):
+    """
+    The package that owns a POD identifier on this site, i.e. the first one
+    that registered it. Any other package using it is a duplicate.
+    :param identifier: str
+    :return: str|None, package id, None if the identifier is not indexed
+    """
+    setup()
+    try:
+        owner = Session.execute(
+            identifier_table.select()
+            .where(identifier_table.c.identifier == identifier)
+            .order_by(identifier_table.c.created, identifier_table.c.package_id)
+            .limit(1)).first()
+    except ProgrammingError as e:
+        log.error('datajson identifier index is not available: %s', e)
+        Session.rollback()
+        return None
+    return owner.package_id if owner else None
+
+
+def identifier_owners(identifiers):
+    """
+    identifier_owner of many identifiers, with one query
+    :param identifiers: iterable of str
+    :return: dict, identifier to package id, for the indexed identifiers
+    """
+    setup()
+    identifiers = list(set(identifier for identifier in identifiers if identifier))
+    if not identifiers:
+        return {}
+    owners = {}
+    try:
+        rows = Session.execute(
+            select([identifier_table.c.identifier, identifier_table.c.package_id])
+            .where(identifier_table.c.identifier.in_(identifiers))
+            .order_by(identifier_table.c.created, identifier_table.c.package_id))
+        for row in rows:
+            # the first package that registered an identifier owns it
+            owners.setdefault(row.identifier, row.package_id)
+    except ProgrammingError as e:
+        log.error('datajson identifier index is not available: %s', e)
+        Session.rollback()
+    return owners
+
+
+def get_source_fetch(harvest_source_id):
+    """
+    :param harvest_source_id: str
+    :return: row with etag, last_modified, digest, config_digest and
+        gather_errors, or None
+    """
+    setup()
+    return Session.execute(source_fetch_table.select().where(
+        source_fetch_table.c.harvest_source_id == harvest_source_id)).first()
+
+
+def save_source_fetch(harvest_source_id, etag, last_modified, digest, config_digest, fetched, gather_errors=()):
+    """
+    Records what was downloaded for a harvest source
+    :param harvest_source_id: str
+    :param etag: str|None, ETag response header
+    :param last_modified: str|None, Last-Modified response header
+    :param digest: str, digest of the catalog
+    :param config_digest: str, digest of the source configuration
+    :param fetched: datetime, when the download started
+    :param gather_errors: list of str, messages of the gather errors of the
+        catalog
+    """
+    setup()
+    Session.execute(source_fetch_table.delete().where(
+        source_fetch_table.c.harvest_source_id == harvest_source_id))
+    Session.execute(source_fetch_table.insert().values(
+        harvest_source_id=harvest_source_id, etag=etag, last_modified=last_modified, digest=digest,
+        config_digest=config_digest, fetched=fetched, gather_errors=json.dumps(list(gather_errors))))
+    Session.commit()
+
+
+def source_gather_errors(fetch):
+    """
+    :param fetch: row returned by get_source_fetch
+    :return: list of str, the gather error messages saved with it
+    """
+    return json.loads(fetch.gather_errors or '[]')
+
+
+def package_names_in_use(slugs, package_ids=()):
+    """
+    The names of packages and live reservations that are a slug or a slug with
+    a suffix, and the names of some packages. The slugs are looked up
+    NAME_QUERY_SLUGS at a time, by prefix, see create_indexes.
+    :param slugs: iterable of str
+    :param package_ids: iterable of str
+    :return: list of (name, package id, whether it is only reserved)
+    """
+    setup()
+    slugs = sorted(set(slugs))
+    package_ids = list(package_ids)
+    package_table = model.package_table
+    names = []
+    if package_ids:
+        names += [(row.name, row.id, False) for row in Session.execute(
+            select([package_table.c.name, package_table.c.id]).where(package_table.c.id.in_(package_ids)))]
+    for i in range(0, len(slugs), NAME_QUERY_SLUGS):
+        chunk = slugs[i:i + NAME_QUERY_SLUGS]
+
+        def matching(column):
+            # the slugs are made of [a-z0-9-] only, nothing to escape for LIKE
+            return or_(column.in_(chunk), *[column.like(slug + '-%') for slug in chunk])
+
+        names += [(row.name, row.id, False) for row in Session.execute(
+            select([package_table.c.name, package_table.c.id]).where(matching(package_table.c.name)))]
+        names += [(row.name, row.package_id, True) for row in Session.execute(
+            select([package_name_table.c.name, package_name_table.c.package_id])
+            .where(matching(package_name_table.c.name))
+            .where(package_name_table.c.reserved > datetime.datetime.utcnow() - NAME_RESERVATION_TTL))]
+    return names
+
+
+def reserve_package_names(names):
+    """
+    Reserves package names, in transactions of their own so other import
+    workers see them at once. A name reserved by another package and not
+    expired yet is not reserved again.
+    :param names: dict, package name to package id
+    :return: set, the names now reserved for their package
+    """
+    setup()
+    if not names:
+        return set()
+    now = datetime.datetime.utcnow()
+    connection = Session.get_bind().connect()
+    try:
+        with connection.begin():
+            # expired reservations, of packages that were never saved
+            connection.execute(package_name_table.delete()
+                               .where(package_name_table.c.reserved <= now - NAME_RESERVATION_TTL))
+        try:
+            with connection.begin():
+                connection.execute(package_name_table.insert(), [
+                    {'name': name, 'package_id': package_id, 'reserved': now}
+                    for name, package_id in names.iteritems()])
+            return set(names)
+        except IntegrityError:
+            # some are reserved already, one at a time then
+            pass
+        reserved = set()
+        for name, package_id in names.iteritems():
+            try:
+                with connection.begin():
+                    connection.execute(package_name_table.insert().values(
+                        name=name, package_id=package_id, reserved=now))
+                reserved.add(name)
+            except IntegrityError:
+                row = connection.execute(package_name_table.select()
+                                         .where(package_name_table.c.name == name)).first()
+                if row and row.package_id == package_id:
+                    reserved.add(name)
+        return reserved
+    finally:
+        connection.close()
+
+
+def release_package_names(package_ids):
+    """
+    Removes the name reservations of packages that were saved, their names
+    are in the package table now
+    :param package_ids: list of str
+    """
+    setup()
+    if package_ids:
+        Session.execute(package_name_table.delete().where(package_name_table.c.package_id.in_(package_ids)))
+
+
+def rebuild_identifier_index():
+    """
+    Fills the identifier index from all active packages
+    :return: int, number of packages indexed
+    """
+    import ckan.lib.dictization.model_dictize as model_dictize
+
+    setup()
+    json_export_map = get_export_map_json('export.map.json')
+    Session.execute(identifier_table.delete())
+    count = 0
+    query = Session.query(model.Package).filter(model.Package.state == 'active') \
+        .order_by(model.Package.metadata_created)
+    for pkg in query.yield_per(500):
+        pkg_dict = model_dictize.package_dictize(pkg, {'model': model})
+        identifier = get_pod_identifier(pkg_dict, json_export_map)
+        if identifier:
+            # the oldest package keeps the identifier
+            Session.execute(identifier_table.insert().values(
+                package_id=pkg.id, identifier=identifier, owner_org=pkg.owner_org,
+                created=pkg.metadata_created))
+            count += 1
+    Session.commit()
+    return count
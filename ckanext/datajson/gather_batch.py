@@ -0,0 +1,110 @@
+"""
+Bulk creation of the HarvestObjects (and gather errors) of a harvest job.
+
+HarvestObject.save() flushes and commits each object with its extras, which
+costs several round trips per dataset for large sources. GatherBatch collects
+plain rows instead and writes them with one multi-row INSERT per table, in one
+transaction per batch.
+"""
+import datetime
+import logging
+
+from pylons import config
+
+from ckan.model import Session
+from ckan.model.types import make_uuid
+from ckanext.harvest.model import harvest_object_table, harvest_object_extra_table, harvest_gather_error_table
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def gather_batch_size():
+    return int(config.get('ckanext.datajson.harvest.gather_batch_size', DEFAULT_BATCH_SIZE))
+
+
+class GatherBatch(object):
+    """
+    Collects the HarvestObjects created by a gather stage and inserts them
+    every batch_size objects. Call flush() once gathering is done.
+    """
+
+    def __init__(self, harvest_job, batch_size=None):
+        self.harvest_job = harvest_job
+        self.batch_size = batch_size or gather_batch_size()
+        self.object_ids = []
+        self._objects = []
+        self._extras = []
+        self._errors = []
+
+    def add_object(self, guid, content=None, package_id=None, extras=None):
+        """
+        Queues a HarvestObject for the job
+        :param guid: str
+        :param content: str|None, the dataset's metadata
+        :param package_id: str|None
+        :param extras: list of (key, value) pairs for its HarvestObjectExtras
+        :return: str, the id of the HarvestObject
+        """
+        object_id = make_uuid()
+        self._objects.append({
+            'id': object_id,
+            'guid': guid,
+            'content': content,
+            'package_id': package_id,
+            'harvest_job_id': self.harvest_job.id,
+            'harvest_source_id': self.harvest_job.source_id,
+            'gathered': datetime.datetime.utcnow(),
+            'current': False,
+            'state': u'WAITING',
+        })
+        for key, value in extras or []:
+            self._extras.append({
+                'id': make_uuid(),
+                'harvest_object_id': object_id,
+                'key': key,
+                'value': value,
+            })
+        self.object_ids.append(object_id)
+        if len(self._objects) >= self.batch_size:
+            self.flush()
+        return object_id
+
+    def add_error(self, message):
+        """
+        Queues a gather error for the job, like HarvesterBase._save_gather_error
+        :param message: str
+        """
+        log.error('Error gathering job %s: %s' % (self.harvest_job.id, message))
+        self._errors.append({
+            'id': make_uuid(),
+            'harvest_job_id': self.harvest_job.id,
+            'message': message,
+            'created': datetime.datetime.utcnow(),
+        })
+        if len(self._errors) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Inserts the queued rows in one transaction
+        """
+        if not (self._objects or self._errors):
+            return
+        try:
+            if self._objects:
+                Session.execute(harvest_object_table.insert(), self._objects)
+            if self._extras:
+                Session.execute(harvest_object_extra_table.insert(), self._extras)
+            if self._errors:
+                Session.execute(harvest_gather_error_table.insert(), self._errors)
+            Session.commit()
+        except Exception:
+            Session.rollback()
+            raise
+        log.debug('Inserted %d harvest objects and %d gather errors for job %s',
+                  len(self._objects), len(self._errors), self.harvest_job.id)
+        self._objects = []
+        self._extras = []
+        self._errors = []
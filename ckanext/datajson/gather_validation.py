@@ -0,0 +1,101 @@
+"""
+Optional validation of datasets in the gather stage.
+
+Invalid datasets are otherwise only found in the import stage, after their
+HarvestObject has been written, queued and fetched. Validating them while
+gathering costs the same schema checks, but done in a pool of worker
+processes, and an invalid dataset only leaves its gather error behind.
+"""
+import logging
+import multiprocessing
+
+from pylons import config
+from paste.deploy.converters import asbool
+
+log = logging.getLogger(__name__)
+
+# datasets handed to the workers at a time
+CHUNK_SIZE = 500
+
+
+def gather_validation_enabled(source_config):
+    """
+    :param source_config: dict, the configuration of the harvest source
+    :return: bool, its gather_validation setting, or else
+        ckanext.datajson.harvest.gather_validation
+    """
+    if 'gather_validation' in source_config:
+        return asbool(source_config['gather_validation'])
+    return asbool(config.get('ckanext.datajson.harvest.gather_validation', False))
+
+
+class PreValidator(object):
+    """
+    Validates datasets in chunks with a pool of processes, keeping their
+    order. Call add() for each dataset and finish() once they are all added,
+    both return the (item, message) pairs of the chunks done so far; an empty
+    message means the dataset is valid. close() stops the pool. The workers
+    only run function, they never use the connections of the gather process.
+    """
+
+    def __init__(self, function, args, processes=None, chunk_size=CHUNK_SIZE):
+        """
+        :param function: module level function called with args + (content,),
+            returning the validation message
+        :param args: tuple
+        :param processes: int|None, ckanext.datajson.harvest.validation_processes,
+            or one per CPU, if None
+        :param chunk_size: int
+        """
+        self.function = function
+        self.args = tuple(args)
+        self.chunk_size = chunk_size
+        self.processes = processes or int(config.get('ckanext.datajson.harvest.validation_processes',
+                                                     multiprocessing.cpu_count()))
+        self.checked = 0
+        self.invalid = 0
+        self._pool = None
+        self._items = []
+        self._tasks = []
+
+    def add(self, content, item):
+        """
+        :param content: str, the JSON of the dataset
+        :param item: anything, returned with the message
+        :return: list of (item, message)
+        """
+        self._items.append(item)
+        self._tasks.append(self.args + (content,))
+        if len(self._tasks) >= self.chunk_size:
+            return self._run()
+        return []
+
+    def finish(self):
+        return self._run()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    @property
+    def validity_rate(self):
+        return float(self.checked - self.invalid) / self.checked if self.checked else 1.0
+
+    def _run(self):
+        if not self._tasks:
+            return []
+        if self.processes > 1 and len(self._tasks) > 1:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.processes)
+            messages = self._pool.map(self.function, self._tasks,
+                                      chunksize=max(1, len(self._tasks) // (self.processes * 4)))
+        else:
+            messages = map(self.function, self._tasks)
+        results = zip(self._items, messages)
+        self.checked += len(results)
+        self.invalid += len([message for message in messages if message])
+        self._items = []
+        self._tasks = []
+        return results
@@ -1,27 +1,56 @@
 from ckan.lib.base import c
 from ckan import model
 from ckan import plugins as p
-from ckan.model import Session, Package
+from ckan.model import Session, Package, PackageExtra
+from ckan.model.types import make_uuid
 from ckan.logic import ValidationError, NotFound, get_action
-from ckan.lib.munge import munge_title_to_name
-from ckan.lib.search.index import PackageSearchIndex
+from ckan.lib.search.common import make_connection
+from ckan.lib.search.index import TYPE_FIELD, PACKAGE_TYPE
 from ckan.lib.navl.dictization_functions import Invalid
 from ckan.lib.navl.validators import ignore_empty
 
 from ckanext.harvest.model import HarvestJob, HarvestObject, HarvestGatherError, \
-                                    HarvestObjectError, HarvestObjectExtra
+                                    HarvestObjectError, HarvestObjectExtra, \
+                                    harvest_object_table, harvest_object_extra_table
 from ckanext.harvest.harvesters.base import HarvesterBase
+from pylons import config
 
-import uuid, datetime, hashlib, urllib2, json, yaml, json, os
+import uuid, datetime, hashlib, urllib2, json, yaml, json, os, tempfile, time
+from collections import OrderedDict
 
-from jsonschema.validators import Draft4Validator
-from jsonschema import FormatChecker
+from ckanext.datajson.collection_index import CollectionIndex
+from ckanext.datajson.gather_batch import GatherBatch
+from ckanext.datajson.package_names import PackageNameAllocator
+from ckanext.datajson.gather_validation import PreValidator, gather_validation_enabled
+from ckanext.datajson.db import remove_from_identifier_index, release_package_names
+from ckanext.datajson.resource_index import ResourceIndex, resource_unchanged
+from ckanext.datajson.schema_validators import schema_variant, get_schema_validator, schema_fingerprint, readable_error
+from ckanext.datajson.validation_cache import cached_result
 
+from sqlalchemy import and_, bindparam
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
 
 import logging
 log = logging.getLogger("harvester")
 
+# packages per UPDATE and per search index commit when deleting
+DELETE_BATCH_SIZE = 500
+# HarvestObjectExtra holding the state of an object imported by another one's batch
+BATCH_RESULT_KEY = 'import_batch_result'
+# after this long, an object whose batch has not recorded a result is imported on its own
+BATCH_CLAIM_TIMEOUT = datetime.timedelta(minutes=30)
+# jobs whose JobContext is kept, the fetch consumer can import objects of several
+JOB_CONTEXTS = 4
+
+
+def import_batch_size():
+    """
+    HarvestObjects imported together by import_stage, 1 to import them one
+    at a time
+    """
+    return int(config.get('ckanext.datajson.harvest.import_batch_size', 1))
+
 VALIDATION_SCHEMA = [
                         ('', 'Project Open Data (Federal)'),
                         ('non-federal', 'Project Open Data (Non-Federal)'),
@@ -32,11 +61,286 @@ def validate_schema(schema):
         raise Invalid('Unknown validation schema: {0}'.format(schema))
     return schema
 
+class SpooledCatalog(object):
+    '''
+    The datasets of a remote catalog, read once from the events of
+    load_remote_catalog and kept in a temporary file, one JSON line each.
+    Only the catalog's header fields and the identifiers involved in
+    collections are held in memory.
+    '''
+
+    def __init__(self, events):
+        self.catalog_values = None
+        self.parent_identifiers = set()
+        self.child_identifiers = set()
+        self._count = 0
+        self._file = tempfile.TemporaryFile()
+        try:
+            for kind, value in events:
+                if kind == 'catalog':
+                    self.catalog_values = {}
+                elif kind == 'header':
+                    if self.catalog_values is None:
+                        self.catalog_values = {}
+                    self.catalog_values[value[0]] = value[1]
+                elif kind == 'dataset':
+                    self._add(value)
+        except:
+            self._file.close()
+            raise
+
+    def _add(self, dataset):
+        parent_identifier = dataset.get('isPartOf')
+        if parent_identifier:
+            self.parent_identifiers.add(parent_identifier)
+            self.child_identifiers.add(dataset.get('identifier'))
+        # use sort_keys to preserve field order so hashes of this string are constant from run to run
+        self._file.write(json.dumps(dataset, sort_keys=True) + '\n')
+        self._count += 1
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        # (dataset, its JSON) pairs, in catalog order
+        self._file.seek(0)
+        for line in self._file:
+            content = line.rstrip('\n')
+            yield json.loads(content), content
+
+    def close(self):
+        self._file.close()
+
+
+MAPPING = {
+    "title": "title",
+    "description": "notes",
+    "keyword": "tags",
+    "modified": "extras__modified", # ! revision_timestamp
+    "publisher": "extras__publisher", # !owner_org
+    "contactPoint": "maintainer",
+    "mbox": "maintainer_email",
+    "identifier": "extras__identifier", # !id
+    "accessLevel": "extras__accessLevel",
+
+    "bureauCode": "extras__bureauCode",
+    "programCode": "extras__programCode",
+    "accessLevelComment": "extras__accessLevelComment",
+    "license": "extras__license", # !license_id 
+    "spatial": "extras__spatial", # Geometry not valid GeoJSON, not indexing
+    "temporal": "extras__temporal",
+
+    "theme": "extras__theme",
+    "dataDictionary": "extras__dataDictionary", # !data_dict
+    "dataQuality": "extras__dataQuality",
+    "accrualPeriodicity":"extras__accrualPeriodicity",
+    "landingPage": "extras__landingPage",
+    "language": "extras__language",
+    "primaryITInvestmentUII": "extras__primaryITInvestmentUII", # !PrimaryITInvestmentUII
+    "references": "extras__references",
+    "issued": "extras__issued",
+    "systemOfRecords": "extras__systemOfRecords",
+
+    "accessURL": None,
+    "webService": None,
+    "format": None,
+    "distribution": None,
+}
+
+MAPPING_V1_1 = {
+    "title": "title",
+    "description": "notes",
+    "keyword": "tags",
+    "modified": "extras__modified", # ! revision_timestamp
+    "publisher": "extras__publisher", # !owner_org
+    "contactPoint": {"fn":"maintainer", "hasEmail":"maintainer_email"},
+    "identifier": "extras__identifier", # !id
+    "accessLevel": "extras__accessLevel",
+
+    "bureauCode": "extras__bureauCode",
+    "programCode": "extras__programCode",
+    "rights": "extras__rights",
+    "license": "extras__license", # !license_id
+    "spatial": "extras__spatial", # Geometry not valid GeoJSON, not indexing
+    "temporal": "extras__temporal",
+
+    "theme": "extras__theme",
+    "dataDictionary": "extras__dataDictionary", # !data_dict
+    "dataQuality": "extras__dataQuality",
+    "accrualPeriodicity":"extras__accrualPeriodicity",
+    "landingPage": "extras__landingPage",
+    "language": "extras__language",
+    "primaryITInvestmentUII": "extras__primaryITInvestmentUII", # !PrimaryITInvestmentUII
+    "references": "extras__references",
+    "issued": "extras__issued",
+    "systemOfRecords": "extras__systemOfRecords",
+
+    "distribution": None,
+}
+
+SKIP = frozenset([
+    "accessURL", "webService", "format", "distribution", # will go into pkg["resources"]
+    # also skip the processed_how key, it was added to indicate how we processed the dataset.
+    "processed_how",
+])
+
+SKIP_V1_1 = frozenset(["@type", "isPartOf", "distribution", "processed_how"])
+
+# the 1.0 tables for federal catalogs, whose keys are lowercased, built once
+MAPPING_LOWERCASE = dict((k.lower(), v) for k, v in MAPPING.items())
+SKIP_LOWERCASE = frozenset(k.lower() for k in SKIP)
+
+
+def process_dataset(dataset, schema_version, validator_schema):
+    """
+    The dataset as it is validated and imported: the keys of version 1.0
+    federal catalogs are lowercased.
+    :param dataset: dict
+    :param schema_version: str, '1.0' or '1.1'
+    :param validator_schema: str|None, the source's validator_schema setting
+    :return: (dict, dict, frozenset), the processed dataset, the mapping of
+        its keys to package fields and the keys that are not mapped
+    """
+    if schema_version == '1.0' and validator_schema != 'non-federal':
+        lowercase_conversion = True
+    else:
+        lowercase_conversion = False
+
+    if lowercase_conversion:
+
+        mapping_processed = MAPPING_LOWERCASE
+        skip_processed = SKIP_LOWERCASE
+
+        dataset_processed = {'processed_how': ['lowercase']}
+        for k,v in dataset.items():
+          if k.lower() in mapping_processed:
+            dataset_processed[k.lower()] = v
+          else:
+            dataset_processed[k] = v
+
+        if 'distribution' in dataset and dataset['distribution'] is not None:
+          dataset_processed['distribution'] = []
+          for d in dataset['distribution']:
+            d_lower = {}
+            for k,v in d.items():
+              if k.lower() in mapping_processed:
+                d_lower[k.lower()] = v
+              else:
+                d_lower[k] = v
+            dataset_processed['distribution'].append(d_lower)
+    else:
+        dataset_processed = dataset
+        mapping_processed = MAPPING
+        skip_processed = SKIP
+
+    if schema_version == '1.1':
+        mapping_processed = MAPPING_V1_1
+        skip_processed = SKIP_V1_1
+    return dataset_processed, mapping_processed, skip_processed
+
+
+def validation_message(validator_schema, schema_version, dataset):
+    """
+    The schema errors of a processed dataset, see process_dataset
+    :param validator_schema: str|None, the source's validator_schema setting
+    :param schema_version: str, '1.0' or '1.1'
+    :param dataset: dict
+    :return: str, empty if the dataset is valid
+    """
+    variant = schema_variant(validator_schema, schema_version)
+
+    def validate():
+        msg = ";"
+        errors = get_schema_validator(variant).iter_errors(dataset)
+        count = 0
+        for error in errors:
+            count += 1
+            msg = msg + " ### ERROR #" + str(count) + ": " + readable_error(error) + "; "
+        msg = msg.strip("; ")
+        if msg:
+            id = "Identifier: " + (dataset.get("identifier") if dataset.get("identifier") else "Unknown")
+            title = "Title: " + (dataset.get("title") if dataset.get("title") else "Unknown")
+            msg = id + "; " + title + "; " + str(count) + " Error(s) Found. " + msg + "."
+        return msg
+
+    # the same entry is validated again on every harvest, skip it when its bytes have not changed
+    return cached_result(dataset, '%s@%s' % (variant, schema_fingerprint(variant)), validate)
+
+
+def prevalidate(args):
+    """
+    validation_message of a dataset as stored in a HarvestObject, for
+    gather_validation.PreValidator
+    :param args: tuple, validator_schema, schema_version and the dataset's JSON
+    :return: str
+    """
+    validator_schema, schema_version, content = args
+    dataset = process_dataset(json.loads(content), schema_version, validator_schema)[0]
+    return validation_message(validator_schema, schema_version, dataset)
+
+
+class JobContext(object):
+    """
+    What importing the HarvestObjects of a job takes from its harvest source,
+    read once for all of them.
+
+    :ivar source_config: dict, the source configuration parsed as JSON
+    :ivar defaults: dict, the defaults of load_config
+    :ivar validator_schema: str|None
+    :ivar owner_org: str|None, organization of the harvest source
+    :ivar default_group: str, name of the group of the datasets
+    """
+    # ids of the collection packages of the source, loaded when first needed
+    _collection_ids = None
+
+    def __init__(self, source, config):
+        """
+        :param source: HarvestSource
+        :param config: dict, as returned by load_config
+        """
+        self.source_id = source.id
+        self.source_config = json.loads(source.config or '{}')
+        self.defaults = config["defaults"]
+        self.validator_schema = self.source_config.get('validator_schema')
+        self.default_group = self.source_config.get('default_groups', '')
+        # We need to get the owner organization (if any) from the harvest
+        # source dataset
+        source_dataset = model.Package.get(source.id)
+        self.owner_org = source_dataset.owner_org or None
+
+    def collection_exists(self, package_id):
+        """
+        Whether the collection package a dataset is part of exists. The
+        collections of the source are loaded with one query, any other
+        package is looked up on its own.
+        :param package_id: str
+        """
+        if self._collection_ids is None:
+            query = model.Session.query(Package.id) \
+                .join(HarvestObject, HarvestObject.package_id == Package.id) \
+                .join(PackageExtra, and_(PackageExtra.package_id == Package.id,
+                                         PackageExtra.key == "collection_metadata",
+                                         PackageExtra.state == "active")) \
+                .filter(HarvestObject.harvest_source_id == self.source_id) \
+                .filter(HarvestObject.current == True)
+            self._collection_ids = set(row[0] for row in query)
+        if package_id not in self._collection_ids:
+            # not a collection of this source (yet), missing ones are looked up again
+            if model.Session.query(Package.id).filter(Package.id == package_id).first() is None:
+                return False
+            self._collection_ids.add(package_id)
+        return True
+
+
 class DatasetHarvesterBase(HarvesterBase):
     '''
     A Harvester for datasets.
     '''
     _user_name = None
+    # names of the packages the current batch import creates
+    _package_names = None
+    # JobContext of the latest jobs imported, by job id
+    _job_contexts = None
 
     # SUBCLASSES MUST IMPLEMENT
     #HARVESTER_VERSION = "1.0"
@@ -82,6 +386,21 @@ class DatasetHarvesterBase(HarvesterBase):
 
         return ret
 
+    def job_context(self, harvest_object):
+        """
+        :param harvest_object: HarvestObject
+        :return: JobContext of its job
+        """
+        if self._job_contexts is None:
+            self._job_contexts = OrderedDict()
+        job_context = self._job_contexts.get(harvest_object.harvest_job_id)
+        if job_context is None:
+            job_context = JobContext(harvest_object.source, self.load_config(harvest_object.source))
+            self._job_contexts[harvest_object.harvest_job_id] = job_context
+            while len(self._job_contexts) > JOB_CONTEXTS:
+                self._job_contexts.popitem(last=False)
+        return job_context
+
     def _get_user_name(self):
         if not self._user_name:
             user = p.toolkit.get_action('get_site_user')({'model': model, 'ignore_auth': True}, {})
@@ -99,9 +418,14 @@ class DatasetHarvesterBase(HarvesterBase):
         
     # SUBCLASSES MUST IMPLEMENT
     def load_remote_catalog(self, harvest_job):
-        # Loads a remote data catalog. This function must return a JSON-able
-        # list of dicts, each dict a dataset containing an 'identifier' field
-        # with a locally unique identifier string and a 'title' field.
+        # Loads a remote data catalog. This function must return an iterable
+        # of (kind, value) events, read as the catalog is downloaded:
+        #   ('catalog', None) first, if the catalog is an object (POD 1.1)
+        #     rather than a bare list of datasets,
+        #   ('header', (key, value)) for the catalog object's other fields,
+        #   ('dataset', dict) for each dataset, containing an 'identifier'
+        #     field with a locally unique identifier string and a 'title' field.
+        # ValueError is reported as a gather error.
         raise Exception("Not implemented")
 
     def extra_schema(self):
@@ -117,12 +441,19 @@ class DatasetHarvesterBase(HarvesterBase):
 
         # Start gathering.
         try:
-            source_datasets, catalog_values = self.load_remote_catalog(harvest_job)
+            source_datasets = SpooledCatalog(self.load_remote_catalog(harvest_job))
         except ValueError as e:
             self._save_gather_error("Error loading json content: %s." % (e), harvest_job)
             return []
 
+        try:
+            return self._gather_datasets(harvest_job, source_datasets)
+        finally:
+            source_datasets.close()
+
+    def _gather_datasets(self, harvest_job, source_datasets):
         if len(source_datasets) == 0: return []
+        catalog_values = source_datasets.catalog_values
 
         DATAJSON_SCHEMA = {
             "https://project-open-data.cio.gov/v1.1/schema": '1.1',
@@ -135,18 +466,15 @@ class DatasetHarvesterBase(HarvesterBase):
         catalog_extras = {}
         if isinstance(catalog_values, dict):
             schema_value = catalog_values.get('conformsTo', '')
-            if schema_value not in DATAJSON_SCHEMA.keys():
+            if schema_value not in DATAJSON_SCHEMA:
                 self._save_gather_error('Error reading json schema value.' \
                     ' The given value is %s.' % ('empty' if schema_value == ''
                     else schema_value), harvest_job)
                 return []
             schema_version = DATAJSON_SCHEMA.get(schema_value, '1.0')
 
-            for dataset in source_datasets:
-                parent_identifier = dataset.get('isPartOf')
-                if parent_identifier:
-                    parent_identifiers.add(parent_identifier)
-                    child_identifiers.add(dataset.get('identifier'))
+            parent_identifiers = source_datasets.parent_identifiers
+            child_identifiers = source_datasets.child_identifiers
 
             # get a list of needed catalog values and put into hobj
             catalog_fields = ['@context', '@id', 'conformsTo', 'describedBy']
@@ -154,52 +482,31 @@ class DatasetHarvesterBase(HarvesterBase):
                 for (k, v) in catalog_values.iteritems()
                 if k in catalog_fields)
 
-        # Loop through the packages we've already imported from this source
-        # and go into their extra fields to get their source_identifier,
-        # which corresponds to the remote catalog's 'identifier' field.
-        # Make a mapping so we know how to update existing records.
-        # Added: mark all existing parent datasets.
-        existing_datasets = { }
-        existing_parents = { }
-        for hobj in model.Session.query(HarvestObject).filter_by(source=harvest_job.source, current=True):
-            try:
-                pkg = get_action('package_show')(self.context(), { "id": hobj.package_id })
-            except:
-                # reference is broken
-                continue
-            sid = self.find_extra(pkg, "identifier")
-            is_parent = self.find_extra(pkg, "collection_metadata")
-            if sid:
-                existing_datasets[sid] = pkg
-            if is_parent and pkg.get("state") == "active":
-                existing_parents[sid] = pkg
-
-        # which parent has been demoted to child level?
-        existing_parents_demoted = set(
-            identifier for identifier in existing_parents.keys() \
-            if identifier not in parent_identifiers)
-
-        # which dataset has been promoted to parent level?
-        existing_datasets_promoted = set(
-                identifier for identifier in existing_datasets.keys() \
-                if identifier in parent_identifiers \
-                and identifier not in existing_parents.keys())
+        # Look up the packages we've already imported from this source and
+        # their source_identifier, which corresponds to the remote catalog's
+        # 'identifier' field. Make a mapping so we know how to update existing
+        # records.
+        # Added: mark all existing parent datasets, and which of them have
+        # been demoted to child level or promoted to parent level.
+        existing_datasets = self._existing_datasets(harvest_job.source)
+        collections = CollectionIndex(parent_identifiers, child_identifiers, existing_datasets)
+        new_parents = collections.new_parents
 
         # if there is any new parents, we will have to harvest parents
         # first, mark the status in harvest_source config, which
         # triggers a children harvest_job after parents job is finished.
         source = harvest_job.source
         source_config = json.loads(source.config or '{}')
+        # HarvestObjects and gather errors are inserted in batches
+        batch = GatherBatch(harvest_job)
         # run status: None, or parents_run, or children_run?
         run_status = source_config.get('datajson_collection')
         if parent_identifiers:
-            for parent in parent_identifiers & child_identifiers:
-                self._save_gather_error("Collection identifier '%s' \
+            for parent in collections.nested:
+                batch.add_error("Collection identifier '%s' \
                     cannot be isPartOf another collection." \
-                    % parent, harvest_job)
+                    % parent)
 
-            new_parents = set(identifier for identifier in parent_identifiers \
-                if identifier not in existing_parents.keys())
             if new_parents:
                 if not run_status:
                     # fresh start
@@ -211,12 +518,11 @@ class DatasetHarvesterBase(HarvesterBase):
                     # it means new parents are tried and failed.
                     # but skip some which have previously reported with
                     # parent_identifiers & child_identifiers
-                    for parent in new_parents - \
-                        (parent_identifiers & child_identifiers):
-                        self._save_gather_error("Collection identifier '%s' \
+                    for parent in new_parents - collections.nested:
+                        batch.add_error("Collection identifier '%s' \
                             not found. Records which are part of this \
                             collection will not be harvested." \
-                            % parent, harvest_job)
+                            % parent)
                 else:
                     # run_status was parents_run, and did not finish.
                     # something wrong but not sure what happened.
@@ -234,110 +540,219 @@ class DatasetHarvesterBase(HarvesterBase):
                     
         # Create HarvestObjects for any records in the remote catalog.
             
-        object_ids = []
         seen_datasets = set()
         unique_datasets = set()
         
         filters = self.load_config(harvest_job.source)["filters"]
 
-        for dataset in source_datasets:
-            # Create a new HarvestObject for this dataset and save the
-            # dataset metdata inside it for later.
-
-            # Check the config's filters to see if we should import this dataset.
-            # For each filter, check that the value specified in the data.json file
-            # is among the permitted values in the filter specification.
-            matched_filters = True
-            for k, v in filters.items():
-                if dataset.get(k) not in v:
-                    matched_filters = False
-            if not matched_filters:
-                continue
+        # optionally validate the datasets now, so invalid ones get no HarvestObject
+        prevalidator = None
+        if gather_validation_enabled(source_config):
+            prevalidator = PreValidator(prevalidate, (source_config.get('validator_schema'), schema_version))
 
-            if parent_identifiers and new_parents \
-                and dataset['identifier'] not in parent_identifiers \
-                and dataset.get('isPartOf') in new_parents:
-                if run_status == 'parents_run':
-                    # skip those whose parents still need to run.
+        def add_object(obj, message=None):
+            if message:
+                batch.add_error(message)
+            else:
+                batch.add_object(**obj)
+
+        # the pool of the prevalidator must not outlive the gather, which runs
+        # in the long lived gather consumer
+        try:
+            for dataset, content in source_datasets:
+                # Create a new HarvestObject for this dataset and save the
+                # dataset metdata inside it for later.
+
+                # Check the config's filters to see if we should import this dataset.
+                # For each filter, check that the value specified in the data.json file
+                # is among the permitted values in the filter specification.
+                matched_filters = True
+                for k, v in filters.items():
+                    if dataset.get(k) not in v:
+                        matched_filters = False
+                if not matched_filters:
                     continue
-                else:
-                    # which is 'children_run'.
-                    # error out since parents got issues.
-                    self._save_gather_error(
-                        "Record with identifier '%s': isPartOf '%s' points to \
+
+                if collections.waits_for_parent(dataset):
+                    if run_status == 'parents_run':
+                        # skip those whose parents still need to run.
+                        continue
+                    else:
+                        # which is 'children_run'.
+                        # error out since parents got issues.
+                        batch.add_error(
+                            "Record with identifier '%s': isPartOf '%s' points to \
                         an erroneous record." % (dataset['identifier'],
-                            dataset.get('isPartOf')), harvest_job)
-                    continue
+                                dataset.get('isPartOf')))
+                        continue
 
-            # Some source contains duplicate identifiers. skip all except the first one
-            if dataset['identifier'] in unique_datasets:
-                self._save_gather_error("Duplicate entry ignored for identifier: '%s'." % (dataset['identifier']), harvest_job)
-                continue
-            unique_datasets.add(dataset['identifier'])
+                # Some source contains duplicate identifiers. skip all except the first one
+                if dataset['identifier'] in unique_datasets:
+                    batch.add_error("Duplicate entry ignored for identifier: '%s'." % (dataset['identifier']))
+                    continue
+                unique_datasets.add(dataset['identifier'])
             
-            # Get the package_id of this resource if we've already imported
-            # it into our system. Otherwise, assign a brand new GUID to the
-            # HarvestObject. I'm not sure what the point is of that.
+                # Get the package_id of this resource if we've already imported
+                # it into our system. Otherwise, assign a brand new GUID to the
+                # HarvestObject. I'm not sure what the point is of that.
             
-            if dataset['identifier'] in existing_datasets:
-                pkg = existing_datasets[dataset["identifier"]]
-                pkg_id = pkg["id"]
-                seen_datasets.add(dataset['identifier'])
+                # The hash is computed once here from the stored JSON and handed
+                # to import_stage with the HarvestObject.
+                source_hash = self.make_upstream_content_hash(dataset, harvest_job.source, catalog_extras, schema_version,
+                                                              content)
+
+                if dataset['identifier'] in existing_datasets:
+                    pkg = existing_datasets[dataset["identifier"]]
+                    pkg_id = pkg["id"]
+                    seen_datasets.add(dataset['identifier'])
                 
-                # We store a hash of the dict associated with this dataset
-                # in the package so we can avoid updating datasets that
-                # don't look like they've changed.
-                if pkg.get("state") == "active" \
-                    and dataset['identifier'] not in existing_parents_demoted \
-                    and dataset['identifier'] not in existing_datasets_promoted \
-                    and self.find_extra(pkg, "source_hash") == self.make_upstream_content_hash(dataset, harvest_job.source, catalog_extras, schema_version):
-                    continue
-            else:
-                pkg_id = uuid.uuid4().hex
-
-            # Create a new HarvestObject and store in it the GUID of the
-            # existing dataset (if it exists here already) and the dataset's
-            # metadata from the remote catalog file.
-            extras = [HarvestObjectExtra(
-                key='schema_version', value=schema_version)]
-            if dataset['identifier'] in parent_identifiers:
-                extras.append(HarvestObjectExtra(
-                    key='is_collection', value=True))
-            elif dataset.get('isPartOf'):
-                parent_pkg_id = existing_parents[dataset.get('isPartOf')]['id']
-                extras.append(HarvestObjectExtra(
-                    key='collection_pkg_id', value=parent_pkg_id))
-            for k, v in catalog_extras.iteritems():
-                extras.append(HarvestObjectExtra(key=k, value=v))
-
-            obj = HarvestObject(
-                guid=pkg_id,
-                job=harvest_job,
-                extras=extras,
-                content=json.dumps(dataset, sort_keys=True)) # use sort_keys to preserve field order so hashes of this string are constant from run to run
-            obj.save()
-            object_ids.append(obj.id)
-            
+                    # We store a hash of the dict associated with this dataset
+                    # in the package so we can avoid updating datasets that
+                    # don't look like they've changed.
+                    if pkg.get("state") == "active" \
+                        and dataset['identifier'] not in collections.role_changed \
+                        and pkg["source_hash"] == source_hash:
+                        continue
+                else:
+                    pkg_id = uuid.uuid4().hex
+
+                # Create a new HarvestObject and store in it the GUID of the
+                # existing dataset (if it exists here already) and the dataset's
+                # metadata from the remote catalog file.
+                extras = [('schema_version', schema_version), ('source_hash', source_hash)]
+                if dataset['identifier'] in parent_identifiers:
+                    extras.append(('is_collection', True))
+                elif dataset.get('isPartOf'):
+                    parent_pkg_id = collections.parent_package_id(dataset)
+                    extras.append(('collection_pkg_id', parent_pkg_id))
+                for k, v in catalog_extras.iteritems():
+                    extras.append((k, v))
+
+                obj = dict(guid=pkg_id, extras=extras, content=content)
+                if prevalidator:
+                    for obj, message in prevalidator.add(content, obj):
+                        add_object(obj, message)
+                else:
+                    add_object(obj)
+
+            if prevalidator:
+                for obj, message in prevalidator.finish():
+                    add_object(obj, message)
+        finally:
+            if prevalidator:
+                prevalidator.close()
+
+        if prevalidator:
+            log.info('%d of %d datasets to harvest from %s are valid (%.1f%%)' % (
+                prevalidator.checked - prevalidator.invalid, prevalidator.checked, harvest_job.source.url,
+                prevalidator.validity_rate * 100))
+            if prevalidator.invalid:
+                batch.add_error("%d of %d new or changed datasets are valid (%.1f%%), the invalid ones were "
+                                "not harvested." % (prevalidator.checked - prevalidator.invalid, prevalidator.checked,
+                                                prevalidator.validity_rate * 100))
+
         # Remove packages no longer in the remote catalog.
-        for upstreamid, pkg in existing_datasets.items():
-            if upstreamid in seen_datasets: continue # was just updated
-            if pkg.get("state") == "deleted": continue # already deleted
-            pkg["state"] = "deleted"
-            log.warn('deleting package %s (%s) because it is no longer in %s' % (pkg["name"], pkg["id"], harvest_job.source.url))
-            get_action('package_update')(self.context(), pkg)
-            obj = HarvestObject(
-                guid=pkg_id,
-                package_id=pkg["id"],
-                job=harvest_job,
-                ) 
-            obj.save()
-            object_ids.append(obj.id)
-            
-        return object_ids
+        disappeared = [existing for upstreamid, existing in existing_datasets.iteritems()
+                       if upstreamid not in seen_datasets # was just updated
+                       and existing["state"] != "deleted"] # already deleted
+        if disappeared and source_config.get('deletion_dry_run'):
+            batch.add_error("%d datasets are no longer in the catalog and would be deleted. "
+                            "Remove deletion_dry_run from the source configuration to delete them."
+                            % len(disappeared))
+        elif disappeared:
+            self._delete_packages(disappeared, harvest_job, batch)
+
+        batch.flush()
+        return batch.object_ids
+
+    def _delete_packages(self, packages, harvest_job, batch):
+        '''
+        Marks packages as deleted with bulk updates in one transaction instead
+        of a package_update each, then removes them from the search index in
+        batches.
+
+        :param packages: list of dicts with the id and name of the packages,
+            as returned by _existing_datasets
+        :param harvest_job: HarvestJob
+        :param batch: GatherBatch, gets a HarvestObject for each package
+        '''
+        log.warn('deleting %d packages because they are no longer in %s' % (len(packages), harvest_job.source.url))
+        package_ids = [pkg["id"] for pkg in packages]
+        now = datetime.datetime.utcnow()
+        try:
+            for i in range(0, len(package_ids), DELETE_BATCH_SIZE):
+                model.Session.query(Package).filter(Package.id.in_(package_ids[i:i + DELETE_BATCH_SIZE])) \
+                    .update({"state": "deleted", "metadata_modified": now}, synchronize_session=False)
+                remove_from_identifier_index(package_ids[i:i + DELETE_BATCH_SIZE])
+            model.Session.commit()
+        except:
+            model.Session.rollback()
+            raise
+
+        for pkg in packages:
+            log.info('deleted package %s (%s) because it is no longer in %s' % (pkg["name"], pkg["id"], harvest_job.source.url))
+            batch.add_object(guid=pkg["id"], package_id=pkg["id"])
+
+        # one delete query per batch and a single commit, the search index
+        # would otherwise get a request (and maybe a commit) per package
+        conn = make_connection()
+        try:
+            for i in range(0, len(package_ids), DELETE_BATCH_SIZE):
+                query = '+%s:%s +site_id:"%s" +id:(%s)' % (
+                    TYPE_FIELD, PACKAGE_TYPE, config.get('ckan.site_id'),
+                    ' OR '.join('"%s"' % package_id for package_id in package_ids[i:i + DELETE_BATCH_SIZE]))
+                if hasattr(conn, 'delete_query'):
+                    # solrpy, CKAN before 2.6
+                    conn.delete_query(query)
+                else:
+                    conn.delete(q=query, commit=False)
+            conn.commit()
+        finally:
+            if hasattr(conn, 'close'):
+                conn.close()
+
+    def _existing_datasets(self, harvest_source):
+        '''
+        The packages of the current HarvestObjects of a source, keyed by their
+        POD identifier, in one query instead of a package_show per package.
+
+        :param harvest_source: HarvestSource
+        :return: dict of identifier to a dict with the package's id, name,
+            state, source_hash and collection_metadata extra
+        '''
+        keys = ("identifier", "collection_metadata", "source_hash")
+        extras = [aliased(PackageExtra) for key in keys]
+        query = model.Session.query(Package.id, Package.name, Package.state, *[extra.value for extra in extras]) \
+            .join(HarvestObject, HarvestObject.package_id == Package.id) \
+            .filter(HarvestObject.harvest_source_id == harvest_source.id) \
+            .filter(HarvestObject.current == True)
+        for key, extra in zip(keys, extras):
+            query = query.outerjoin(extra, and_(
+                extra.package_id == Package.id, extra.key == key, extra.state == "active"))
+
+        existing_datasets = {}
+        for package_id, name, state, identifier, collection_metadata, source_hash in query:
+            if identifier:
+                existing_datasets[identifier] = {
+                    "id": package_id,
+                    "name": name,
+                    "state": state,
+                    "source_hash": source_hash,
+                    "collection_metadata": collection_metadata,
+                }
+        return existing_datasets
 
     def fetch_stage(self, harvest_object):
         # Nothing to do in this stage because we captured complete
         # dataset metadata from the first request to the remote catalog file.
+        # An object taken into the import batch of another consumer that is
+        # still running goes back to the queue instead of waiting for it.
+        if self._batch_pending(harvest_object):
+            from ckanext.harvest.queue import get_fetch_publisher
+            publisher = get_fetch_publisher()
+            publisher.send({'harvest_object_id': harvest_object.id})
+            publisher.close()
+            return False
         return True
 
     # SUBCLASSES MUST IMPLEMENT
@@ -349,46 +764,11 @@ class DatasetHarvesterBase(HarvesterBase):
     # validate dataset against POD schema
     # use a local copy.
     def _validate_dataset(self, validator_schema, schema_version, dataset):
-        if validator_schema == 'non-federal':
-            if schema_version == '1.1':
-                file_path = 'pod_schema/non-federal-v1.1/dataset-non-federal.json'
-            else:
-                file_path = 'pod_schema/non-federal/single_entry.json'
-        else:
-            if schema_version == '1.1':
-                file_path = 'pod_schema/federal-v1.1/dataset.json'
-            else:
-                file_path = 'pod_schema/single_entry.json'
-
-        with open(os.path.join(
-            os.path.dirname(__file__), file_path)) as json_file:
-            schema = json.load(json_file)
-
-        msg = ";"
-        errors = Draft4Validator(schema, format_checker=FormatChecker()).iter_errors(dataset)
-        count = 0
-        for error in errors:
-            count += 1
-            msg = msg + " ### ERROR #" + str(count) + ": " + self._validate_readable_msg(error) + "; "
-        msg = msg.strip("; ")
-        if msg:
-            id = "Identifier: " + (dataset.get("identifier") if dataset.get("identifier") else "Unknown")
-            title = "Title: " + (dataset.get("title") if dataset.get("title") else "Unknown")
-            msg = id + "; " + title + "; " + str(count) + " Error(s) Found. " + msg + "."
-        return msg
+        return validation_message(validator_schema, schema_version, dataset)
 
     # make ValidationError readable.
     def _validate_readable_msg(self, e):
-        msg = e.message.replace("u'", "'")
-        elem = ""
-        try:
-            if e.schema_path[0] == 'properties':
-                elem = e.schema_path[1]
-                elem = "'" + elem + "':" 
-        except:
-            pass
-
-        return elem + msg
+        return readable_error(e)
 
     def import_stage(self, harvest_object):
         # The import stage actually creates the dataset.
@@ -397,15 +777,257 @@ class DatasetHarvesterBase(HarvesterBase):
         
         if(harvest_object.content == None):
            return True
-        
+
+        # already imported together with another object of its job
+        batch_result = self._pop_batch_result(harvest_object)
+        if batch_result is not None:
+            return batch_result
+
+        batch_size = import_batch_size()
+        if batch_size > 1:
+            return self._import_with_batch(harvest_object, batch_size)
+        return self._import_single(harvest_object)
+
+    def _import_single(self, harvest_object):
+        built = self._build_package(harvest_object)
+        if built is None:
+            return None
+        pkg, dataset_processed = built
+
+        # Try to update an existing package with the ID set in harvest_object.guid. If that GUID
+        # corresponds with an existing package, get its current metadata.
+        try:
+            existing_pkg = get_action('package_show')(self.context(), { "id": harvest_object.guid })
+        except NotFound:
+            existing_pkg = None
+
+        # the datajson plugin registers the identifier of the saved package
+        pkg = self._save_package(harvest_object, pkg, dataset_processed, existing_pkg, self.context())
+
+        # Flag the other HarvestObjects linking to this package as not current anymore,
+        # with one UPDATE of the (normally single) row still flagged
+        model.Session.query(HarvestObject) \
+            .filter(HarvestObject.package_id == pkg["id"]) \
+            .filter(HarvestObject.current == True) \
+            .filter(HarvestObject.id != harvest_object.id) \
+            .update({"current": False}, synchronize_session=False)
+
+        # the package holds its name now
+        release_package_names([pkg['id']])
+
+        # Flag this HarvestObject as the current harvest object
+        harvest_object.package_id = pkg['id']
+        harvest_object.current = True
+        harvest_object.save()
+        model.Session.commit()
+
+        # Now that the package and the harvest source are associated, re-index the
+        # package so it knows it is part of the harvest source. The CKAN harvester
+        # does this by creating the association before the package is saved by
+        # overriding the GUID creation on a new package. That's too difficult.
+        # So here we end up indexing twice.
+        # !!! DISABLED - causes showing wrong number of datasets, when you try to
+        # !!! list datasets by harvest source /harvest/{source_id}
+        # PackageSearchIndex().index_package(pkg)
+
+        return True
+
+    def import_batch(self, harvest_objects, record=()):
+        '''
+        Imports HarvestObjects of the same job in one transaction: the
+        packages that already exist are looked up with one query, created
+        and updated without a commit each, the objects are flagged current
+        with two UPDATE statements and everything is committed once. If the
+        transaction fails, the objects are imported one by one instead, so
+        one bad dataset does not fail the others.
+
+        :param harvest_objects: list of HarvestObject
+        :param record: list of HarvestObject, those of harvest_objects whose
+            queue messages are still to come, their state and result are
+            saved in the same transaction for import_stage to return
+        :return: dict, HarvestObject id to what import_stage would return
+        '''
+        results = {}
+        built = []
+        for harvest_object in harvest_objects:
+            if harvest_object.content is None:
+                results[harvest_object.id] = True
+                continue
+            package = self._build_package(harvest_object)
+            if package is None:
+                results[harvest_object.id] = None
+            else:
+                built.append((harvest_object, ) + package)
+        if not built:
+            self._record_batch_results(record, results)
+            model.Session.commit()
+            return results
+
+        started = time.time()
+        guids = [harvest_object.guid for harvest_object, pkg, dataset_processed in built]
+        existing_pkgs = self._existing_package_dicts(guids)
+        context = dict(self.context(), defer_commit=True)
+        # the names of the new packages, chosen and reserved together
+        self._package_names = PackageNameAllocator()
+        try:
+            self._package_names.allocate_all([(dataset_processed["title"], harvest_object.guid)
+                                              for harvest_object, pkg, dataset_processed in built
+                                              if harvest_object.guid not in existing_pkgs])
+            saved = []
+            for harvest_object, pkg, dataset_processed in built:
+                pkg = self._save_package(harvest_object, pkg, dataset_processed,
+                                         existing_pkgs.get(harvest_object.guid), context)
+                saved.append((harvest_object, pkg))
+
+            # the other HarvestObjects of the packages are not current anymore, these are
+            model.Session.query(HarvestObject) \
+                .filter(HarvestObject.package_id.in_([pkg["id"] for harvest_object, pkg in saved])) \
+                .filter(HarvestObject.current == True) \
+                .update({"current": False}, synchronize_session=False)
+            model.Session.execute(
+                harvest_object_table.update()
+                .where(harvest_object_table.c.id == bindparam("object_id"))
+                .values(package_id=bindparam("new_package_id"), current=True),
+                [{"object_id": harvest_object.id, "new_package_id": pkg["id"]} for harvest_object, pkg in saved])
+            release_package_names([pkg["id"] for harvest_object, pkg in saved])
+            for harvest_object, pkg in saved:
+                results[harvest_object.id] = True
+            self._record_batch_results(record, results)
+            model.Session.commit()
+        except Exception as e:
+            model.Session.rollback()
+            self._package_names = None
+            log.warn('Batch import of %d objects failed (%s), importing them one by one' % (len(built), e))
+            for harvest_object, pkg, dataset_processed in built:
+                try:
+                    results[harvest_object.id] = self._import_single(harvest_object)
+                except Exception as e:
+                    model.Session.rollback()
+                    self._save_object_error('Error importing dataset: %s' % e, harvest_object, 'Import')
+                    results[harvest_object.id] = None
+            self._record_batch_results(record, results)
+            model.Session.commit()
+            return results
+
+        self._package_names = None
+        for harvest_object, pkg in saved:
+            model.Session.expire(harvest_object)
+        elapsed = time.time() - started
+        log.info('Imported %d packages in one batch in %.2fs, %.0f ms per package' % (
+            len(saved), elapsed, elapsed * 1000 / len(saved)))
+        return results
+
+    def _existing_package_dicts(self, package_ids):
+        # package_show of the packages that exist, taken from a package_search
+        # per search.rows_max packages when the search index holds their
+        # current version, so a batch does not need a package_show per package
+        modified = dict(model.Session.query(Package.id, Package.metadata_modified)
+                        .filter(Package.id.in_(package_ids)))
+        existing_pkgs = {}
+        found = []
+        ids = sorted(modified)
+        rows_max = int(config.get('ckan.search.rows_max', 1000))
+        for i in range(0, len(ids), rows_max):
+            chunk = ids[i:i + rows_max]
+            try:
+                found.extend(get_action('package_search')(self.context(), {
+                    'fq': 'id:(%s)' % ' OR '.join('"%s"' % package_id for package_id in chunk),
+                    'rows': len(chunk),
+                    'include_private': True,
+                })['results'])
+            except Exception as e:
+                log.warn('Could not search the existing packages of a batch: %s' % e)
+        for pkg in found:
+            if modified.get(pkg['id']) and pkg.get('metadata_modified') == modified[pkg['id']].isoformat():
+                existing_pkgs[pkg['id']] = pkg
+        for package_id in modified:
+            if package_id not in existing_pkgs:
+                # deleted, or changed since it was indexed
+                existing_pkgs[package_id] = get_action('package_show')(self.context(), {"id": package_id})
+        return existing_pkgs
+
+    def _import_with_batch(self, harvest_object, batch_size):
+        # Imports the object together with up to batch_size - 1 objects of
+        # its job that no fetch consumer has started on yet. Each is claimed
+        # with an UPDATE from WAITING to IMPORT, which only one consumer can
+        # make, committed before the import so other consumers leave them
+        # alone even when the batch is rolled back; import_started holds the
+        # time of the claim. Their queue messages are still delivered later,
+        # see fetch_stage and _pop_batch_result.
+        candidates = model.Session.query(HarvestObject.id) \
+            .filter(HarvestObject.harvest_job_id == harvest_object.harvest_job_id) \
+            .filter(HarvestObject.id != harvest_object.id) \
+            .filter(HarvestObject.state == u'WAITING') \
+            .order_by(HarvestObject.gathered, HarvestObject.id) \
+            .limit(batch_size - 1) \
+            .all()
+        now = datetime.datetime.utcnow()
+        claimed = []
+        for object_id, in candidates:
+            result = model.Session.execute(harvest_object_table.update()
+                                           .where(harvest_object_table.c.id == object_id)
+                                           .where(harvest_object_table.c.state == u'WAITING')
+                                           .values(state=u'IMPORT', import_started=now))
+            if result.rowcount == 1:
+                claimed.append(object_id)
+        model.Session.commit()
+        others = model.Session.query(HarvestObject).filter(HarvestObject.id.in_(claimed)) \
+            .order_by(HarvestObject.gathered, HarvestObject.id).all() if claimed else []
+        return self.import_batch([harvest_object] + others, record=others)[harvest_object.id]
+
+    def _record_batch_results(self, harvest_objects, results):
+        now = datetime.datetime.utcnow()
+        for harvest_object in harvest_objects:
+            state = u'COMPLETE' if results[harvest_object.id] else u'ERROR'
+            model.Session.execute(harvest_object_table.update()
+                                  .where(harvest_object_table.c.id == harvest_object.id)
+                                  .values(state=state, import_started=now, import_finished=now))
+            model.Session.execute(harvest_object_extra_table.insert().values(
+                id=make_uuid(), harvest_object_id=harvest_object.id, key=BATCH_RESULT_KEY, value=state))
+
+    def _batch_pending(self, harvest_object):
+        # Whether the object was claimed by the batch of another consumer
+        # (see _import_with_batch) that has not recorded its result yet. The
+        # fetch consumer only sets import_started after the fetch stage, so
+        # there it is the time of the claim. A claim older than
+        # BATCH_CLAIM_TIMEOUT is from a consumer that died, the object is
+        # imported on its own then.
+        if harvest_object.import_started is None:
+            return False
+        if model.Session.query(HarvestObjectExtra.id) \
+                .filter(HarvestObjectExtra.harvest_object_id == harvest_object.id) \
+                .filter(HarvestObjectExtra.key == BATCH_RESULT_KEY).first() is not None:
+            return False
+        if datetime.datetime.utcnow() - harvest_object.import_started < BATCH_CLAIM_TIMEOUT:
+            return True
+        log.warn('The batch that claimed harvest object %s did not finish, importing it' % harvest_object.id)
+        return False
+
+    def _pop_batch_result(self, harvest_object):
+        # True or False if the object was imported by _import_with_batch,
+        # None otherwise. The record is removed, so importing it again works.
+        for extra in harvest_object.extras:
+            if extra.key == BATCH_RESULT_KEY:
+                state = extra.value
+                model.Session.delete(extra)
+                model.Session.commit()
+                return state == u'COMPLETE'
+        return None
+
+    def _build_package(self, harvest_object):
+        # The package dict of a HarvestObject and its processed dataset, or
+        # None if it cannot be imported (the object error is saved).
         dataset = json.loads(harvest_object.content)
         schema_version = '1.0' # default to '1.0'
         is_collection = False
         parent_pkg_id = ''
         catalog_extras = {}
+        source_hash = None
         for extra in harvest_object.extras:
             if extra.key == 'schema_version':
                 schema_version = extra.value
+            if extra.key == 'source_hash':
+                source_hash = extra.value
             if extra.key == 'is_collection' and extra.value:
                 is_collection = True
             if extra.key == 'collection_pkg_id' and extra.value:
@@ -413,139 +1035,22 @@ class DatasetHarvesterBase(HarvesterBase):
             if extra.key.startswith('catalog_'):
                 catalog_extras[extra.key] = extra.value
 
+        job_context = self.job_context(harvest_object)
+
         # if this dataset is part of collection, we need to check if
         # parent dataset exist or not. we dont support any hierarchy
         # in this, so the check does not apply to those of is_collection
         if parent_pkg_id and not is_collection:
-            parent_pkg = None
-            try:
-                parent_pkg = get_action('package_show')(self.context(),
-                    { "id": parent_pkg_id })
-            except:
-                pass
-            if not parent_pkg:
+            if not job_context.collection_exists(parent_pkg_id):
                 parent_check_message = "isPartOf identifer '%s' not found." \
                     % dataset.get('isPartOf')
                 self._save_object_error(parent_check_message, harvest_object,
                     'Import')
                 return None
 
-        # Get default values.
-        dataset_defaults = self.load_config(harvest_object.source)["defaults"]
-
-        source_config = json.loads(harvest_object.source.config or '{}')
-        validator_schema = source_config.get('validator_schema')
-        if schema_version == '1.0' and validator_schema != 'non-federal':
-            lowercase_conversion = True
-        else:
-            lowercase_conversion = False
-
-        MAPPING = {
-            "title": "title",
-            "description": "notes",
-            "keyword": "tags",
-            "modified": "extras__modified", # ! revision_timestamp
-            "publisher": "extras__publisher", # !owner_org
-            "contactPoint": "maintainer",
-            "mbox": "maintainer_email",
-            "identifier": "extras__identifier", # !id
-            "accessLevel": "extras__accessLevel",
-
-            "bureauCode": "extras__bureauCode",
-            "programCode": "extras__programCode",
-            "accessLevelComment": "extras__accessLevelComment",
-            "license": "extras__license", # !license_id 
-            "spatial": "extras__spatial", # Geometry not valid GeoJSON, not indexing
-            "temporal": "extras__temporal",
-
-            "theme": "extras__theme",
-            "dataDictionary": "extras__dataDictionary", # !data_dict
-            "dataQuality": "extras__dataQuality",
-            "accrualPeriodicity":"extras__accrualPeriodicity",
-            "landingPage": "extras__landingPage",
-            "language": "extras__language",
-            "primaryITInvestmentUII": "extras__primaryITInvestmentUII", # !PrimaryITInvestmentUII
-            "references": "extras__references",
-            "issued": "extras__issued",
-            "systemOfRecords": "extras__systemOfRecords",
-
-            "accessURL": None,
-            "webService": None,
-            "format": None,
-            "distribution": None,
-        }
-
-        MAPPING_V1_1 = {
-            "title": "title",
-            "description": "notes",
-            "keyword": "tags",
-            "modified": "extras__modified", # ! revision_timestamp
-            "publisher": "extras__publisher", # !owner_org
-            "contactPoint": {"fn":"maintainer", "hasEmail":"maintainer_email"},
-            "identifier": "extras__identifier", # !id
-            "accessLevel": "extras__accessLevel",
-
-            "bureauCode": "extras__bureauCode",
-            "programCode": "extras__programCode",
-            "rights": "extras__rights",
-            "license": "extras__license", # !license_id
-            "spatial": "extras__spatial", # Geometry not valid GeoJSON, not indexing
-            "temporal": "extras__temporal",
-
-            "theme": "extras__theme",
-            "dataDictionary": "extras__dataDictionary", # !data_dict
-            "dataQuality": "extras__dataQuality",
-            "accrualPeriodicity":"extras__accrualPeriodicity",
-            "landingPage": "extras__landingPage",
-            "language": "extras__language",
-            "primaryITInvestmentUII": "extras__primaryITInvestmentUII", # !PrimaryITInvestmentUII
-            "references": "extras__references",
-            "issued": "extras__issued",
-            "systemOfRecords": "extras__systemOfRecords",
-
-            "distribution": None,
-        }
-
-        SKIP = ["accessURL", "webService", "format", "distribution"] # will go into pkg["resources"]
-        # also skip the processed_how key, it was added to indicate how we processed the dataset.
-        SKIP.append("processed_how");
-
-        SKIP_V1_1 = ["@type", "isPartOf", "distribution"]
-        SKIP_V1_1.append("processed_how");
-
-        if lowercase_conversion:
-
-            mapping_processed = {}
-            for k,v in MAPPING.items():
-                mapping_processed[k.lower()] = v
-
-            skip_processed = [k.lower() for k in SKIP]
-
-            dataset_processed = {'processed_how': ['lowercase']}
-            for k,v in dataset.items():
-              if k.lower() in mapping_processed.keys():
-                dataset_processed[k.lower()] = v
-              else:
-                dataset_processed[k] = v
-
-            if 'distribution' in dataset and dataset['distribution'] is not None:
-              dataset_processed['distribution'] = []
-              for d in dataset['distribution']:
-                d_lower = {}
-                for k,v in d.items():
-                  if k.lower() in mapping_processed.keys():
-                    d_lower[k.lower()] = v
-                  else:
-                    d_lower[k] = v
-                dataset_processed['distribution'].append(d_lower)
-        else:
-            dataset_processed = dataset
-            mapping_processed = MAPPING
-            skip_processed = SKIP
-
-        if schema_version == '1.1':
-            mapping_processed = MAPPING_V1_1
-            skip_processed = SKIP_V1_1
+        validator_schema = job_context.validator_schema
+        dataset_processed, mapping_processed, skip_processed = \
+            process_dataset(dataset, schema_version, validator_schema)
 
         validate_message = self._validate_dataset(validator_schema,
             schema_version, dataset_processed)
@@ -553,23 +1058,12 @@ class DatasetHarvesterBase(HarvesterBase):
             self._save_object_error(validate_message, harvest_object, 'Import')
             return None
 
-        # We need to get the owner organization (if any) from the harvest
-        # source dataset
-        owner_org = None
-        source_dataset = model.Package.get(harvest_object.source.id)
-        if source_dataset.owner_org:
-            owner_org = source_dataset.owner_org
-
-
-        source_config = json.loads(harvest_object.source.config or '{}')
-        group_name = source_config.get('default_groups', '')
-
         # Assemble basic information about the dataset.
 
         pkg = {
             "state": "active", # in case was previously deleted
-            "owner_org": owner_org,
-            "groups": [{"name": group_name}],
+            "owner_org": job_context.owner_org,
+            "groups": [{"name": job_context.default_group}],
             "resources": [],
             "extras": [
                 {
@@ -578,7 +1072,9 @@ class DatasetHarvesterBase(HarvesterBase):
                 },
                 {
                     "key": "source_hash",
-                    "value": self.make_upstream_content_hash(dataset, harvest_object.source, catalog_extras, schema_version),
+                    # objects gathered before the hash was passed along don't have it
+                    "value": source_hash or self.make_upstream_content_hash(dataset, harvest_object.source,
+                        catalog_extras, schema_version, harvest_object.content),
                 },
                 {
                     "key": "source_datajson_identifier",
@@ -663,77 +1159,67 @@ class DatasetHarvesterBase(HarvesterBase):
             extras.append({'key':k, 'value':v})
 
         # Set specific information about the dataset.
-        self.set_dataset_info(pkg, dataset_processed, dataset_defaults, schema_version)
-    
-        # Try to update an existing package with the ID set in harvest_object.guid. If that GUID
-        # corresponds with an existing package, get its current metadata.
-        try:
-            existing_pkg = get_action('package_show')(self.context(), { "id": harvest_object.guid })
-        except NotFound:
-            existing_pkg = None
-      
+        self.set_dataset_info(pkg, dataset_processed, job_context.defaults, schema_version)
+        return pkg, dataset_processed
+
+    def _save_package(self, harvest_object, pkg, dataset_processed, existing_pkg, context):
+        # Creates the package, or updates existing_pkg with it, and returns
+        # the saved package dict.
         if existing_pkg:
             # Update the existing metadata with the new information.
             
             # But before doing that, try to avoid replacing existing resources with new resources
-            # my assigning resource IDs where they match up.
-            for res in pkg.get("resources", []):
-                for existing_res in existing_pkg.get("resources", []):
-                    if res["url"] == existing_res["url"]:
-                        res["id"] = existing_res["id"]
+            # my assigning resource IDs where they match up, and keep those that did not change.
+            if "resources" in pkg:
+                resources = []
+                matches = ResourceIndex(existing_pkg.get("resources", [])).match(pkg["resources"])
+                for res, existing_res in zip(pkg["resources"], matches):
+                    if existing_res is not None:
+                        if resource_unchanged(res, existing_res):
+                            res = existing_res
+                        else:
+                            res["id"] = existing_res["id"]
+                    resources.append(res)
+                pkg["resources"] = resources
             pkg['groups'] = existing_pkg['groups']
             existing_pkg.update(pkg) # preserve other fields that we're not setting, but clobber extras
             pkg = existing_pkg
             
             log.warn('updating package %s (%s) from %s' % (pkg["name"], pkg["id"], harvest_object.source.url))
-            pkg = get_action('package_update')(self.context(), pkg)
+            pkg = get_action('package_update')(dict(context), pkg)
         else:
             # It doesn't exist yet. Create a new one.
             pkg['name'] = self.make_package_name(dataset_processed["title"], harvest_object.guid)
             try:
-                pkg = get_action('package_create')(self.context(), pkg)
+                pkg = get_action('package_create')(dict(context), pkg)
                 log.warn('created package %s (%s) from %s' % (pkg["name"], pkg["id"], harvest_object.source.url))
             except IntegrityError:
+                if context.get('defer_commit'):
+                    # the rollback would lose the rest of the batch
+                    raise
                 # sometimes one fetch worker does not see new pkg added
                 # by other workers. it gives db error for pkg with same title.
                 model.Session.rollback()
                 pkg['name'] = self.make_package_name(dataset_processed["title"], harvest_object.guid)
-                pkg = get_action('package_create')(self.context(), pkg)
+                pkg = get_action('package_create')(dict(context), pkg)
                 log.warn('created package %s (%s) from %s' % (pkg["name"], pkg["id"], harvest_object.source.url))
             except:
                 log.error('failed to create package %s from %s' % (pkg["name"], harvest_object.source.url))
                 raise
-
-        # Flag the other HarvestObjects linking to this package as not current anymore
-        for ob in model.Session.query(HarvestObject).filter_by(package_id=pkg["id"]):
-            ob.current = False
-            ob.save()
-
-        # Flag this HarvestObject as the current harvest object
-        harvest_object.package_id = pkg['id']
-        harvest_object.current = True
-        harvest_object.save()
-        model.Session.commit()
-
-        # Now that the package and the harvest source are associated, re-index the
-        # package so it knows it is part of the harvest source. The CKAN harvester
-        # does this by creating the association before the package is saved by
-        # overriding the GUID creation on a new package. That's too difficult.
-        # So here we end up indexing twice.
-        # !!! DISABLED - causes showing wrong number of datasets, when you try to
-        # !!! list datasets by harvest source /harvest/{source_id}
-        # PackageSearchIndex().index_package(pkg)
-
-        return True
+        return pkg
         
     def make_upstream_content_hash(self, datasetdict, harvest_source,
-        catalog_extras, schema_version='1.0'):
+        catalog_extras, schema_version='1.0', content=None):
+        # content is json.dumps(datasetdict, sort_keys=True) when the caller
+        # already has it, e.g. HarvestObject.content
+        if content is None:
+            content = json.dumps(datasetdict, sort_keys=True)
         if schema_version == '1.0':
-            return hashlib.sha1(json.dumps(datasetdict, sort_keys=True)
+            return hashlib.sha1(content
                 + "|" + harvest_source.config + "|"
                 + self.HARVESTER_VERSION).hexdigest()
         else:
-            return hashlib.sha1(json.dumps(datasetdict, sort_keys=True)
+            return hashlib.sha1(content
                 + "|" + json.dumps(catalog_extras,
                 sort_keys=True)).hexdigest()
         
@@ -747,33 +1233,9 @@ class DatasetHarvesterBase(HarvesterBase):
         '''
         Creates a URL friendly name from a title
 
-        If the name already exists, it will add some random characters at the end
+        If the name already exists, it will add a suffix made of the package
+        id at the end. The name is reserved for the package, see
+        PackageNameAllocator.
         '''
-
-        name = munge_title_to_name(title).replace('_', '-')
-        while '--' in name:
-            name = name.replace('--', '-')
-        name = name[0:90] # max length is 100
-
-        # Is this slug already in use (and if we're updating a package, is it in
-        # use by a different package?).
-        pkg_obj = Session.query(Package).filter(Package.name == name).filter(Package.id != exclude_existing_package).first()
-        if not pkg_obj:
-            # The name is available, so use it. Note that if we're updating an
-            # existing package we will be updating this package's URL, so incoming
-            # links may break.
-            return name
-
-        if exclude_existing_package:
-            # The name is not available, and we're updating a package. Chances
-            # are the package's name already had some random string attached
-            # to it last time. Prevent spurrious updates to the package's URL
-            # (choosing new random text) by just reusing the existing package's
-            # name.
-            pkg_obj = Session.query(Package).filter(Package.id == exclude_existing_package).first()
-            if pkg_obj: # the package may not exist yet because we may be passed the desired package GUID before a new package is instantiated
-                return pkg_obj.name
-
-        # Append some random text to the URL. Hope that with five character
-        # there will be no collsion.
-        return name + "-" + str(uuid.uuid4())[:5]
+        names = self._package_names or PackageNameAllocator()
+        return names.allocate(title, exclude_existing_package)
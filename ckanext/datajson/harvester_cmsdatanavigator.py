@@ -1,4 +1,5 @@
 from ckanext.datajson.harvester_base import DatasetHarvesterBase
+from ckanext.datajson.http_client import open_url
 
 import urllib2, json, re, datetime
 
@@ -17,11 +18,15 @@ class CmsDataNavigatorHarvester(DatasetHarvesterBase):
         }
 
     def load_remote_catalog(self, harvest_job):
-        catalog = json.load(urllib2.urlopen(harvest_job.source.url))
+        response = open_url(harvest_job.source.url)
+        try:
+            catalog = json.load(response)
+        finally:
+            response.close()
         for item in catalog:
             item["identifier"] = item["ID"]
             item["title"] = item["Name"].strip()
-        return catalog
+        return (("dataset", item) for item in catalog)
         
     def set_dataset_info(self, package, dataset, dataset_defaults):
         extra(package, "Agency", "Department of Health & Human Services")
@@ -1,8 +1,23 @@
+from ckan import model
+from ckanext.harvest.model import HarvestGatherError, HarvestObject
+from paste.deploy.converters import asbool
+from pylons import config
+
+from ckanext.datajson.catalog_prefetch import get_catalog_spool
+from ckanext.datajson.db import get_source_fetch, save_source_fetch, source_gather_errors
 from ckanext.datajson.harvester_base import DatasetHarvesterBase
+from ckanext.datajson.http_client import download
+from jsonstream import JsonStreamParser, detect_encoding
 from parse_datajson import parse_datajson_entry
 
 
-import urllib2, json
+import urllib2, hashlib, tempfile, datetime
+
+import logging
+log = logging.getLogger("harvester")
+
+# a catalog is read in the first of these it is valid in
+CATALOG_ENCODINGS = ('utf-8', 'cp1252', 'iso-8859-1')
 
 class DataJsonHarvester(DatasetHarvesterBase):
     '''
@@ -11,6 +26,12 @@ class DataJsonHarvester(DatasetHarvesterBase):
 
     HARVESTER_VERSION = "0.9al"  # increment to force an update even if nothing has changed
 
+    def __init__(self, *args, **kwargs):
+        super(DataJsonHarvester, self).__init__(*args, **kwargs)
+        # what was downloaded for each job this instance is gathering, saved
+        # once the catalog was read completely
+        self._fetches = {}
+
     def info(self):
         return {
             'name': 'datajson',
@@ -18,48 +39,138 @@ class DataJsonHarvester(DatasetHarvesterBase):
             'description': 'Harvests remote /data.json files',
         }
 
+    def gather_stage(self, harvest_job):
+        try:
+            object_ids = super(DataJsonHarvester, self).gather_stage(harvest_job)
+        finally:
+            fetch = self._fetches.pop(harvest_job.id, None)
+        if fetch:
+            # the gather errors are kept, to report them again for the jobs
+            # that skip the catalog while it does not change
+            errors = [message for message, in model.Session.query(HarvestGatherError.message)
+                      .filter(HarvestGatherError.harvest_job_id == harvest_job.id)
+                      .order_by(HarvestGatherError.created)]
+            save_source_fetch(harvest_job.source.id, gather_errors=errors, **fetch)
+        return object_ids
+
     def load_remote_catalog(self, harvest_job):
-        req = urllib2.Request(harvest_job.source.url)
-        # todo: into config and across harvester
-        req.add_header('User-agent', 'Data.gov/2.0')
+        # The catalog is downloaded once to a temporary file, then parsed from
+        # there one dataset at a time in the first encoding it is valid in.
+        spool = self._download_catalog(harvest_job)
+        if spool is None:
+            log.info('%s has not changed since it was last harvested' % harvest_job.source.url)
+            for message in source_gather_errors(get_source_fetch(harvest_job.source.id)):
+                self._save_gather_error(message, harvest_job)
+            return
         try:
-            datasets = json.load(urllib2.urlopen(req))
-        except UnicodeDecodeError:
-            # try different encode
-            try:
-                datasets = json.load(urllib2.urlopen(req), 'cp1252')
-            except:
-                datasets = json.load(urllib2.urlopen(req), 'iso-8859-1')
+            encoding = detect_encoding(spool, CATALOG_ENCODINGS)
+            if encoding != CATALOG_ENCODINGS[0]:
+                log.warn('%s is not UTF-8, reading it as %s' % (harvest_job.source.url, encoding))
+            for event in self._catalog_events(JsonStreamParser(spool, encoding), harvest_job):
+                yield event
         except:
-            # remove BOM
-            datasets = json.loads(lstrip_bom(urllib2.urlopen(req).read()))
-
-        # The first dataset should be for the data.json file itself. Check that
-        # it is, and if so rewrite the dataset's title because Socrata exports
-        # these items all with the same generic name that is confusing when
-        # harvesting a bunch from different sources. It should have an accessURL
-        # but Socrata fills the URL of these in under webService.
-        if isinstance(datasets, list) and len(datasets) > 0 and (datasets[0].get("accessURL") == harvest_job.source.url
-            or datasets[0].get("webService") == harvest_job.source.url) and \
-            datasets[0].get("title") == "Project Open Data, /data.json file":
-            datasets[0]["title"] = "%s Project Open Data data.json File" % harvest_job.source.title
-
-        catalog_values = None
-        if isinstance(datasets, dict):
-            # this is a catalog, not dataset array as in schema 1.0.
-            catalog_values = datasets.copy()
-            datasets = catalog_values.pop("dataset", [])
-
-        return (datasets, catalog_values)
-        
+            # a catalog that could not be read is downloaded again next time
+            self._fetches.pop(harvest_job.id, None)
+            raise
+        finally:
+            spool.close()
+
+    def _download_catalog(self, harvest_job):
+        # Returns the catalog in a temporary file, None if it is the same as
+        # the last time the source was gathered with the same configuration.
+        # A catalog prefetched for the job (see catalog_prefetch) is used if
+        # it was requested the way it would be requested now.
+        source = harvest_job.source
+        previous, config_digest, headers = self._fetch_plan(source)
+
+        prefetched = get_catalog_spool().take(harvest_job.id)
+        if prefetched is not None:
+            spool, fetch = prefetched
+            if (fetch['url'], fetch['config_digest'], fetch['headers']) == (source.url, config_digest, headers) \
+                    and (spool is not None or previous):
+                log.debug('Using the catalog prefetched for job %s' % harvest_job.id)
+                if spool is None:
+                    return None  # 304 Not Modified
+                return self._fetched(harvest_job, previous, spool, fetch)
+            if spool is not None:
+                spool.close()
+
+        fetch = {'config_digest': config_digest, 'fetched': datetime.datetime.utcnow()}
+        spool = tempfile.TemporaryFile()
+        try:
+            response, fetch['digest'] = download(source.url, spool, headers)
+        except urllib2.HTTPError as e:
+            spool.close()
+            if e.code == 304 and previous:
+                return None
+            raise
+        except:
+            spool.close()
+            raise
+        fetch['etag'] = response.info().getheader('ETag')
+        fetch['last_modified'] = response.info().getheader('Last-Modified')
+        return self._fetched(harvest_job, previous, spool, fetch)
+
+    def _fetch_plan(self, source):
+        # The previous fetch of the source the catalog is compared with (None
+        # to always gather it), the digest of the source configuration and
+        # the conditional request headers to send.
+        # the collection run status is part of the config, so the jobs of a
+        # parents / children run always get the whole catalog
+        config_digest = hashlib.sha1((source.config or '') + '|' + self.HARVESTER_VERSION).hexdigest()
+        previous = None
+        if asbool(config.get('ckanext.datajson.harvest.conditional_fetch', True)):
+            previous = get_source_fetch(source.id)
+            if previous and (previous.config_digest != config_digest or not self._last_harvest_complete(source, previous)):
+                previous = None
+
+        headers = {}
+        if previous:
+            if previous.etag:
+                headers['If-None-Match'] = previous.etag
+            if previous.last_modified:
+                headers['If-Modified-Since'] = previous.last_modified
+        return previous, config_digest, headers
+
+    def _fetched(self, harvest_job, previous, spool, fetch):
+        if previous and previous.digest == fetch['digest']:
+            spool.close()
+            return None
+        self._fetches[harvest_job.id] = dict((key, fetch[key]) for key in
+                                             ('etag', 'last_modified', 'digest', 'config_digest', 'fetched'))
+        spool.seek(0)
+        return spool
+
+    def _last_harvest_complete(self, source, previous):
+        # An unchanged catalog is only skipped if the source still has its
+        # datasets (it was not cleared) and everything gathered from it last
+        # time was imported, otherwise failed datasets would never be retried.
+        objects = model.Session.query(HarvestObject.id).filter(HarvestObject.harvest_source_id == source.id)
+        if objects.filter(HarvestObject.current == True).first() is None:
+            return False
+        return objects.filter(HarvestObject.gathered >= previous.fetched) \
+            .filter(HarvestObject.state != u'COMPLETE').first() is None
+
+    def _catalog_events(self, parser, harvest_job):
+        first = True
+        for kind, value in parser.events():
+            if kind == 'value':
+                raise ValueError('The file is neither a list of datasets nor a catalog object')
+            if first and parser.top_level == '{':
+                # this is a catalog, not dataset array as in schema 1.0.
+                yield 'catalog', None
+            elif first and isinstance(value, dict) and (value.get("accessURL") == harvest_job.source.url
+                or value.get("webService") == harvest_job.source.url) and \
+                value.get("title") == "Project Open Data, /data.json file":
+                # The first dataset should be for the data.json file itself. Check that
+                # it is, and if so rewrite the dataset's title because Socrata exports
+                # these items all with the same generic name that is confusing when
+                # harvesting a bunch from different sources. It should have an accessURL
+                # but Socrata fills the URL of these in under webService.
+                value["title"] = "%s Project Open Data data.json File" % harvest_job.source.title
+            first = False
+            yield kind, value
+
     def set_dataset_info(self, pkg, dataset, dataset_defaults, schema_version):
         parse_datajson_entry(dataset, pkg, dataset_defaults, schema_version)
 
-# helper function to remove BOM
-def lstrip_bom(str_):
-    from codecs import BOM_UTF8
-    bom = BOM_UTF8
-    if str_.startswith(bom):
-        return str_[len(bom):]
-    else:
-        return str_
@@ -161,13 +161,26 @@ def get_validator(schema_type="federal-v1.1"):
     :param schema_type: str
     :return: obj
     """
-    import os
-    from jsonschema import Draft4Validator, FormatChecker
+    from schema_validators import get_schema_validator
+
+    return get_schema_validator(schema_type)
 
-    schema_path = os.path.join(os.path.dirname(__file__), 'pod_schema', schema_type, 'dataset.json')
-    with open(schema_path, 'r') as schema:
-        schema = json.loads(schema.read())
-        return Draft4Validator(schema, format_checker=FormatChecker())
+
+def get_pod_identifier(package, json_export_map):
+    """
+    POD identifier of a package, read the same way the export reads it
+    :param package: dict
+    :param json_export_map: dict
+    :return: str|None
+    """
+    field_map = json_export_map.get('dataset_fields_map', {}).get('identifier', {})
+    field = field_map.get('field')
+    if not field:
+        return None
+    if field_map.get('extra'):
+        # a private cache, the shared one could hold a stale copy of this package
+        return PackageExtraCache().get(package, field)
+    return strip_if_string(package.get(field))
 
 
 def uglify(key):
@@ -200,7 +213,7 @@ class PackageExtraCache:
         try:
             self.pid = package.get('id')
 
-            current_extras = package.get('extras')
+            current_extras = package.get('extras') or []
             new_extras = {}
             for extra in current_extras:
                 if 'extras_rollup' == extra.get('key'):
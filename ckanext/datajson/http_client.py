@@ -0,0 +1,436 @@
+"""
+HTTP client shared by the harvesters.
+
+Requests ask for gzip or deflate compressed bodies, which are inflated as they
+are read, and go over keep-alive connections pooled per host, so harvesting
+several catalogs from one server does not connect again for each of them.
+Errors are raised like urllib2 does: urllib2.HTTPError for error statuses and
+304 Not Modified, urllib2.URLError when the server cannot be reached.
+"""
+import base64
+import hashlib
+import httplib
+import logging
+import random
+import re
+import socket
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+
+from jsonstream import DecompressingReader, CHUNK_SIZE
+
+try:
+    from pylons import config
+except ImportError:
+    # used outside of a CKAN process
+    config = {}
+
+log = logging.getLogger(__name__)
+
+DEFAULT_USER_AGENT = 'Data.gov/2.0'
+# seconds to wait for a connection or for data
+DEFAULT_TIMEOUT = 60
+MAX_REDIRECTS = 10
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+# idle connections kept per host
+MAX_IDLE_PER_HOST = 4
+# unread response bodies up to this size are drained so the connection can be reused
+DRAIN_LIMIT = 64 * 1024
+# download retries, the first one after DEFAULT_BACKOFF seconds, then twice as long each time
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 60
+# statuses of temporary server errors, retried by download
+RETRY_CODES = (408, 429, 502, 503, 504)
+# RFC 3230 Digest algorithms checked by download
+DIGEST_ALGORITHMS = {'sha-256': 'sha256', 'sha': 'sha1', 'md5': 'md5'}
+
+
+class ConnectionPool:
+    """
+    Idle keep-alive connections, per scheme, host, port and proxy.
+    """
+
+    def __init__(self, max_idle_per_host=MAX_IDLE_PER_HOST):
+        self.max_idle_per_host = max_idle_per_host
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, timeout):
+        """
+        :param key: tuple, (scheme, host, port, proxy url or None)
+        :param timeout: float, seconds
+        :return: (httplib.HTTPConnection, bool), the bool is True for a reused connection
+        """
+        with self._lock:
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+        if conn is not None:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn, True
+        return self._connect(key, timeout), False
+
+    def put(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.itervalues():
+            for conn in connections:
+                conn.close()
+
+    def _connect(self, key, timeout):
+        scheme, host, port, proxy = key
+        connection_class = httplib.HTTPSConnection if scheme == 'https' else httplib.HTTPConnection
+        if proxy is None:
+            return connection_class(host, port, timeout=timeout)
+        proxy = urlparse.urlsplit(proxy)
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(proxy.hostname, proxy.port or 80, timeout=timeout)
+            conn.set_tunnel(host, port)
+            return conn
+        return httplib.HTTPConnection(proxy.hostname, proxy.port or 80, timeout=timeout)
+
+
+class Response:
+    """
+    File-like body of a response, inflated as it is read. Closing it puts the
+    connection back in the pool if the body was read completely.
+    """
+
+    def __init__(self, pool, key, conn, raw, url, throttle=None):
+        self.code = raw.status
+        self.msg = raw.reason
+        self.url = url
+        self.headers = raw.msg
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._raw = raw
+        body = _ThrottledReader(raw, throttle) if throttle else raw
+        encoding = (raw.getheader('Content-Encoding') or '').strip().lower()
+        if encoding in ('gzip', 'x-gzip'):
+            self._body = DecompressingReader(body, 'gzip')
+        elif encoding == 'deflate':
+            self._body = DecompressingReader(body, 'deflate')
+        else:
+            self._body = body
+
+    def info(self):
+        return self.headers
+
+    def getcode(self):
+        return self.code
+
+    def geturl(self):
+        return self.url
+
+    def getheader(self, name, default=None):
+        return self._raw.getheader(name, default)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self._body.read()
+        return self._body.read(size)
+
+    def close(self):
+        if self._conn is None:
+            return
+        raw = self._raw
+        if not raw.isclosed() and not raw.chunked and raw.length is not None and raw.length <= DRAIN_LIMIT:
+            try:
+                raw.read()
+            except (httplib.HTTPException, socket.error):
+                pass
+        if raw.isclosed() and not raw.will_close:
+            self._pool.put(self._key, self._conn)
+        else:
+            self._conn.close()
+        self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _ThrottledReader:
+    # reports the bytes read off the wire, before they are inflated
+
+    def __init__(self, fileobj, throttle):
+        self.fileobj = fileobj
+        self.throttle = throttle
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        if data:
+            self.throttle(len(data))
+        return data
+
+
+_pool = ConnectionPool()
+
+
+def open_url(url, headers=None, timeout=None, pool=None, throttle=None):
+    """
+    GET request following redirects
+    :param url: str
+    :param headers: dict|None, extra request headers
+    :param timeout: float|None, seconds, ckanext.datajson.harvest.timeout if None
+    :param pool: ConnectionPool|None, the process wide pool if None
+    :param throttle: callable|None, called with the number of bytes of each
+        read of the body, before they are inflated
+    :return: Response, to be closed by the caller
+    :raises urllib2.HTTPError: for status codes from 300 up that are not
+        followed redirects
+    :raises urllib2.URLError: if the server cannot be reached
+    """
+    if timeout is None:
+        timeout = float(config.get('ckanext.datajson.harvest.timeout', DEFAULT_TIMEOUT))
+    pool = pool or _pool
+    request_headers = {
+        'User-Agent': config.get('ckanext.datajson.harvest.user_agent', DEFAULT_USER_AGENT),
+        'Accept-Encoding': 'gzip, deflate',
+    }
+    request_headers.update(headers or {})
+
+    for redirect in range(MAX_REDIRECTS + 1):
+        response = _request(pool, url, request_headers, timeout, throttle)
+        location = response.getheader('Location')
+        if response.code in REDIRECT_CODES and location and redirect < MAX_REDIRECTS:
+            response.close()
+            url = urlparse.urljoin(url, location)
+            continue
+        if response.code >= 300:
+            response.close()
+            raise urllib2.HTTPError(url, response.code, response.msg, response.headers, None)
+        return response
+
+
+def download(url, fileobj, headers=None, timeout=None, pool=None, throttle=None, retries=None, backoff=None):
+    """
+    Writes the inflated body of url to fileobj. Dropped connections, timeouts
+    and temporary server errors are retried after backoff, 2 * backoff, 4 *
+    backoff... seconds; a partial body is resumed with a Range request if the
+    server supports it and the file has not changed, otherwise it is
+    downloaded again. The size of the body is checked against its
+    Content-Length and, if the server sends a Digest header for a body that is
+    not content-encoded, its digest.
+    :param url: str
+    :param fileobj: file-like object open for reading and writing, positioned
+        at its start
+    :param headers, timeout, pool, throttle: see open_url
+    :param retries: int|None, ckanext.datajson.harvest.retries if None
+    :param backoff: float|None, seconds, ckanext.datajson.harvest.retry_backoff if None
+    :return: (Response, str), the closed response of the first request that
+        returned the whole file, for its status and headers, and the sha1 hex
+        digest of the body
+    :raises urllib2.HTTPError: see open_url
+    :raises urllib2.URLError: if the server cannot be reached, or
+        IncompleteDownload if the body could not be read completely, once
+        the retries are used up
+    """
+    if retries is None:
+        retries = int(config.get('ckanext.datajson.harvest.retries', DEFAULT_RETRIES))
+    if backoff is None:
+        backoff = float(config.get('ckanext.datajson.harvest.retry_backoff', DEFAULT_BACKOFF))
+    state = _Download(url, fileobj)
+    attempt = 0
+    while True:
+        size = state.size
+        try:
+            return state.fetch(headers, timeout, pool, throttle)
+        except urllib2.HTTPError as e:
+            if e.code not in RETRY_CODES or attempt >= retries:
+                raise
+            error = e
+            retry_after = e.hdrs.getheader('Retry-After') if e.hdrs else None
+            delay = int(retry_after) if retry_after and retry_after.isdigit() else None
+        except (urllib2.URLError, httplib.HTTPException, socket.error) as e:
+            if attempt >= retries:
+                if isinstance(e, urllib2.URLError):
+                    raise
+                raise IncompleteDownload(e)
+            error = e
+            delay = None
+        if state.size > size:
+            # the download is getting somewhere, keep going
+            attempt = 0
+        if delay is None:
+            delay = backoff * 2 ** attempt * random.uniform(0.5, 1)
+        delay = min(delay, MAX_BACKOFF)
+        log.warn('Download of %s failed after %d bytes (%s), retrying in %.1fs', url, state.size, error, delay)
+        time.sleep(delay)
+        attempt += 1
+
+
+class IncompleteDownload(urllib2.URLError):
+    pass
+
+
+class _Download:
+    # what was downloaded of a file so far
+
+    def __init__(self, url, fileobj):
+        self.url = url
+        self.fileobj = fileobj
+        self.size = 0
+        self.digest = hashlib.sha1()
+        self.response = None
+        # whether the body of the response was content-encoded on the wire
+        self.encoded = False
+        # ETag or Last-Modified date of the file, to resume its download with
+        self.validator = None
+
+    def fetch(self, headers, timeout, pool, throttle):
+        request_headers = dict(headers or {})
+        if self.size and self.validator:
+            # the byte offsets of the identity encoding are those of the inflated body
+            request_headers.update({'Range': 'bytes=%d-' % self.size, 'If-Range': self.validator,
+                                    'Accept-Encoding': 'identity'})
+        try:
+            response = open_url(self.url, request_headers, timeout, pool, throttle)
+        except urllib2.HTTPError as e:
+            if e.code != 416 or 'Range' not in request_headers:
+                raise
+            self.validator = None
+            raise IncompleteDownload('%s cannot be resumed at %d bytes' % (self.url, self.size))
+        try:
+            if response.code == 206:
+                start, expected = _content_range(response.getheader('Content-Range'))
+                if start != self.size:
+                    self.validator = None
+                    raise IncompleteDownload('%s answered with a range from %s, not %d'
+                                             % (self.url, start, self.size))
+                log.info('Resuming download of %s at %d bytes', self.url, self.size)
+            else:
+                if self.size:
+                    self._restart()
+                self.response = response
+                self.validator = _range_validator(response)
+                length = response.getheader('Content-Length')
+                self.encoded = (response.getheader('Content-Encoding') or 'identity').lower() != 'identity'
+                expected = int(length) if length and length.isdigit() and not self.encoded else None
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.digest.update(chunk)
+                self.fileobj.write(chunk)
+                self.size += len(chunk)
+        finally:
+            response.close()
+
+        if expected is not None and self.size != expected:
+            raise IncompleteDownload('%s ended after %d of %d bytes' % (self.url, self.size, expected))
+        # the Digest of a content-encoded response is that of the encoded
+        # bytes, which are not kept
+        instance_digest = None if self.encoded else _instance_digest(self.response.getheader('Digest'))
+        if instance_digest and not self._check(*instance_digest):
+            self._restart()
+            raise IncompleteDownload('%s does not match its %s digest' % (self.url, instance_digest[0]))
+        return self.response, self.digest.hexdigest()
+
+    def _restart(self):
+        self.fileobj.seek(0)
+        self.fileobj.truncate()
+        self.size = 0
+        self.digest = hashlib.sha1()
+
+    def _check(self, algorithm, expected):
+        digest = hashlib.new(algorithm)
+        self.fileobj.seek(0)
+        while True:
+            chunk = self.fileobj.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+        self.fileobj.seek(0, 2)
+        return digest.digest() == expected
+
+
+def _content_range(header):
+    # (first byte, total size or None) of a "bytes first-last/total" Content-Range
+    m = re.match(r'bytes\s+(\d+)-\d+/(\d+|\*)$', (header or '').strip())
+    if not m:
+        return None, None
+    return int(m.group(1)), int(m.group(2)) if m.group(2) != '*' else None
+
+
+def _range_validator(response):
+    # weak ETags cannot be used with If-Range
+    if (response.getheader('Accept-Ranges') or '').lower() == 'none':
+        return None
+    etag = response.getheader('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.getheader('Last-Modified')
+
+
+def _instance_digest(header):
+    # (hashlib algorithm, digest) of the first known algorithm of a RFC 3230 Digest header
+    for value in (header or '').split(','):
+        algorithm, _, encoded = value.strip().partition('=')
+        algorithm = DIGEST_ALGORITHMS.get(algorithm.lower())
+        if algorithm:
+            try:
+                return algorithm, base64.b64decode(encoded)
+            except TypeError:
+                pass
+    return None
+
+
+def close_connections():
+    """
+    Closes the idle connections of the process wide pool
+    """
+    _pool.clear()
+
+
+def _request(pool, url, headers, timeout, throttle=None):
+    parts = urlparse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme not in ('http', 'https') or not parts.hostname:
+        raise urllib2.URLError('unsupported URL: %s' % url)
+    port = parts.port or (443 if scheme == 'https' else 80)
+    proxy = _proxy(scheme, parts.hostname)
+    if proxy and scheme == 'http':
+        # plain HTTP proxies get the absolute URL
+        path = urlparse.urlunsplit((scheme, parts.netloc, parts.path or '/', parts.query, ''))
+    else:
+        path = urlparse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+    key = (scheme, parts.hostname, port, proxy)
+
+    while True:
+        conn, reused = pool.get(key, timeout)
+        try:
+            conn.request('GET', path, headers=headers)
+            raw = conn.getresponse()
+        except (httplib.HTTPException, socket.error) as e:
+            conn.close()
+            if reused:
+                # the server closed the idle connection, try a new one
+                log.debug('Reused connection to %s failed (%s), reconnecting', parts.hostname, e)
+                continue
+            raise urllib2.URLError(e)
+        return Response(pool, key, conn, raw, url, throttle)
+
+
+def _proxy(scheme, host):
+    # the proxy from the environment, like urllib2
+    proxy = urllib.getproxies().get(scheme)
+    if proxy and not urllib.proxy_bypass(host):
+        return proxy
+    return None
@@ -0,0 +1,264 @@
+import codecs
+import json
+import re
+import zlib
+from codecs import BOM_UTF8
+from json.scanner import py_make_scanner
+
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+NUMBER_CHARS = frozenset('0123456789.eE+-')
+# json errors raised when a string is cut off by the end of the buffer
+TRUNCATION_ERRORS = ('Unterminated string', 'end is out of bounds')
+ERROR_POSITION = re.compile(r'^(.*?):? line \d+ column \d+ \(char (\d+)\)')
+
+
+class DecompressingReader:
+    """
+    Read-only file-like object inflating a gzip or deflate encoded stream as
+    it is read, e.g. a request or response body sent with Content-Encoding.
+    """
+
+    def __init__(self, fileobj, encoding='gzip'):
+        self.fileobj = fileobj
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._decompressor = None  # deflate, zlib wrapped or raw, decided on first read
+        self._buffer = ''
+        self._eof = False
+
+    def _fill(self, size):
+        # inflate no more than was asked for, a small compressed body can
+        # expand to gigabytes; the input left over is kept for the next read
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            if self._decompressor is not None and self._decompressor.unconsumed_tail:
+                chunk = self._decompressor.unconsumed_tail
+            else:
+                chunk = self.fileobj.read(CHUNK_SIZE)
+            if self._decompressor is None:
+                # some servers send raw deflate data without the zlib header
+                if chunk[:1] and ord(chunk[0]) & 0x0f == 8:
+                    self._decompressor = zlib.decompressobj()
+                else:
+                    self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            if not chunk:
+                self._buffer += self._decompressor.flush()
+                self._eof = True
+            else:
+                wanted = CHUNK_SIZE if size < 0 else size - len(self._buffer)
+                self._buffer += self._decompressor.decompress(chunk, wanted)
+
+    def read(self, size=-1):
+        self._fill(size)
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        if hasattr(self.fileobj, 'close'):
+            self.fileobj.close()
+
+
+class LimitedReader:
+    """
+    Stops reading a stream after length bytes, for WSGI input streams that
+    never signal the end of the request body.
+    """
+
+    def __init__(self, fileobj, length):
+        self.fileobj = fileobj
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return ''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+class JsonStreamParser:
+    """
+    Incremental reader for data.json documents.
+
+    Walks the top level structure of the document itself and hands each
+    dataset (or catalog header value) to the json module once it has been read
+    completely, so memory use is bounded by the largest single dataset rather
+    than by the size of the whole catalog.
+    """
+
+    def __init__(self, fileobj, encoding='utf-8', chunk_size=CHUNK_SIZE):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder(encoding=encoding)
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.offset = 0  # bytes dropped from the front of buf
+        self.top_level = None  # '[' or '{' once the document has started
+
+    def _read_more(self, size=None):
+        if self.eof:
+            return False
+        if self.pos > self.chunk_size:
+            # forget what has already been parsed
+            self.offset += self.pos
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        chunk = self.fileobj.read(max(size or 0, self.chunk_size))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf += chunk
+        return True
+
+    def _py_decoder(self):
+        decoder = json.JSONDecoder(encoding=self.decoder.encoding)
+        decoder.scan_once = py_make_scanner(decoder)
+        return decoder
+
+    def _error(self, msg):
+        return ValueError('%s: char %d' % (msg, self.offset + self.pos))
+
+    def _peek(self):
+        # skip whitespace and return the next significant character, '' at the end
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._read_more():
+                return ''
+
+    def _expect(self, chars):
+        c = self._peek()
+        if c == '' or c not in chars:
+            raise self._error('Expecting %s' % ' or '.join(repr(x) for x in chars))
+        self.pos += 1
+        return c
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a number at the end of the buffer may continue in the next chunk
+                if self.eof or not (isinstance(value, (int, long, float)) and not isinstance(value, bool)
+                                    and (end == len(self.buf) or
+                                         (self.buf[end] in NUMBER_CHARS and len(self.buf) - end < 64))):
+                    self.pos = end
+                    return value
+            except UnicodeDecodeError:
+                # the document is not in self.decoder.encoding, reading more won't help
+                raise
+            except ValueError as e:
+                # errors well before the end of the buffer will not go away by
+                # reading more, don't pull the rest of the stream into memory
+                m = ERROR_POSITION.search(unicode(e))
+                if not m:
+                    # the C scanner does not tell where nested values fail, ask the python one
+                    try:
+                        self._py_decoder().raw_decode(self.buf, self.pos)
+                    except ValueError as py_e:
+                        e = py_e
+                        m = ERROR_POSITION.search(unicode(e))
+                position = int(m.group(2)) if m else self.pos
+                if self.eof or (not unicode(e).startswith(TRUNCATION_ERRORS)
+                                and position < len(self.buf) - 8):
+                    self.pos = position
+                    raise self._error(m.group(1) if m else unicode(e))
+            # read at least as much again as is buffered, so large values
+            # are not parsed over and over
+            if not self._read_more(len(self.buf) - self.pos):
+                if self.pos >= len(self.buf):
+                    raise self._error('Expecting value')
+
+    def _array_items(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._expect(',]') == ']':
+                return
+
+    def events(self):
+        """
+        Yields ('dataset', item) for every dataset, ('header', (key, value))
+        for the other top level fields of a catalog object and ('value', value)
+        if the document is neither an array nor an object.
+        """
+        while len(self.buf) < len(BOM_UTF8) and self._read_more():
+            pass
+        if self.buf.startswith(BOM_UTF8):
+            self.pos = len(BOM_UTF8)
+
+        c = self._peek()
+        self.top_level = c
+        if c == '[':
+            for item in self._array_items():
+                yield 'dataset', item
+        elif c == '{':
+            self.pos += 1
+            if self._peek() == '}':
+                self.pos += 1
+            else:
+                while True:
+                    if self._peek() != '"':
+                        raise self._error('Expecting property name')
+                    key = self._value()
+                    self._expect(':')
+                    if key == 'dataset' and self._peek() == '[':
+                        for item in self._array_items():
+                            yield 'dataset', item
+                    else:
+                        yield 'header', (key, self._value())
+                    if self._expect(',}') == '}':
+                        break
+        else:
+            yield 'value', self._value()
+
+        if self._peek() != '':
+            raise self._error('Extra data')
+
+
+def detect_encoding(fileobj, encodings=('utf-8', 'cp1252', 'iso-8859-1')):
+    """
+    The first of encodings a whole seekable file decodes with. A UTF-8 BOM is
+    valid UTF-8 and skipped by JsonStreamParser. The file is rewound.
+    :param fileobj: seekable file-like object
+    :param encodings: list of str, the last one is returned if none fits
+    :return: str
+    """
+    for encoding in encodings[:-1]:
+        fileobj.seek(0)
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            while True:
+                chunk = fileobj.read(CHUNK_SIZE)
+                decoder.decode(chunk, not chunk)
+                if not chunk:
+                    break
+        except UnicodeDecodeError:
+            continue
+        fileobj.seek(0)
+        return encoding
+    fileobj.seek(0)
+    return encodings[-1]
+
+
+def iter_catalog(fileobj, encoding='utf-8'):
+    """
+    Parses a data.json stream incrementally, see JsonStreamParser.events
+    :param fileobj: file-like object
+    :param encoding: str
+    :return: generator of (kind, value) tuples
+    """
+    return JsonStreamParser(fileobj, encoding).events()
@@ -0,0 +1,246 @@
+"""
+Validates local data.json files without a CKAN site:
+
+    datajson-validate [options] FILE_OR_DIRECTORY [...]
+
+Every file is stream parsed and checked against the POD rules of
+datajsonvalidator and the bundled pod_schema JSON schema, one file per worker
+process. The aggregated report is printed as text or JSON. The exit status is
+0 when every file is valid, 1 otherwise.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from datajsonvalidator import do_incremental_validation, add_error, format_errors
+from jsonstream import JsonStreamParser, DecompressingReader
+from schema_validators import SCHEMA_FILES, schema_variant, get_schema_validator, readable_error
+
+CONFORMS_TO_V11 = 'https://project-open-data.cio.gov/v1.1/schema'
+# schema errors listed per file in the text report
+MAX_TEXT_SCHEMA_ERRORS = 20
+
+
+def find_files(paths):
+    """
+    The files to validate, directories are searched for *.json and *.json.gz
+    :param paths: list of str
+    :return: list of str
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                for name in sorted(names):
+                    if name.endswith(('.json', '.json.gz')):
+                        files.append(os.path.join(root, name))
+        else:
+            files.append(path)
+    return files
+
+
+def validate_file(path, schema='auto', non_federal=False):
+    """
+    Validates one data.json file, reading it one dataset at a time
+    :param path: str, the file, gzip compressed if it ends in .gz
+    :param schema: str, 'auto' to pick the schema from the structure of the
+        file, 'none' to skip the schema checks or a bundled schema name
+    :param non_federal: bool, use the non-federal schema when schema is 'auto'
+    :return: dict
+    """
+    started = time.time()
+    cpu_started = time.clock()
+    result = {
+        'file': path,
+        'datasets': 0,
+        'schema': schema if schema not in ('auto', 'none') else None,
+        'errors': [],
+        'schema_errors': [],
+    }
+    state = {'invalid_json': None, 'bad_structure': False, 'conforms_to': None, 'complete': False}
+
+    def datasets(parser):
+        try:
+            for kind, value in parser.events():
+                if kind == 'dataset':
+                    if result['datasets'] == 0 and schema == 'auto':
+                        # a catalog object is POD 1.1, a bare array 1.0
+                        result['schema'] = schema_variant('non-federal' if non_federal else None,
+                                                          '1.1' if parser.top_level == '{' else '1.0')
+                    result['datasets'] += 1
+                    if result['schema'] is not None:
+                        check_schema(value)
+                    yield value
+                elif kind == 'header':
+                    if value[0] == 'conformsTo':
+                        state['conforms_to'] = value[1]
+                else:
+                    state['bad_structure'] = True
+            state['complete'] = True
+        except ValueError as e:
+            state['invalid_json'] = e
+
+    def check_schema(dataset):
+        messages = [readable_error(e) for e in get_schema_validator(result['schema']).iter_errors(dataset)]
+        if messages:
+            identifier = dataset.get('identifier') if isinstance(dataset, dict) else None
+            result['schema_errors'].append({
+                'dataset': result['datasets'],
+                'identifier': identifier or 'Unknown',
+                'errors': messages,
+            })
+
+    try:
+        f = open(path, 'rb')
+    except IOError as e:
+        result['errors'] = [("Error Loading File", ["The file could not be opened: " + unicode(e)])]
+    else:
+        try:
+            if path.endswith('.gz'):
+                f = DecompressingReader(f, 'gzip')
+            parser = JsonStreamParser(f)
+            do_incremental_validation(datasets(parser), result['errors'], set())
+        except Exception as e:
+            result['errors'].append(("Internal Error", ["Something bad happened: " + unicode(e)]))
+        finally:
+            f.close()
+
+    if state['invalid_json'] is not None:
+        result['errors'] = [("Invalid JSON", ["The file does not meet basic JSON syntax requirements: " + unicode(
+            state['invalid_json']) + ". Try using JSONLint.com."])]
+    elif state['bad_structure']:
+        errs = {}
+        add_error(errs, 0, "Bad JSON Structure",
+                  "The file must be an array at its top level. "
+                  "That means the file starts with an open bracket [ and ends with a close bracket ].")
+        result['errors'] = []
+        format_errors(errs, result['errors'])
+    elif state['complete'] and parser.top_level == '{' and state['conforms_to'] != CONFORMS_TO_V11:
+        result['errors'].append(("Invalid Catalog", ["The catalog's conformsTo is %s, not %s." % (
+            'missing' if state['conforms_to'] is None else json.dumps(state['conforms_to']), CONFORMS_TO_V11)]))
+
+    result['valid'] = not result['errors'] and not result['schema_errors']
+    result['seconds'] = round(time.time() - started, 3)
+    result['cpu_seconds'] = round(time.clock() - cpu_started, 3)
+    return result
+
+
+def _validate_file_job(args):
+    # Pool.imap only passes one argument
+    path, schema, non_federal = args
+    return validate_file(path, schema, non_federal)
+
+
+def validate_files(paths, processes=None, schema='auto', non_federal=False):
+    """
+    Validates files in parallel, one file per worker process
+    :param paths: list of str
+    :param processes: int|None, number of worker processes, one per CPU if None
+    :param schema: str, see validate_file
+    :param non_federal: bool, see validate_file
+    :return: dict, the report
+    """
+    started = time.time()
+    processes = processes or multiprocessing.cpu_count()
+    jobs = [(path, schema, non_federal) for path in paths]
+    if processes == 1 or len(jobs) < 2:
+        results = map(_validate_file_job, jobs)
+    else:
+        pool = multiprocessing.Pool(min(processes, len(jobs)))
+        try:
+            # biggest files first so one large file does not finish last on its own
+            jobs.sort(key=lambda job: -_file_size(job[0]))
+            results = list(pool.imap_unordered(_validate_file_job, jobs))
+        finally:
+            pool.close()
+            pool.join()
+        order = dict((path, i) for i, path in enumerate(paths))
+        results.sort(key=lambda r: order[r['file']])
+
+    seconds = time.time() - started
+    datasets = sum(r['datasets'] for r in results)
+    return {
+        'valid': all(r['valid'] for r in results),
+        'files': len(results),
+        'invalid_files': len([r for r in results if not r['valid']]),
+        'datasets': datasets,
+        'processes': processes,
+        'seconds': round(seconds, 3),
+        'cpu_seconds': round(sum(r['cpu_seconds'] for r in results), 3),
+        'datasets_per_second': round(datasets / seconds, 1) if seconds else None,
+        'results': results,
+    }
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def format_text_report(report, max_schema_errors=MAX_TEXT_SCHEMA_ERRORS):
+    """
+    :param report: dict, as returned by validate_files
+    :param max_schema_errors: int, schema errors listed per file
+    :return: unicode
+    """
+    lines = []
+    for r in report['results']:
+        lines.append(u'%s: %s, %d datasets, %.2fs' % (
+            r['file'], 'valid' if r['valid'] else 'INVALID', r['datasets'], r['seconds']))
+        for heading, descriptions in r['errors']:
+            lines.append(u'  %s' % heading)
+            for description in descriptions:
+                lines.append(u'    %s' % description)
+        if r['schema_errors']:
+            lines.append(u'  %d datasets do not validate against the %s schema' % (
+                len(r['schema_errors']), r['schema']))
+            for error in r['schema_errors'][:max_schema_errors]:
+                lines.append(u'    dataset %d (%s): %s' % (
+                    error['dataset'], error['identifier'], u'; '.join(error['errors'])))
+            if len(r['schema_errors']) > max_schema_errors:
+                lines.append(u'    ... and %d more' % (len(r['schema_errors']) - max_schema_errors))
+    lines.append(u'')
+    lines.append(u'%d files, %d invalid, %d datasets in %.1fs (%.1fs cpu, %d processes, %s datasets/s)' % (
+        report['files'], report['invalid_files'], report['datasets'], report['seconds'],
+        report['cpu_seconds'], report['processes'], report['datasets_per_second']))
+    return u'\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='datajson-validate',
+        description='Validates local data.json files against the Project Open Data rules and schema.')
+    parser.add_argument('paths', nargs='+', metavar='FILE_OR_DIRECTORY',
+                        help='data.json files (optionally .gz), directories are searched for *.json')
+    parser.add_argument('-p', '--processes', type=int, default=None,
+                        help='number of worker processes (default: one per CPU)')
+    parser.add_argument('-f', '--format', choices=('text', 'json'), default='text',
+                        help='report format (default: text)')
+    parser.add_argument('-s', '--schema', choices=['auto', 'none'] + sorted(SCHEMA_FILES), default='auto',
+                        help='JSON schema to check the datasets against (default: auto, POD 1.1 for catalog '
+                             'objects and 1.0 for bare arrays)')
+    parser.add_argument('--non-federal', action='store_true',
+                        help='use the non-federal schemas with --schema auto')
+    args = parser.parse_args(argv)
+
+    paths = find_files(args.paths)
+    if not paths:
+        parser.error('no data.json files found')
+    report = validate_files(paths, args.processes, args.schema, args.non_federal)
+
+    if args.format == 'json':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        sys.stdout.write(format_text_report(report).encode('utf-8') + '\n')
+    return 0 if report['valid'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,6 +15,8 @@ class Package2Pod:
         pass
 
     seen_identifiers = None
+    # identifier to owning package of the exported packages, see db.identifier_owners
+    identifier_owners = None
 
     @staticmethod
     def wrap_json_catalog(dataset_dict, json_export_map):
@@ -173,12 +175,41 @@ class Package2Pod:
                     or dataset_dict.get('dataQuality') == "False":
                 dataset_dict['dataQuality'] = False
 
-            errors = []
+            from datajsonvalidator import do_validation, RULES_VERSION
+            from validation_cache import cached_result
+
+            from db import identifier_owner
+
+            # The only state do_validation reads is whether the identifier is a
+            # duplicate. The site wide identifier index decides that when it knows
+            # the identifier, so duplicates across organizations and separate
+            # exports are caught too; otherwise only this run is considered.
+            identifier = dataset_dict.get('identifier')
+            has_identifier = isinstance(identifier, (str, unicode)) and identifier.strip() != ''
+            duplicate = has_identifier and identifier in Package2Pod.seen_identifiers
+            if has_identifier:
+                if Package2Pod.identifier_owners is not None:
+                    owner = Package2Pod.identifier_owners.get(identifier)
+                else:
+                    owner = identifier_owner(identifier)
+                if owner:
+                    duplicate = owner != pkg.get('id')
+
+            def validate():
+                errors = []
+                do_validation([dict(dataset_dict)], errors, set([identifier]) if duplicate else set())
+                return errors
+
+            variant = 'rules@' + RULES_VERSION
+            if duplicate:
+                variant += '+duplicate'
             try:
-                from datajsonvalidator import do_validation
-                do_validation([dict(dataset_dict)], errors, Package2Pod.seen_identifiers)
+                errors = cached_result(dict(dataset_dict), variant, validate)
             except Exception as e:
-                errors.append(("Internal Error", ["Something bad happened: " + unicode(e)]))
+                # not cached, the next export validates the entry again
+                errors = [("Internal Error", ["Something bad happened: " + unicode(e)])]
+            if has_identifier:
+                Package2Pod.seen_identifiers.add(identifier)
             if len(errors) > 0:
                 for error in errors:
                     log.warn(error)
@@ -0,0 +1,106 @@
+"""
+Names of the packages created by the harvest.
+"""
+import hashlib
+
+from ckan.lib.munge import munge_title_to_name
+
+from ckanext.datajson.db import package_names_in_use, reserve_package_names
+
+
+def package_slug(title):
+    """
+    :param title: str, title of a dataset
+    :return: str, URL friendly name made of it
+    """
+    name = munge_title_to_name(title).replace('_', '-')
+    while '--' in name:
+        name = name.replace('--', '-')
+    return name[0:90]  # max length is 100
+
+
+class PackageNameAllocator(object):
+    """
+    Gives packages names made of their titles that no other package uses or
+    has reserved, and reserves them. The names sharing the slugs of a batch of
+    titles are loaded with one query, and the names chosen are reserved
+    together, so a batch of new packages needs neither a query per package
+    nor a rollback when another worker chose a name first.
+
+    A package whose slug is taken gets the slug with a suffix made of its id,
+    so it gets the same name whichever worker imports it. A package that
+    exists already keeps its name then.
+    """
+
+    def __init__(self):
+        self.in_use = {}
+        self._package_names = {}
+        self._allocated = {}
+        self._loaded_slugs = set()
+        self._loaded_ids = set()
+
+    def allocate_all(self, packages):
+        """
+        Chooses and reserves the names of a batch of packages
+        :param packages: list of (title, package id)
+        """
+        wanted = dict((package_id, package_slug(title)) for title, package_id in packages
+                      if package_id not in self._allocated)
+        self._load(set(wanted.values()), wanted.keys())
+        while wanted:
+            names = {}
+            for package_id, slug in sorted(wanted.items()):
+                name = self._choose(slug, package_id)
+                names[name] = package_id
+                self.in_use[name] = package_id
+            reserved = reserve_package_names(names)
+            for name, package_id in names.iteritems():
+                if name in reserved:
+                    self._allocated[package_id] = (wanted.pop(package_id), name)
+            if wanted:
+                # another worker reserved some of the names meanwhile
+                for name, package_id in names.iteritems():
+                    if name not in reserved:
+                        del self.in_use[name]
+                self._load(set(wanted.values()), wanted.keys(), reload=True)
+
+    def allocate(self, title, package_id):
+        """
+        :param title: str
+        :param package_id: str
+        :return: str, the reserved name of the package
+        """
+        slug = package_slug(title)
+        if self._allocated.get(package_id, (None,))[0] != slug:
+            self._allocated.pop(package_id, None)
+            self.allocate_all([(title, package_id)])
+        return self._allocated[package_id][1]
+
+    def _choose(self, slug, package_id):
+        owner = self.in_use.get(slug)
+        if owner is None or owner == package_id:
+            # Note that if we're updating an existing package we will be
+            # updating this package's URL, so incoming links may break.
+            return slug
+        if package_id in self._package_names:
+            # Prevent spurious updates to the package's URL by reusing the
+            # existing package's name.
+            return self._package_names[package_id]
+        suffix = hashlib.sha1((package_id or '').encode('utf8')).hexdigest()[:5]
+        name = '%s-%s' % (slug, suffix)
+        n = 2
+        while self.in_use.get(name, package_id) != package_id:
+            name = '%s-%s-%d' % (slug, suffix, n)
+            n += 1
+        return name
+
+    def _load(self, slugs, package_ids, reload=False):
+        if not reload:
+            slugs = set(slugs) - self._loaded_slugs
+            package_ids = set(package_ids) - self._loaded_ids
+        for name, package_id, reserved in package_names_in_use(slugs, package_ids):
+            self.in_use[name] = package_id
+            if not reserved and package_id in package_ids:
+                self._package_names[package_id] = name
+        self._loaded_slugs.update(slugs)
+        self._loaded_ids.update(package_ids)
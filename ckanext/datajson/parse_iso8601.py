@@ -0,0 +1,380 @@
+"""
+Recognizers for the ISO 8601 dates, durations and repeating intervals the
+Project Open Data schema allows in modified, temporal and issued.
+
+They accept exactly the strings matched by the MODIFIED_REGEX_*,
+TEMPORAL_REGEX_* and ISSUED_REGEX patterns of datajsonvalidator, including
+their quirks (a trailing newline is accepted, ordinal day 360 is not, the end
+of a temporal range reuses the separators of its start), but read the value
+left to right keeping only the set of positions the grammar can be at, so the
+time spent is linear in the length of the value whatever it contains.
+
+The shapes nearly every catalog uses (2015-01-01, 2015-01-01T10:20:30Z, week
+dates, R/P1Y, R/2015-01-01/P1Y and ranges of them) are recognized by small
+unambiguous patterns first, and values that cannot start a date or a
+duration, or have an impossible month or day, are rejected without parsing
+them, so these are not slower than with the regexes.
+"""
+import re
+
+_DATE = r'\d{4}-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])'
+_WEEK_DATE = r'\d{4}-W([0-4]\d|5[0-2])(-[1-7])?'
+_TIME = r'T([01]\d|2[0-3]):[0-5]\d:[0-5]\d([.,]\d{1,9})?([zZ]|[+-]([01]\d|2[0-3]):[0-5]\d)?'
+_REPEAT = r'(R\d*/)?'
+_DURATION = r'P(\d+Y)?(\d+M)?(\d+W)?(\d+D)?(T(\d+H)?(\d+M)?(\d+S)?)?'
+COMMON_DATE = re.compile(r'^(%s|%s)(%s)?$' % (_DATE, _WEEK_DATE, _TIME))
+# the end of a range can only have seconds if the start has minutes
+COMMON_DATE_RANGE = re.compile(r'^%s(%s/%s(%s)?|/%s)$' % (_DATE, _TIME, _DATE, _TIME, _DATE))
+COMMON_DURATION = re.compile(r'^%s%s$' % (_REPEAT, _DURATION))
+COMMON_DATE_DURATION = re.compile(r'^%s%s(%s)?/%s$' % (_REPEAT, _DATE, _TIME, _DURATION))
+COMMON_DURATION_DATE = re.compile(r'^%s%s/%s(%s)?$' % (_REPEAT, _DURATION, _DATE, _TIME))
+# the duration patterns backtrack over long runs of digits, longer values
+# are left to the parser
+COMMON_DURATION_LENGTH = 64
+# a month or day out of range after a four digit year and a dash cannot be
+# an ordinal or week date either
+IMPOSSIBLE_DATE = re.compile(r'^[+-]?\d{4}-(?!(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01]))\d\d-\d\d')
+# first characters of a date (a signed year or a year), a duration or a
+# repeating interval
+FIRST_CHARS = frozenset('+-0123456789PR')
+
+DIGITS = frozenset('0123456789')
+DIGIT_RUN = re.compile(r'\d*')
+WORD_CHARS = frozenset('0123456789_abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+WEEKDAYS = frozenset('1234567')
+# [T\s]
+TIME_MARKERS = frozenset('T \t\n\r\f\v')
+DURATION_DATE_UNITS = 'YMWD'
+DURATION_TIME_UNITS = 'HMS'
+
+
+def _digits(s, i, count):
+    if len(s) < i + count:
+        return False
+    for c in s[i:i + count]:
+        if c not in DIGITS:
+            return False
+    return True
+
+
+def _two_digits(s, i, low, high):
+    return _digits(s, i, 2) and low <= s[i:i + 2] <= high
+
+
+def _digit_run(s, i):
+    return DIGIT_RUN.match(s, i).end()
+
+
+def _ends(s, i):
+    # the end of a value, or a trailing newline just like $ in a regex
+    n = len(s)
+    return i == n or (i == n - 1 and s[i] == '\n')
+
+
+def _time_ends(s, i, seconds_separator=None, own_separator=True):
+    """
+    Positions where the optional time part starting at i can end, with the
+    separator used between hours and minutes (None if there are no minutes)
+    :param s: str
+    :param i: int, position right after the date
+    :param seconds_separator: str|None, separator required before the seconds
+        when own_separator is False
+    :param own_separator: bool, whether the seconds use the separator of these
+        minutes or seconds_separator
+    :return: list of (int, str|None)
+    """
+    if i >= len(s) or s[i] not in TIME_MARKERS:
+        return []
+    i += 1
+
+    # hours and minutes, possibly with a decimal fraction
+    hours = [(i, None)]
+    if _two_digits(s, i, '00', '23'):
+        j = i + 2
+        hours.append((j, None))
+        if s[j:j + 1] == ':' and _two_digits(s, j + 1, '00', '59'):
+            hours.append((j + 3, ':'))
+        if _two_digits(s, j, '00', '59'):
+            hours.append((j + 2, ''))
+    elif s[i:i + 2] == '24':
+        if s[i + 2:i + 5] == ':00':
+            hours.append((i + 5, None))
+        if s[i + 2:i + 4] == '00':
+            hours.append((i + 4, None))
+    for j, separator in hours[1:]:
+        if s[j:j + 1] in ('.', ','):
+            end = _digit_run(s, j + 1)
+            # a fraction may stop anywhere in its digits, but the only places
+            # not followed by a digit are the end of the digits and two digits
+            # before it, where seconds written without a separator can start
+            if end > j + 1 and s[end:end + 1] != ':':
+                hours.append((end, separator))
+            if end - 2 > j + 1:
+                hours.append((end - 2, separator))
+
+    results = []
+    for j, separator in hours:
+        if own_separator:
+            seconds_separator = separator
+        ends = [j]
+        if seconds_separator is not None and s.startswith(seconds_separator, j) \
+                and _two_digits(s, j + len(seconds_separator), '00', '59'):
+            k = j + len(seconds_separator) + 2
+            ends.append(k)
+            if s[k:k + 1] in ('.', ',') and s[k + 1:k + 2] in DIGITS:
+                ends.append(_digit_run(s, k + 1))
+
+        # time zone
+        for k in ends:
+            results.append((k, separator))
+            if s[k:k + 1] in ('z', 'Z'):
+                results.append((k + 1, separator))
+            elif s[k:k + 1] in ('+', '-') and _two_digits(s, k + 1, '00', '23'):
+                k += 3
+                for m in (k, k + 1) if s[k:k + 1] == ':' else (k,):
+                    results.append((m, separator))
+                    if _two_digits(s, m, '00', '59'):
+                        results.append((m + 2, separator))
+    return results
+
+
+def _date_ends(s, i, separators=None):
+    """
+    Positions where a date (and time) starting at i can end
+    :param s: str
+    :param i: int
+    :param separators: (str|None, str|None) date and minute separators of the
+        start of the range, for the end of a range; None to use its own
+    :return: list of (int, str|None, str|None), the end position with the
+        date and minute separators used
+    """
+    n = len(s)
+    if s[i:i + 1] in ('+', '-'):
+        i += 1
+    if not _digits(s, i, 4):
+        return []
+    i += 4
+    # six digit years are not years
+    if _digits(s, i, 2) and (i + 2 == n or s[i + 2] not in WORD_CHARS):
+        return []
+
+    results = [(i, None, None)]
+    separator = '-' if s[i:i + 1] == '-' else ''
+    i += len(separator)
+    day_separator = separator if separators is None else separators[0]
+
+    dates = []
+    if _two_digits(s, i, '01', '12'):
+        dates.append(i + 2)
+        if day_separator is not None and s.startswith(day_separator, i + 2) \
+                and _two_digits(s, i + 2 + len(day_separator), '01', '31'):
+            dates.append(i + 4 + len(day_separator))
+    if s[i:i + 1] == 'W' and _two_digits(s, i + 1, '00', '52'):
+        j = i + 3
+        dates.append(j)
+        if s[j:j + 1] == '-':
+            j += 1
+        if s[j:j + 1] in WEEKDAYS and j < n:
+            dates.append(j + 1)
+    if _digits(s, i, 3) and '001' <= s[i:i + 3] <= '366' and s[i:i + 3] != '360':
+        dates.append(i + 3)
+
+    for j in dates:
+        results.append((j, separator, None))
+        if separators is None:
+            times = _time_ends(s, j)
+        else:
+            times = _time_ends(s, j, separators[1], own_separator=False)
+        for k, minute_separator in times:
+            results.append((k, separator, minute_separator))
+    return results
+
+
+def _duration_end(s, i):
+    """
+    End of the duration starting at i, all of whose parts are optional
+    :param s: str
+    :param i: int, position of the P
+    :return: int|None
+    """
+    if s[i:i + 1] != 'P':
+        return None
+    i += 1
+    units = DURATION_DATE_UNITS
+    time = False
+    while True:
+        j = _digit_run(s, i)
+        if j > i:
+            if s[j:j + 1] == '.' and s[j + 1:j + 2] in DIGITS:
+                j = _digit_run(s, j + 1)
+            unit = s[j:j + 1]
+            if not unit or unit not in units:
+                return i
+            # each unit at most once and in order
+            units = units[units.index(unit) + 1:]
+            i = j + 1
+        elif not time and s[i:i + 1] == 'T':
+            time = True
+            units = DURATION_TIME_UNITS
+            i += 1
+        else:
+            return i
+
+
+def _repeat_end(s, i):
+    # optional R<n>/ prefix of a repeating interval
+    if s[i:i + 1] == 'R':
+        j = _digit_run(s, i + 1)
+        if s[j:j + 1] == '/':
+            return j + 1
+    return i
+
+
+def _check_type(s):
+    if not isinstance(s, basestring):
+        # same as re.match
+        raise TypeError('expected string or buffer')
+
+
+def _common(pattern, s):
+    return len(s) <= COMMON_DURATION_LENGTH and pattern.match(s) is not None
+
+
+def is_date(s):
+    """
+    A single ISO 8601 date or date and time (ISSUED_REGEX)
+    :param s: str
+    :return: bool
+    """
+    _check_type(s)
+    if COMMON_DATE.match(s):
+        return True
+    for end, date_separator, minute_separator in _date_ends(s, 0):
+        if _ends(s, end):
+            return True
+    return False
+
+
+def is_duration(s):
+    """
+    A duration, optionally repeating: R/P1Y (MODIFIED_REGEX_2)
+    :param s: str
+    :return: bool
+    """
+    _check_type(s)
+    if _common(COMMON_DURATION, s):
+        return True
+    end = _duration_end(s, _repeat_end(s, 0))
+    return end is not None and _ends(s, end)
+
+
+def is_date_duration(s):
+    """
+    A start date and a duration, optionally repeating: R/2015-01-01/P1M
+    (MODIFIED_REGEX_3 and TEMPORAL_REGEX_2)
+    :param s: str
+    :return: bool
+    """
+    _check_type(s)
+    if _common(COMMON_DATE_DURATION, s):
+        return True
+    for end in set(e for e, _, _ in _date_ends(s, _repeat_end(s, 0))):
+        if s[end:end + 1] == '/':
+            duration_end = _duration_end(s, end + 1)
+            if duration_end is not None and _ends(s, duration_end):
+                return True
+    return False
+
+
+def is_date_range(s):
+    """
+    A start and an end date: 2015-01-01/2015-12-31 (TEMPORAL_REGEX_1)
+    :param s: str
+    :return: bool
+    """
+    _check_type(s)
+    if COMMON_DATE_RANGE.match(s):
+        return True
+    starts = set((end + 1, date_separator, minute_separator)
+                 for end, date_separator, minute_separator in _date_ends(s, 0)
+                 if s[end:end + 1] == '/')
+    for start, date_separator, minute_separator in starts:
+        for end, _, _ in _date_ends(s, start, (date_separator, minute_separator)):
+            if _ends(s, end):
+                return True
+    return False
+
+
+def is_duration_date(s):
+    """
+    A duration and an end date, optionally repeating: P1Y/2015-12-31
+    (TEMPORAL_REGEX_3)
+    :param s: str
+    :return: bool
+    """
+    _check_type(s)
+    if _common(COMMON_DURATION_DATE, s):
+        return True
+    end = _duration_end(s, _repeat_end(s, 0))
+    if end is None or s[end:end + 1] != '/':
+        return False
+    for date_end, _, _ in _date_ends(s, end + 1):
+        if _ends(s, date_end):
+            return True
+    return False
+
+
+def is_modified(s):
+    """
+    Valid value for modified: a date, a duration or a date and a duration
+    :param s: str
+    :return: bool
+    """
+    _check_type(s)
+    # only durations and repeating intervals do not start with the year
+    if s[:1] == 'P':
+        return is_duration(s)
+    if s[:1] == 'R':
+        if _common(COMMON_DURATION, s) or _common(COMMON_DATE_DURATION, s):
+            return True
+        return is_duration(s) or is_date_duration(s)
+    if COMMON_DATE.match(s):
+        return True
+    if s[:1] not in FIRST_CHARS or IMPOSSIBLE_DATE.match(s):
+        return False
+    return is_date(s) or is_date_duration(s)
+
+
+def is_temporal(s):
+    """
+    Valid value for temporal: an interval given by two dates, a start date and
+    a duration or a duration and an end date
+    :param s: str
+    :return: bool
+    """
+    _check_type(s)
+    if s[:1] == 'P':
+        return is_duration_date(s)
+    if s[:1] == 'R':
+        if _common(COMMON_DATE_DURATION, s) or _common(COMMON_DURATION_DATE, s):
+            return True
+        return is_date_duration(s) or is_duration_date(s)
+    if COMMON_DATE_RANGE.match(s):
+        return True
+    if s[:1] not in FIRST_CHARS or IMPOSSIBLE_DATE.match(s):
+        return False
+    return is_date_range(s) or is_date_duration(s)
+
+
+def is_issued(s):
+    """
+    Valid value for issued: a date
+    :param s: str
+    :return: bool
+    """
+    _check_type(s)
+    if COMMON_DATE.match(s):
+        return True
+    if s[:1] not in FIRST_CHARS or IMPOSSIBLE_DATE.match(s):
+        return False
+    return is_date(s)
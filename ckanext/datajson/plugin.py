@@ -12,8 +12,11 @@ from ckan.lib.base import BaseController, render, c
 from jsonschema.exceptions import best_match
 from pylons import request, response
 
-from helpers import get_export_map_json, detect_publisher, get_validator
+from db import setup as setup_db, update_identifier_index, remove_from_identifier_index, identifier_owners
+from helpers import get_export_map_json, get_pod_identifier, detect_publisher, get_validator
 from package2pod import Package2Pod
+from schema_validators import schema_fingerprint
+from validation_cache import cached_result
 
 logger = logging.getLogger(__name__)
 draft4validator = get_validator()
@@ -28,6 +31,8 @@ class DataJsonPlugin(p.SingletonPlugin):
     p.implements(p.interfaces.IConfigurer)
     p.implements(p.ITemplateHelpers)
     p.implements(p.interfaces.IRoutes, inherit=True)
+    p.implements(p.IConfigurable)
+    p.implements(p.IPackageController, inherit=True)
 
     def update_config(self, config):
         # Must use IConfigurer rather than IConfigurable because only IConfigurer
@@ -51,6 +56,30 @@ class DataJsonPlugin(p.SingletonPlugin):
         # relative to the path of *this* file. Wow.
         p.toolkit.add_template_directory(config, "templates")
 
+    def configure(self, config):
+        setup_db()
+        # read once, every package save uses it to index the POD identifier
+        DataJsonPlugin.json_export_map = get_export_map_json('export.map.json')
+
+    # keep the site wide identifier index current, see db.identifier_owner
+    def after_create(self, context, pkg_dict):
+        self._update_identifier_index(pkg_dict)
+
+    def after_update(self, context, pkg_dict):
+        self._update_identifier_index(pkg_dict)
+
+    def _update_identifier_index(self, pkg_dict):
+        # the index only serves the export, a failure must not fail the save
+        try:
+            update_identifier_index(pkg_dict, getattr(DataJsonPlugin, 'json_export_map', None))
+        except Exception:
+            logger.exception('Could not index the POD identifier of package %s', pkg_dict.get('id'))
+
+    def after_delete(self, context, pkg_dict):
+        pkg = model.Package.get(pkg_dict.get('id'))
+        if pkg:
+            remove_from_identifier_index([pkg.id])
+
     @staticmethod
     def datajson_inventory_links_enabled():
         return DataJsonPlugin.inventory_links_enabled
@@ -90,6 +119,10 @@ class DataJsonPlugin(p.SingletonPlugin):
         # /pod/validate
         m.connect('datajsonvalidator', "/pod/validate",
                   controller='ckanext.datajson.plugin:DataJsonController', action='validator')
+        m.connect('datajsonvalidator_job', "/pod/validate/{job_id}",
+                  controller='ckanext.datajson.plugin:DataJsonController', action='validator_job')
+        m.connect('datajsonvalidator_api', "/api/pod/validate",
+                  controller='ckanext.datajson.plugin:DataJsonController', action='validator_api')
 
         return m
 
@@ -176,6 +209,7 @@ class DataJsonController(BaseController):
         output = []
         errors_json = []
         Package2Pod.seen_identifiers = set()
+        Package2Pod.identifier_owners = None
 
         try:
             # Build the data.json file.
@@ -197,6 +231,9 @@ class DataJsonController(BaseController):
             json_export_map = get_export_map_json('export.map.json')
 
             if json_export_map:
+                # the owners of the exported identifiers, in one query for the export
+                Package2Pod.identifier_owners = identifier_owners(
+                    get_pod_identifier(pkg, json_export_map) for pkg in packages)
                 for pkg in packages:
                     if json_export_map.get('debug'):
                         output.append(pkg)
@@ -258,6 +295,7 @@ class DataJsonController(BaseController):
             exc_type, exc_obj, exc_tb = sys.exc_info()
             filename = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             logger.error("%s : %s : %s : %s", exc_type, filename, exc_tb.tb_lineno, unicode(e))
+        Package2Pod.identifier_owners = None
 
         # Get the error log
         eh.flush()
@@ -304,7 +342,11 @@ class DataJsonController(BaseController):
         Validates a data.json entry against the project open data's JSON schema.
         Log a warning message on validation error
         """
-        error = best_match(draft4validator.iter_errors(instance))
+        def validate():
+            error = best_match(draft4validator.iter_errors(instance))
+            return unicode(error) if error else None
+
+        error = cached_result(instance, 'federal-v1.1@%s' % schema_fingerprint('federal-v1.1'), validate)
         if error:
             logger.warn("===================================================\r\n"+
                         "Validation failed, best guess of error:\r\n %s\r\nFor this dataset:\r\n", error)
@@ -363,38 +405,70 @@ class DataJsonController(BaseController):
         return binary
 
     def validator(self):
-        # Validates that a URL is a good data.json file.
+        # Validates that a URL is a good data.json file. The work is done by a
+        # background job, so just submit it and send the user to its status page.
         if request.method == "POST" and "url" in request.POST and request.POST["url"].strip() != "":
-            c.source_url = request.POST["url"]
-            c.errors = []
-
-            import urllib
-            import json
-            from datajsonvalidator import do_validation
-
-            body = None
-            try:
-                body = json.load(urllib.urlopen(c.source_url))
-            except IOError as e:
-                c.errors.append(("Error Loading File", ["The address could not be loaded: " + unicode(e)]))
-            except ValueError as e:
-                c.errors.append(("Invalid JSON", ["The file does not meet basic JSON syntax requirements: " + unicode(
-                    e) + ". Try using JSONLint.com."]))
-            except Exception as e:
-                c.errors.append((
-                    "Internal Error",
-                    ["Something bad happened while trying to load and parse the file: " + unicode(e)]))
-
-            if body:
-                try:
-                    do_validation(body, c.errors)
-                except Exception as e:
-                    c.errors.append(("Internal Error", ["Something bad happened: " + unicode(e)]))
-                if len(c.errors) == 0:
-                    c.errors.append(("No Errors", ["Great job!"]))
+            from validation_jobs import submit_validation
+
+            job = submit_validation(request.POST["url"].strip())
+            p.toolkit.redirect_to('datajsonvalidator_job', job_id=job['id'])
+
+        return render('datajsonvalidator.html')
+
+    def validator_job(self, job_id):
+        from validation_jobs import get_report_store, STATUS_DONE
+
+        store = get_report_store()
+        c.job = store.get_job(job_id)
+        if not c.job:
+            p.toolkit.abort(404, 'Validation job not found')
+
+        c.source_url = c.job['url']
+        if c.job['status'] == STATUS_DONE:
+            report = store.get_report(c.job['report'])
+            if report:
+                c.errors = report['errors']
+            else:
+                c.errors = [("Report Expired", ["The report is no longer available, please validate again."])]
+        elif c.job.get('error'):
+            c.errors = [("Internal Error", ["Something bad happened: " + c.job['error']])]
 
         return render('datajsonvalidator.html')
 
+    def validator_api(self):
+        """
+        Validates a data.json document POSTed as the request body, optionally
+        gzip or deflate compressed, and returns the errors as json. The body is
+        parsed and validated one dataset at a time while it is being read.
+        """
+        from datajsonvalidator import do_stream_validation
+        from jsonstream import DecompressingReader, LimitedReader
+
+        response.content_type = 'application/json; charset=UTF-8'
+        if request.method != 'POST':
+            response.status_int = 405
+            return json.dumps({'error': 'POST the data.json file as the request body'})
+
+        body = getattr(request, 'body_file_raw', None) or request.body_file
+        if request.content_length is not None:
+            body = LimitedReader(body, request.content_length)
+        content_encoding = (request.headers.get('Content-Encoding') or '').strip().lower()
+        if content_encoding in ('gzip', 'x-gzip', 'deflate'):
+            body = DecompressingReader(body, 'deflate' if content_encoding == 'deflate' else 'gzip')
+
+        errors = []
+        count = 0
+        try:
+            count = do_stream_validation(body, errors, set())
+        except Exception as e:
+            errors.append(("Internal Error", ["Something bad happened: " + unicode(e)]))
+
+        return json.dumps({
+            'valid': len(errors) == 0,
+            'datasets': count,
+            'errors': errors,
+        })
+
     @staticmethod
     def _get_ckan_datasets(org=None, with_private=False):
         n = 500
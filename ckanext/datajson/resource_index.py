@@ -0,0 +1,101 @@
+"""
+Matching of harvested resources to those of the package they update.
+"""
+from collections import deque
+import urlparse
+
+# resource fields set from a data.json distribution, see parse_datajson
+HARVESTED_FIELDS = frozenset(['url', 'format', 'mimetype', 'description', 'name',
+                              'conformsTo', 'describedBy', 'describedByType', 'accessURL'])
+
+DEFAULT_PORTS = {'http': '80', 'https': '443', 'ftp': '21'}
+
+
+def normalize_url(url):
+    """
+    The form of a URL two distributions are considered the same by: without
+    surrounding whitespace, default port and trailing slash, with the scheme
+    and host in lower case and https the same as http, as sources move their
+    files to it. The fragment is kept, some catalogs link to the pages of a
+    single page application with it.
+    :param url: str
+    :return: str
+    """
+    url = (url or '').strip()
+    try:
+        parts = urlparse.urlsplit(url)
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    host, sep, port = netloc.rpartition(':')
+    if sep and port == DEFAULT_PORTS.get(scheme) and ']' not in port:
+        netloc = host
+    if scheme == 'https':
+        scheme = 'http'
+    return urlparse.urlunsplit((scheme, netloc, parts.path.rstrip('/'), parts.query, parts.fragment))
+
+
+def resource_unchanged(resource, existing):
+    """
+    Whether updating an existing resource with a harvested one would not
+    change what was harvested, so the existing one can be saved as it is
+    :param resource: dict, harvested resource
+    :param existing: dict, resource of the package
+    """
+    for key in HARVESTED_FIELDS.union(resource):
+        if key != 'id' and _value(resource.get(key)) != _value(existing.get(key)):
+            return False
+    return True
+
+
+def _value(value):
+    # CKAN returns the fields a resource was saved without as empty strings
+    return '' if value is None else value
+
+
+class ResourceIndex(object):
+    """
+    The resources of an existing package keyed by their URL, and by their
+    normalized URL, built once per update so matching the harvested
+    resources does not compare every pair of them.
+
+    Each existing resource is matched once. Harvested resources with the
+    same URL are matched, in order, to the existing ones with that URL, those
+    left over are new resources. Exact URLs are matched before normalized
+    ones, so a resource whose URL only changed in form keeps its id without
+    taking that of another resource.
+    """
+
+    def __init__(self, existing_resources):
+        """
+        :param existing_resources: list of dict, resources of the package
+        """
+        self._by_url = {}
+        self._by_normalized_url = {}
+        for resource in existing_resources:
+            url = resource.get('url') or ''
+            self._by_url.setdefault(url, deque()).append(resource)
+            self._by_normalized_url.setdefault(normalize_url(url), deque()).append(resource)
+        self._matched = set()
+
+    def match(self, resources):
+        """
+        :param resources: list of dict, harvested resources
+        :return: list of dict|None, the existing resource each one updates,
+            None for new resources
+        """
+        matches = [None] * len(resources)
+        for index, key in ((self._by_url, lambda url: url), (self._by_normalized_url, normalize_url)):
+            for i, resource in enumerate(resources):
+                if matches[i] is None:
+                    matches[i] = self._take(index.get(key(resource.get('url') or '')))
+        return matches
+
+    def _take(self, candidates):
+        while candidates:
+            existing = candidates.popleft()
+            if id(existing) not in self._matched:
+                self._matched.add(id(existing))
+                return existing
+        return None
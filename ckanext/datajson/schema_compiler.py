@@ -0,0 +1,260 @@
+"""
+Turns a JSON schema into plain Python validation functions.
+
+jsonschema's Draft4Validator interprets the schema for every instance: each
+keyword goes through a dispatch table, every subschema enters a resolution
+scope and every $ref is resolved again. The bundled POD schemas never change,
+so all of that can be done once: compile_schema walks the schema in the same
+order the validator does and generates one function per subschema, with the
+keyword checks inlined and references turned into direct calls.
+
+The generated code reports the same ValidationErrors as jsonschema 2.4.0
+(message, validator, path, schema_path, context and cause) in the same order.
+Schemas using keywords it does not know raise CompileError, the caller then
+keeps using the interpreted validator.
+"""
+import numbers
+import re
+
+import jsonschema
+from jsonschema import _utils
+from jsonschema.compat import iteritems
+from jsonschema.exceptions import ValidationError, FormatError
+
+# the messages and error bookkeeping below are those of this jsonschema version
+JSONSCHEMA_VERSIONS = ('2.4.0',)
+
+# Draft 4 keywords that only describe, they are ignored by the validator too
+_VALIDATED_KEYWORDS = frozenset([
+    u'$ref', u'anyOf', u'dependencies', u'enum', u'format', u'items', u'maxItems', u'maxLength', u'minItems',
+    u'minLength', u'pattern', u'properties', u'required', u'type', u'uniqueItems'])
+
+
+class CompileError(Exception):
+    pass
+
+
+def _error(message, validator, validator_value, instance, schema, cause=None, context=()):
+    return ValidationError(message, validator=validator, validator_value=validator_value, instance=instance,
+                           schema=schema, schema_path=(validator,), cause=cause, context=context)
+
+
+def _descended(errors, sub_errors, keyword, path=None, schema_path=None):
+    # what Validator.descend and iter_errors do to the errors of a subschema
+    for error in sub_errors:
+        if path is not None:
+            error.path.appendleft(path)
+        if schema_path is not None:
+            error.schema_path.appendleft(schema_path)
+        error.schema_path.appendleft(keyword)
+        errors.append(error)
+
+
+def _any_of(instance, functions):
+    # None if a subschema matches, the errors of all of them otherwise
+    all_errors = []
+    for index, function in enumerate(functions):
+        errors = function(instance)
+        if not errors:
+            return None
+        for error in errors:
+            error.schema_path.appendleft(index)
+        all_errors.extend(errors)
+    return all_errors
+
+
+class CompiledValidator:
+    """
+    Stands in for a Draft4Validator, using the generated functions to check
+    instances against the whole schema.
+    """
+
+    def __init__(self, interpreted, function, source):
+        self.interpreted = interpreted
+        self.schema = interpreted.schema
+        self.resolver = interpreted.resolver
+        self.format_checker = interpreted.format_checker
+        self.source = source
+        self._function = function
+
+    def iter_errors(self, instance, _schema=None):
+        if _schema is not None:
+            return self.interpreted.iter_errors(instance, _schema)
+        return iter(self._function(instance))
+
+    def is_valid(self, instance, _schema=None):
+        return next(self.iter_errors(instance, _schema), None) is None
+
+    def validate(self, *args, **kwargs):
+        for error in self.iter_errors(*args, **kwargs):
+            raise error
+
+
+class _Compiler:
+
+    def __init__(self, validator):
+        self.validator = validator
+        self.resolver = validator.resolver
+        self.namespace = {
+            '_error': _error,
+            '_descended': _descended,
+            '_any_of': _any_of,
+            '_types_msg': _utils.types_msg,
+            '_uniq': _utils.uniq,
+            'FormatError': FormatError,
+            'format_checker': validator.format_checker,
+        }
+        self.functions = {}
+        self.sources = []
+
+    def constant(self, value, prefix='C'):
+        name = '%s%d' % (prefix, len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def type_check(self, type_name, var):
+        pytypes = self.validator._types.get(type_name)
+        if pytypes is None:
+            raise CompileError('unknown type %r' % type_name)
+        check = 'isinstance(%s, %s)' % (var, self.constant(pytypes, 'T'))
+        # Validator.is_type: bool is an int, but not an integer or a number
+        flat = _utils.flatten(pytypes)
+        if any(issubclass(t, numbers.Number) for t in flat) and bool not in flat:
+            check = '(%s and not isinstance(%s, bool))' % (check, var)
+        return check
+
+    def compile(self, schema):
+        """
+        Name of the function checking an instance against schema in the
+        current resolution scope
+        """
+        if not isinstance(schema, dict):
+            raise CompileError('schema %r is not an object' % (schema,))
+        key = (id(schema), self.resolver.resolution_scope, self.resolver.base_uri)
+        if key in self.functions:
+            return self.functions[key]
+        name = '_v%d' % len(self.functions)
+        self.functions[key] = name
+        with self.resolver.in_scope(schema.get(u'id', u'')):
+            lines = self.body(schema)
+        self.sources.append('def %s(i):\n%s\n' % (name, '\n'.join('    ' + line for line in lines)))
+        return name
+
+    def body(self, schema):
+        s = self.constant(schema, 'S')
+        ref = schema.get(u'$ref')
+        if ref is not None:
+            with self.resolver.resolving(ref) as resolved:
+                return ['return %s(i)' % self.compile(resolved)]
+
+        lines = ['errors = []']
+        for keyword, value in iteritems(schema):
+            if keyword not in _VALIDATED_KEYWORDS:
+                if keyword in self.validator.VALIDATORS:
+                    raise CompileError('keyword %r is not supported' % keyword)
+                continue
+            v = self.constant(value)
+            if keyword == u'type':
+                types = _utils.ensure_list(value)
+                lines += ['if not (%s):' % ' or '.join(self.type_check(t, 'i') for t in types),
+                          '    errors.append(_error(_types_msg(i, %s), u"type", %s, i, %s))'
+                          % (self.constant(types), v, s)]
+            elif keyword == u'enum':
+                lines += ['if i not in %s:' % v,
+                          '    errors.append(_error("%%r is not one of %%r" %% (i, %s), u"enum", %s, i, %s))'
+                          % (v, v, s)]
+            elif keyword == u'pattern':
+                lines += ['if %s and not %s.search(i):' % (self.type_check(u'string', 'i'),
+                                                            self.constant(re.compile(value), 'P')),
+                          '    errors.append(_error("%%r does not match %%r" %% (i, %s), u"pattern", %s, i, %s))'
+                          % (v, v, s)]
+            elif keyword == u'format':
+                if self.validator.format_checker is None or value not in self.validator.format_checker.checkers:
+                    continue
+                lines += ['try:',
+                          '    format_checker.check(i, %s)' % v,
+                          'except FormatError as e:',
+                          '    errors.append(_error(e.message, u"format", %s, i, %s, cause=e.cause))' % (v, s)]
+            elif keyword in (u'minLength', u'maxLength', u'minItems', u'maxItems'):
+                type_name = u'string' if keyword.endswith(u'Length') else u'array'
+                short = keyword.startswith(u'min')
+                lines += ['if %s and len(i) %s %s:' % (self.type_check(type_name, 'i'), '<' if short else '>', v),
+                          '    errors.append(_error("%%r is too %s" %% (i,), u"%s", %s, i, %s))'
+                          % ('short' if short else 'long', keyword, v, s)]
+            elif keyword == u'uniqueItems':
+                if value:
+                    lines += ['if %s and not _uniq(i):' % self.type_check(u'array', 'i'),
+                              '    errors.append(_error("%%r has non-unique elements" %% i, u"uniqueItems", %s, i, %s))'
+                              % (v, s)]
+            elif keyword == u'required':
+                if not isinstance(value, list):
+                    raise CompileError('required must be an array')
+                lines.append('if %s:' % self.type_check(u'object', 'i'))
+                for prop in value:
+                    p = self.constant(prop)
+                    lines += ['    if %s not in i:' % p,
+                              '        errors.append(_error("%%r is a required property" %% %s, u"required", %s, i, %s))'
+                              % (p, v, s)]
+            elif keyword == u'properties':
+                lines.append('if %s:' % self.type_check(u'object', 'i'))
+                for prop, subschema in iteritems(value):
+                    p = self.constant(prop)
+                    lines += ['    if %s in i:' % p,
+                              '        e = %s(i[%s])' % (self.compile(subschema), p),
+                              '        if e:',
+                              '            _descended(errors, e, u"properties", %s, %s)' % (p, p)]
+            elif keyword == u'items':
+                lines.append('if %s:' % self.type_check(u'array', 'i'))
+                if isinstance(value, dict):
+                    lines += ['    for index, item in enumerate(i):',
+                              '        e = %s(item)' % self.compile(value),
+                              '        if e:',
+                              '            _descended(errors, e, u"items", index)']
+                else:
+                    functions = '(%s,)' % ', '.join(self.compile(subschema) for subschema in value)
+                    lines += ['    for index, (item, function) in enumerate(zip(i, %s)):' % functions,
+                              '        e = function(item)',
+                              '        if e:',
+                              '            _descended(errors, e, u"items", index, index)']
+            elif keyword == u'dependencies':
+                lines.append('if %s:' % self.type_check(u'object', 'i'))
+                for prop, dependency in iteritems(value):
+                    p = self.constant(prop)
+                    lines.append('    if %s in i:' % p)
+                    if isinstance(dependency, dict):
+                        lines += ['        e = %s(i)' % self.compile(dependency),
+                                  '        if e:',
+                                  '            _descended(errors, e, u"dependencies", None, %s)' % p]
+                    else:
+                        for dep in _utils.ensure_list(dependency):
+                            d = self.constant(dep)
+                            lines += ['        if %s not in i:' % d,
+                                      '            errors.append(_error("%%r is a dependency of %%r" %% (%s, %s), '
+                                      'u"dependencies", %s, i, %s))' % (d, p, v, s)]
+            elif keyword == u'anyOf':
+                functions = '(%s,)' % ', '.join(self.compile(subschema) for subschema in value)
+                lines += ['e = _any_of(i, %s)' % functions,
+                          'if e is not None:',
+                          '    errors.append(_error("%%r is not valid under any of the given schemas" %% (i,), '
+                          'u"anyOf", %s, i, %s, context=e))' % (v, s)]
+        lines.append('return errors')
+        return lines
+
+
+def compile_schema(validator):
+    """
+    Generates the validation functions for the schema of a validator
+    :param validator: jsonschema Draft4Validator
+    :return: CompiledValidator
+    :raises CompileError: if the schema or jsonschema version is not supported
+    """
+    if jsonschema.__version__ not in JSONSCHEMA_VERSIONS:
+        raise CompileError('jsonschema %s is not supported' % jsonschema.__version__)
+    compiler = _Compiler(validator)
+    try:
+        entry = compiler.compile(validator.schema)
+    except jsonschema.RefResolutionError as e:
+        raise CompileError('unresolvable reference: %s' % e)
+    source = '\n'.join(compiler.sources)
+    exec compile(source, '<compiled schema %s>' % validator.schema.get(u'id', u''), 'exec') in compiler.namespace
+    return CompiledValidator(validator, compiler.namespace[entry], source)
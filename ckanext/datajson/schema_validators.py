@@ -0,0 +1,116 @@
+import hashlib
+import json
+import logging
+import os
+
+from jsonschema import Draft4Validator, FormatChecker, RefResolver
+
+from schema_compiler import compile_schema, CompileError
+
+log = logging.getLogger(__name__)
+
+# bundled Project Open Data schemas, by variant name
+SCHEMA_FILES = {
+    'federal': 'pod_schema/single_entry.json',
+    'federal-v1.1': 'pod_schema/federal-v1.1/dataset.json',
+    'non-federal': 'pod_schema/non-federal/single_entry.json',
+    'non-federal-v1.1': 'pod_schema/non-federal-v1.1/dataset-non-federal.json',
+}
+
+_validators = {}
+_fingerprints = {}
+
+
+def schema_variant(validator_schema, schema_version):
+    """
+    Name of the bundled schema used for a harvest source's validator_schema
+    setting and the schema version of the catalog
+    :param validator_schema: str|None, '' or 'non-federal'
+    :param schema_version: str, '1.0' or '1.1'
+    :return: str
+    """
+    variant = 'non-federal' if validator_schema == 'non-federal' else 'federal'
+    if schema_version == '1.1':
+        variant += '-v1.1'
+    return variant
+
+
+def schema_path(variant):
+    return os.path.join(os.path.dirname(__file__), SCHEMA_FILES[variant])
+
+
+def load_schema(variant):
+    with open(schema_path(variant), 'r') as json_file:
+        return json.load(json_file)
+
+
+def get_schema_validator(variant, compiled=True):
+    """
+    Validator for a bundled schema, built once per process. The schema is
+    compiled to Python functions (see schema_compiler), the interpreted
+    Draft4Validator is used if that is not possible.
+    :param variant: str
+    :param compiled: bool, False for the interpreted Draft4Validator
+    :return: CompiledValidator|Draft4Validator
+    """
+    key = (variant, compiled)
+    validator = _validators.get(key)
+    if validator is None:
+        schema = load_schema(variant)
+        resolver = RefResolver.from_schema(schema, store=_embedded_schemas(schema))
+        validator = Draft4Validator(schema, resolver=resolver, format_checker=FormatChecker())
+        if compiled:
+            try:
+                validator = compile_schema(validator)
+            except CompileError as e:
+                log.warn('Using the interpreted validator for the %s schema: %s', variant, e)
+        _validators[key] = validator
+    return validator
+
+
+def _embedded_schemas(schema, store=None):
+    # definitions with their own id (vcard, distribution, organization) refer
+    # to themselves with "#", register them so that never goes to the network
+    if store is None:
+        store = {}
+    if isinstance(schema, dict):
+        if isinstance(schema.get('id'), basestring):
+            store[schema['id'].rstrip('#')] = schema
+        for value in schema.itervalues():
+            _embedded_schemas(value, store)
+    elif isinstance(schema, list):
+        for value in schema:
+            _embedded_schemas(value, store)
+    return store
+
+
+def schema_fingerprint(variant):
+    """
+    Short digest of a bundled schema file, so anything cached against a schema
+    is invalidated when the schema is updated
+    :param variant: str
+    :return: str
+    """
+    fingerprint = _fingerprints.get(variant)
+    if fingerprint is None:
+        with open(schema_path(variant), 'rb') as schema_file:
+            fingerprint = hashlib.sha1(schema_file.read()).hexdigest()[:12]
+        _fingerprints[variant] = fingerprint
+    return fingerprint
+
+
+def readable_error(error):
+    """
+    Error message of a schema ValidationError prefixed with the top level
+    field it is about, e.g. 'title':'title' is a required property
+    :param error: jsonschema.ValidationError
+    :return: str
+    """
+    msg = error.message.replace("u'", "'")
+    elem = ""
+    try:
+        if error.schema_path[0] == 'properties':
+            elem = "'" + error.schema_path[1] + "':"
+    except:
+        pass
+    return elem + msg
@@ -3,8 +3,10 @@ from __future__ import print_function
 import json
 import logging
 import os
+import re
 import SimpleHTTPServer
 import SocketServer
+import time
 from threading import Thread
 
 import pkg_resources
@@ -13,8 +15,18 @@ from ckanext import datajson
 log = logging.getLogger("harvester")
 
 PORT = 8998
+ETAG = '"arm-1"'
+# seconds the first response of /arm-stalled stops halfway for
+STALL = 2
+# /arm-slow sends its body in pieces this big, one every SLOW_DELAY seconds
+SLOW_CHUNK = 64 * 1024
+SLOW_DELAY = 0.02
 
 class MockDataJSONHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    # Range headers of the requests received per path (with query string)
+    # of the unreliable sources
+    attempts = {}
+
     def do_GET(self):
         log.info('GET mock at: {}'.format(self.path))
         # test name is the first bit of the URL and makes CKAN behave
@@ -28,6 +40,10 @@ class MockDataJSONHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
         elif self.path == '/usda':
             self.sample_datajson_file = 'usda.gov.data.json'
             self.test_name = 'usda'
+        elif self.path.split('?')[0] in ('/arm-dropped', '/arm-stalled', '/arm-slow'):
+            # the query string only tells tests apart
+            self.test_name = self.path.split('?')[0][len('/arm-'):]
+            self.respond_unreliable('arm.data.json')
         elif self.path == '/404':
             self.test_name = 'e404'
             self.respond('Not found', status=404)
@@ -54,6 +70,48 @@ class MockDataJSONHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
         return self.respond(content=content, status=status,
                             content_type='application/json')
 
+    def respond_unreliable(self, file_path):
+        '''
+        Serves a sample file with Range support, the way a far away server
+        could: the first request for /arm-dropped is cut off halfway, the
+        first one for /arm-stalled stops sending halfway for STALL seconds
+        and /arm-slow trickles the file out in small pieces.
+        '''
+        pt = pkg_resources.resource_filename(__name__, "/datajson-samples/{}".format(file_path))
+        with open(pt, 'rb') as f:
+            content = f.read()
+        MockDataJSONHandler.attempts.setdefault(self.path, []).append(self.headers.get('Range'))
+        attempt = len(MockDataJSONHandler.attempts[self.path])
+
+        start = 0
+        m = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if m and self.headers.get('If-Range') == ETAG:
+            start = int(m.group(1))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(content) - 1, len(content)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content) - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', ETAG)
+        self.end_headers()
+
+        body = content[start:]
+        if attempt == 1 and self.test_name in ('dropped', 'stalled'):
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            if self.test_name == 'stalled':
+                time.sleep(STALL)
+        elif self.test_name == 'slow':
+            for i in range(0, len(body), SLOW_CHUNK):
+                self.wfile.write(body[i:i + SLOW_CHUNK])
+                self.wfile.flush()
+                time.sleep(SLOW_DELAY)
+        else:
+            self.wfile.write(body)
+        self.wfile.close()
+
     def respond(self, content, status=200, content_type='application/json'):
         self.send_response(status)
         self.send_header('Content-Type', content_type)
@@ -62,6 +120,9 @@ class MockDataJSONHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
         self.wfile.close()
 
 
+_httpd = None
+
+
 def serve(port=PORT):
     '''Runs a CKAN-alike app (over HTTP) that is used for harvesting tests'''
 
@@ -69,10 +130,16 @@ def serve(port=PORT):
     # os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)),
     #                      'mock_ckan_files'))
 
-    class TestServer(SocketServer.TCPServer):
+    global _httpd
+    if _httpd is not None:
+        # already serving for another test module
+        return
+
+    class TestServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
         allow_reuse_address = True
+        daemon_threads = True
 
-    httpd = TestServer(("", PORT), MockDataJSONHandler)
+    httpd = _httpd = TestServer(("", PORT), MockDataJSONHandler)
 
     info = 'Serving test HTTP server at port {}'.format(PORT)
     print(info)
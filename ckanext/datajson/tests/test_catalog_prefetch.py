@@ -0,0 +1,151 @@
+import BaseHTTPServer
+import datetime
+import shutil
+import tempfile
+import threading
+import time
+from urllib2 import HTTPError
+
+from mock import patch
+from nose.tools import assert_equal, assert_true, assert_is_none, assert_is_instance
+
+from ckanext.datajson import catalog_prefetch
+from ckanext.datajson.catalog_prefetch import CatalogSpool, FetchScheduler
+from ckanext.datajson.http_client import close_connections
+from test_http_client import ThreadingServer
+
+BODY = '[' + ','.join('{"identifier": "%d"}' % i for i in range(5000)) + ']'
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    lock = threading.Lock()
+    active = {}
+    most_active = {}
+
+    def do_GET(self):
+        host = self.headers['Host'].split(':')[0]
+        with Handler.lock:
+            Handler.active[host] = Handler.active.get(host, 0) + 1
+            Handler.most_active[host] = max(Handler.most_active.get(host, 0), Handler.active[host])
+        try:
+            if self.path.startswith('/slow'):
+                time.sleep(0.5)
+                self.respond(200, BODY, {'ETag': '"%s"' % self.path})
+            elif self.path == '/unchanged':
+                self.respond(304 if self.headers.get('If-None-Match') == '"1"' else 200, '')
+            elif self.path == '/catalog':
+                self.respond(200, BODY)
+            else:
+                self.respond(404, 'Not found')
+        finally:
+            with Handler.lock:
+                Handler.active[host] -= 1
+
+    def respond(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestCatalogPrefetch(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.server = ThreadingServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        cls.port = cls.server.server_address[1]
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = CatalogSpool(self.directory)
+        Handler.active.clear()
+        Handler.most_active.clear()
+
+    def teardown(self):
+        close_connections()
+        shutil.rmtree(self.directory)
+
+    def fetch(self, job_id, path, host='127.0.0.1', headers=None):
+        return {'job_id': job_id, 'url': 'http://%s:%d%s' % (host, self.port, path),
+                'headers': headers or {}, 'config_digest': 'abc'}
+
+    def test_concurrent(self):
+        fetches = [self.fetch('job%d' % i, '/slow%d' % i) for i in range(4)]
+        started = time.time()
+        results = FetchScheduler(self.spool, workers=4, per_host=4).run(fetches)
+        # as long as the slowest download, not as all of them together
+        assert_true(time.time() - started < 1.5)
+        assert_equal(results, dict.fromkeys(['job0', 'job1', 'job2', 'job3']))
+        assert_equal(Handler.most_active['127.0.0.1'], 4)
+
+        catalog, fetch = self.spool.take('job2')
+        assert_equal(catalog.read(), BODY)
+        catalog.close()
+        assert_equal(fetch['status'], 200)
+        assert_equal(fetch['etag'], '"/slow2"')
+        assert_equal(fetch['config_digest'], 'abc')
+        assert_is_instance(fetch['fetched'], datetime.datetime)
+        # a catalog is only taken once
+        assert_is_none(self.spool.take('job2'))
+
+    def test_per_host_limit(self):
+        fetches = [self.fetch('job%d' % i, '/slow%d' % i) for i in range(3)] + \
+                  [self.fetch('job%d' % i, '/slow%d' % i, host='localhost') for i in range(3, 6)]
+        FetchScheduler(self.spool, workers=6, per_host=1).run(fetches)
+        assert_equal(Handler.most_active, {'127.0.0.1': 1, 'localhost': 1})
+        for i in range(6):
+            catalog, fetch = self.spool.take('job%d' % i)
+            assert_equal(catalog.read(), BODY)
+            catalog.close()
+
+    def test_bandwidth_limit(self):
+        started = time.time()
+        FetchScheduler(self.spool, bandwidth=len(BODY)).run(
+            [self.fetch('job0', '/catalog'), self.fetch('job1', '/catalog')])
+        # two bodies at one body per second
+        assert_true(time.time() - started >= 1.5)
+
+    def test_not_modified_and_errors(self):
+        results = FetchScheduler(self.spool).run([
+            self.fetch('job0', '/unchanged', headers={'If-None-Match': '"1"'}),
+            self.fetch('job1', '/missing'),
+        ])
+        assert_is_none(results['job0'])
+        catalog, fetch = self.spool.take('job0')
+        assert_is_none(catalog)
+        assert_equal(fetch['status'], 304)
+        assert_equal(fetch['headers'], {'If-None-Match': '"1"'})
+
+        assert_is_instance(results['job1'], HTTPError)
+        assert_is_none(self.spool.take('job1'))
+
+    def test_take_waits_for_download(self):
+        thread = threading.Thread(target=FetchScheduler(self.spool).run, args=([self.fetch('job0', '/slow0')],))
+        thread.start()
+        time.sleep(0.1)
+        catalog, fetch = self.spool.take('job0', wait=5)
+        assert_equal(catalog.read(), BODY)
+        catalog.close()
+        thread.join()
+
+    def test_take_stalled_download(self):
+        self.spool.open_part('job0').close()
+        started = time.time()
+        with patch.dict(catalog_prefetch.config, {'ckanext.datajson.harvest.prefetch_wait': '0.2'}):
+            assert_is_none(self.spool.take('job0'))
+        # gave up once the part file had not grown for the configured wait
+        assert_true(0.2 <= time.time() - started < 1.5)
@@ -0,0 +1,41 @@
+from nose.tools import assert_equal, assert_true, assert_false
+
+from ckanext.datajson.collection_index import CollectionIndex
+
+
+def existing(pkg_id, collection=False, state='active'):
+    return {'id': pkg_id, 'state': state, 'source_hash': '', 'collection_metadata': 'true' if collection else None}
+
+
+class TestCollectionIndex(object):
+
+    def setup(self):
+        # a: collection before and now, b: new collection, c: dataset promoted
+        # to collection, d: collection demoted, e: deleted collection, n: nested
+        parents = set(['a', 'b', 'c', 'n', 'e'])
+        children = set(['a1', 'b1', 'n'])
+        self.collections = CollectionIndex(parents, children, {
+            'a': existing('pa', collection=True),
+            'a1': existing('pa1'),
+            'c': existing('pc'),
+            'd': existing('pd', collection=True),
+            'e': existing('pe', collection=True, state='deleted'),
+        })
+
+    def test_sets(self):
+        c = self.collections
+        assert_equal(sorted(c.existing_parents), ['a', 'd'])
+        assert_equal(c.nested, set(['n']))
+        assert_equal(c.new_parents, set(['b', 'c', 'n', 'e']))
+        assert_equal(c.demoted, set(['d']))
+        assert_equal(c.promoted, set(['c', 'e']))
+        assert_equal(c.role_changed, set(['c', 'd', 'e']))
+
+    def test_datasets(self):
+        c = self.collections
+        assert_true(c.waits_for_parent({'identifier': 'b1', 'isPartOf': 'b'}))
+        assert_false(c.waits_for_parent({'identifier': 'a1', 'isPartOf': 'a'}))
+        # collections are harvested first, even those wrongly part of another one
+        assert_false(c.waits_for_parent({'identifier': 'n', 'isPartOf': 'b'}))
+        assert_false(c.waits_for_parent({'identifier': 'x'}))
+        assert_equal(c.parent_package_id({'identifier': 'a1', 'isPartOf': 'a'}), 'pa')
@@ -1,16 +1,19 @@
 import copy
+import datetime
 from urllib2 import URLError
 from nose.tools import assert_equal, assert_raises, assert_in
 import json
+import shutil
+import tempfile
 from mock import patch, MagicMock, Mock
 from requests.exceptions import HTTPError, RequestException
 
 try:
     from ckan.tests.helpers import reset_db, call_action
-    from ckan.tests.factories import Organization, Group
+    from ckan.tests.factories import Organization, Group, Dataset
 except ImportError:
     from ckan.new_tests.helpers import reset_db, call_action
-    from ckan.new_tests.factories import Organization, Group
+    from ckan.new_tests.factories import Organization, Group, Dataset
 from ckan import model
 from ckan.plugins import toolkit
 from ckan.lib.munge import munge_title_to_name
@@ -22,6 +25,8 @@ from factories import (HarvestSourceObj,
 
 import ckanext.harvest.model as harvest_model
 from ckanext.harvest.harvesters.base import HarvesterBase
+from ckanext.datajson.catalog_prefetch import CatalogSpool, FetchScheduler
+from ckanext.datajson.db import get_source_fetch
 from ckanext.datajson.harvester_datajson import DataJsonHarvester
 import logging
 log = logging.getLogger(__name__)
@@ -109,3 +114,290 @@ class TestDataJSONHarvester(object):
         url = 'http://127.0.0.1:%s/500' % mock_datajson_source.PORT
         with assert_raises(URLError) as harvest_context:
             self.run_source(url=url)
+
+    def test_existing_datasets(self):
+        url = 'http://127.0.0.1:%s/arm' % mock_datajson_source.PORT
+        harvest_object, result, dataset = self.run_source(url=url)
+
+        harvester = DataJsonHarvester()
+        existing = harvester._existing_datasets(harvest_object.source)
+        identifier = json.loads(harvest_object.content)['identifier']
+        assert_equal(existing.keys(), [identifier])
+        assert_equal(existing[identifier]['id'], dataset.id)
+        assert_equal(existing[identifier]['state'], 'active')
+        assert_equal(existing[identifier]['source_hash'], dataset.extras['source_hash'])
+        assert_equal(existing[identifier]['collection_metadata'], None)
+
+    def test_gather_batches(self):
+        url = 'http://127.0.0.1:%s/arm' % mock_datajson_source.PORT
+        source = HarvestSourceObj(url=url)
+        job = HarvestJobObj(source=source)
+
+        with patch('ckanext.datajson.gather_batch.gather_batch_size', return_value=100):
+            obj_ids = DataJsonHarvester().gather_stage(job)
+
+        assert_equal(len(obj_ids), len(set(obj_ids)))
+        objects = model.Session.query(harvest_model.HarvestObject) \
+            .filter(harvest_model.HarvestObject.id.in_(obj_ids)).all()
+        assert_equal(len(objects), len(obj_ids))
+        for obj in objects:
+            assert_equal(obj.harvest_job_id, job.id)
+            assert_equal(obj.harvest_source_id, source.id)
+            assert_in('schema_version', [extra.key for extra in obj.extras])
+
+    def test_load_remote_catalog(self):
+        url = 'http://127.0.0.1:%s/arm' % mock_datajson_source.PORT
+        job = HarvestJobObj(source=HarvestSourceObj(url=url))
+
+        events = list(DataJsonHarvester().load_remote_catalog(job))
+        assert_equal(events[0], ('catalog', None))
+        headers = dict(value for kind, value in events if kind == 'header')
+        assert_equal(headers['conformsTo'], 'https://project-open-data.cio.gov/v1.1/schema')
+        datasets = [value for kind, value in events if kind == 'dataset']
+        assert_equal(datasets[0]['title'],
+                     "NCEP GFS: vertical profiles of met quantities at standard pressures, at Barrow")
+        assert_equal(len(events), 1 + len(headers) + len(datasets))
+
+    def test_unchanged_catalog(self):
+        url = 'http://127.0.0.1:%s/arm' % mock_datajson_source.PORT
+        harvest_object, result, dataset = self.run_source(url=url)
+        # pretend all the other datasets were imported too
+        model.Session.query(harvest_model.HarvestObject) \
+            .filter_by(harvest_job_id=harvest_object.harvest_job_id) \
+            .update({'state': u'COMPLETE'}, synchronize_session=False)
+        model.Session.commit()
+
+        job = HarvestJobObj(source=harvest_object.source)
+        assert_equal(DataJsonHarvester().gather_stage(job), [])
+
+        # a changed configuration gathers the catalog again
+        harvest_object.source.config = json.dumps({'defaults': {'Agency': 'ARM'}})
+        harvest_object.source.save()
+        job = HarvestJobObj(source=harvest_object.source)
+        assert_equal(len(DataJsonHarvester().gather_stage(job)), 996)
+
+    def test_unchanged_catalog_with_errors(self):
+        url = 'http://127.0.0.1:%s/arm' % mock_datajson_source.PORT
+        gather_datasets = DataJsonHarvester._gather_datasets
+
+        def with_error(harvester, harvest_job, source_datasets):
+            harvester._save_gather_error('Invalid dataset', harvest_job)
+            return gather_datasets(harvester, harvest_job, source_datasets)
+
+        with patch.object(DataJsonHarvester, '_gather_datasets', autospec=True, side_effect=with_error):
+            harvest_object, result, dataset = self.run_source(url=url)
+        model.Session.query(harvest_model.HarvestObject) \
+            .filter_by(harvest_job_id=harvest_object.harvest_job_id) \
+            .update({'state': u'COMPLETE'}, synchronize_session=False)
+        model.Session.commit()
+
+        # the catalog is still skipped, and its error reported again
+        job = HarvestJobObj(source=harvest_object.source)
+        assert_equal(DataJsonHarvester().gather_stage(job), [])
+        errors = model.Session.query(harvest_model.HarvestGatherError).filter_by(harvest_job_id=job.id)
+        assert_equal([error.message for error in errors], ['Invalid dataset'])
+
+    def test_unreadable_catalog_not_saved(self):
+        url = 'http://127.0.0.1:%s/arm' % mock_datajson_source.PORT
+        job = HarvestJobObj(source=HarvestSourceObj(url=url))
+        with patch.object(DataJsonHarvester, '_catalog_events', side_effect=ValueError('truncated')):
+            assert_equal(DataJsonHarvester().gather_stage(job), [])
+        assert_equal(get_source_fetch(job.source.id), None)
+
+    def test_source_hash_from_gather(self):
+        url = 'http://127.0.0.1:%s/arm' % mock_datajson_source.PORT
+        harvest_object, result, dataset = self.run_source(url=url)
+
+        extras = dict((extra.key, extra.value) for extra in harvest_object.extras)
+        assert_equal(dataset.extras['source_hash'], extras['source_hash'])
+        assert_equal(extras['source_hash'], DataJsonHarvester().make_upstream_content_hash(
+            json.loads(harvest_object.content), harvest_object.source,
+            dict((k, v) for k, v in extras.items() if k.startswith('catalog_')), extras['schema_version']))
+
+    def reimport(self, harvest_object, content=None):
+        # imports the dataset of harvest_object again, with another HarvestObject
+        second = harvest_model.HarvestObject(
+            guid=harvest_object.guid, content=content or harvest_object.content,
+            harvest_job_id=harvest_object.harvest_job_id, harvest_source_id=harvest_object.harvest_source_id,
+            extras=[harvest_model.HarvestObjectExtra(key=extra.key, value=extra.value)
+                    for extra in harvest_object.extras])
+        second.save()
+        assert_equal(DataJsonHarvester().import_stage(second), True)
+        return second
+
+    def test_current_harvest_object(self):
+        url = 'http://127.0.0.1:%s/arm' % mock_datajson_source.PORT
+        harvest_object, result, dataset = self.run_source(url=url)
+        assert_equal(harvest_object.current, True)
+
+        second = self.reimport(harvest_object)
+
+        current = model.Session.query(harvest_model.HarvestObject) \
+            .filter_by(package_id=dataset.id, current=True).all()
+        assert_equal([ob.id for ob in current], [second.id])
+        model.Session.refresh(harvest_object)
+        assert_equal(harvest_object.current, False)
+
+    def test_resource_ids_kept(self):
+        url = 'http://127.0.0.1:%s/arm' % mock_datajson_source.PORT
+        harvest_object, result, dataset = self.run_source(url=url)
+        before = call_action('package_show', id=dataset.id)['resources']
+        assert before
+
+        # the same distributions, one with its URL in another form, and a new one
+        content = json.loads(harvest_object.content)
+        distribution = content['distribution']
+        distribution[0]['accessURL'] = distribution[0]['accessURL'].replace('http://', 'https://', 1)
+        distribution.append({'accessURL': 'http://example.gov/new.csv', 'format': 'text/csv'})
+        self.reimport(harvest_object, json.dumps(content))
+
+        after = call_action('package_show', id=dataset.id)['resources']
+        assert_equal([res['id'] for res in after[:len(before)]], [res['id'] for res in before])
+        assert_equal(len(after), len(before) + 1)
+
+    def test_job_context(self):
+        source = HarvestSourceObj(url='http://127.0.0.1:%s/arm?context' % mock_datajson_source.PORT,
+                                  config=json.dumps({'validator_schema': 'non-federal',
+                                                     'defaults': {'Agency': 'ARM'}}))
+        job = HarvestJobObj(source=source)
+        objects = [HarvestObjectObj(guid=guid, job=job) for guid in ('a', 'b')]
+        harvester = DataJsonHarvester()
+        with patch.object(harvester, 'load_config', wraps=harvester.load_config) as load_config:
+            contexts = [harvester.job_context(harvest_object) for harvest_object in objects]
+        # read once for the job
+        assert_equal(load_config.call_count, 1)
+        assert contexts[0] is contexts[1]
+        assert_equal(contexts[0].validator_schema, 'non-federal')
+        assert_equal(contexts[0].defaults, {'Agency': 'ARM'})
+        assert_equal(contexts[0].default_group, '')
+
+    def test_collection_exists(self):
+        url = 'http://127.0.0.1:%s/arm' % mock_datajson_source.PORT
+        harvest_object, result, dataset = self.run_source(url=url)
+        extras = call_action('package_show', id=dataset.id)['extras']
+        call_action('package_patch', id=dataset.id,
+                    extras=extras + [{'key': 'collection_metadata', 'value': 'true'}])
+
+        job_context = DataJsonHarvester().job_context(harvest_object)
+        with patch('ckanext.datajson.harvester_base.get_action') as get_action:
+            assert job_context.collection_exists(dataset.id)
+            assert not job_context.collection_exists('missing')
+            # other packages are looked up on their own
+            assert job_context.collection_exists(Dataset()['id'])
+            assert_equal(get_action.call_count, 0)
+
+    def test_delete_disappeared_datasets(self):
+        url = 'http://127.0.0.1:%s/arm' % mock_datajson_source.PORT
+        harvest_object, result, dataset = self.run_source(url=url)
+        # the imported dataset is no longer in the catalog
+        model.Session.query(model.PackageExtra).filter_by(package_id=dataset.id, key='identifier') \
+            .update({'value': u'removed-upstream'}, synchronize_session=False)
+        model.Session.commit()
+        source = harvest_object.source
+
+        source.config = json.dumps({'deletion_dry_run': True})
+        source.save()
+        job = HarvestJobObj(source=source)
+        DataJsonHarvester().gather_stage(job)
+        assert_equal(model.Package.get(dataset.id).state, 'active')
+        assert_in('1 datasets are no longer in the catalog and would be deleted',
+                  ' '.join(error.message for error in job.gather_errors))
+
+        source.config = None
+        source.save()
+        job = HarvestJobObj(source=source)
+        obj_ids = DataJsonHarvester().gather_stage(job)
+        model.Session.expire_all()
+        assert_equal(model.Package.get(dataset.id).state, 'deleted')
+        # and removed from the search index
+        assert_equal(call_action('package_search', fq='id:"%s"' % dataset.id, include_drafts=True)['count'], 0)
+        assert_in(dataset.id, [harvest_model.HarvestObject.get(obj_id).package_id for obj_id in obj_ids])
+
+    def test_prefetched_catalog(self):
+        url = 'http://127.0.0.1:%s/arm' % mock_datajson_source.PORT
+        source = HarvestSourceObj(url=url)
+        job = HarvestJobObj(source=source)
+        harvester = DataJsonHarvester()
+        spool = CatalogSpool(tempfile.mkdtemp())
+        previous, config_digest, headers = harvester._fetch_plan(source)
+        FetchScheduler(spool).run([{'job_id': job.id, 'url': url, 'headers': headers,
+                                    'config_digest': config_digest}])
+
+        with patch('ckanext.datajson.harvester_datajson.get_catalog_spool', return_value=spool), \
+                patch('ckanext.datajson.harvester_datajson.download', side_effect=URLError('not prefetched')):
+            assert_equal(len(harvester.gather_stage(job)), 996)
+        shutil.rmtree(spool.directory)
+
+    def test_datajson_dropped_connection(self):
+        url = 'http://127.0.0.1:%s/arm-dropped?harvest' % mock_datajson_source.PORT
+        harvest_object, result, dataset = self.run_source(url=url)
+        # the download was resumed where the connection dropped
+        assert_equal(len(mock_datajson_source.MockDataJSONHandler.attempts['/arm-dropped?harvest']), 2)
+        assert_equal(dataset.title, "NCEP GFS: vertical profiles of met quantities at standard pressures, at Barrow")
+
+    def test_gather_validation(self):
+        url = 'http://127.0.0.1:%s/arm' % mock_datajson_source.PORT
+        source = HarvestSourceObj(url=url)
+        source.config = json.dumps({'gather_validation': True})
+        source.save()
+        job = HarvestJobObj(source=source)
+        obj_ids = DataJsonHarvester().gather_stage(job)
+        invalid = [error.message for error in job.gather_errors if error.message.startswith('Identifier: ')]
+        # every dataset either gets a HarvestObject or a gather error
+        assert_equal(len(obj_ids) + len(invalid), 996)
+        for obj_id in obj_ids:
+            harvest_object = harvest_model.HarvestObject.get(obj_id)
+            assert_equal(DataJsonHarvester()._validate_dataset(None, '1.1', json.loads(harvest_object.content)), '')
+
+    def test_batch_import(self):
+        url = 'http://127.0.0.1:%s/arm' % mock_datajson_source.PORT
+        source = HarvestSourceObj(url=url)
+        job = HarvestJobObj(source=source)
+        harvester = DataJsonHarvester()
+        obj_ids = harvester.gather_stage(job)
+
+        with patch('ckanext.datajson.harvester_base.import_batch_size', return_value=20):
+            first = harvest_model.HarvestObject.get(obj_ids[0])
+            assert_equal(harvester.import_stage(first), True)
+            batch = model.Session.query(harvest_model.HarvestObject) \
+                .filter_by(harvest_job_id=job.id, current=True).all()
+            assert_equal(len(batch), 20)
+            for harvest_object in batch:
+                assert_equal(model.Package.get(harvest_object.package_id).state, 'active')
+
+            # the queue message of an object imported with the batch does nothing else
+            other = [harvest_object for harvest_object in batch if harvest_object.id != first.id][0]
+            assert_equal(other.state, 'COMPLETE')
+            assert_equal(harvester.fetch_stage(other), True)
+            with patch('ckanext.datajson.harvester_base.get_action') as get_action:
+                assert_equal(harvester.import_stage(other), True)
+                assert_equal(get_action.call_count, 0)
+            assert_equal([extra.key for extra in other.extras if extra.key == 'import_batch_result'], [])
+
+    def test_batch_pending(self):
+        url = 'http://127.0.0.1:%s/arm' % mock_datajson_source.PORT
+        source = HarvestSourceObj(url=url)
+        job = HarvestJobObj(source=source)
+        harvester = DataJsonHarvester()
+        harvest_object = harvest_model.HarvestObject.get(harvester.gather_stage(job)[0])
+        # claimed by a batch that is still running
+        harvest_object.state = u'IMPORT'
+        harvest_object.import_started = datetime.datetime.utcnow()
+        harvest_object.save()
+        with patch('ckanext.harvest.queue.get_fetch_publisher') as get_fetch_publisher:
+            assert_equal(harvester.fetch_stage(harvest_object), False)
+            get_fetch_publisher.return_value.send.assert_called_once_with({'harvest_object_id': harvest_object.id})
+
+    def test_batch_claim_expired(self):
+        url = 'http://127.0.0.1:%s/arm' % mock_datajson_source.PORT
+        source = HarvestSourceObj(url=url)
+        job = HarvestJobObj(source=source)
+        harvester = DataJsonHarvester()
+        harvest_object = harvest_model.HarvestObject.get(harvester.gather_stage(job)[0])
+        # claimed by a batch whose consumer died
+        harvest_object.state = u'IMPORT'
+        harvest_object.import_started = datetime.datetime(2000, 1, 1)
+        harvest_object.save()
+        assert_equal(harvester.fetch_stage(harvest_object), True)
+        assert_equal(harvester.import_stage(harvest_object), True)
+        assert_equal(model.Package.get(harvest_object.package_id).state, 'active')
@@ -0,0 +1,249 @@
+import BaseHTTPServer
+import base64
+import gzip
+import hashlib
+import json
+import socket
+import threading
+import time
+import zlib
+import tempfile
+from StringIO import StringIO
+from urllib2 import HTTPError, URLError
+
+from nose.tools import assert_equal, assert_raises, assert_true
+
+import pkg_resources
+
+from ckanext.datajson.http_client import ConnectionPool, IncompleteDownload, download, open_url
+import mock_datajson_source
+
+CATALOG = json.dumps({'dataset': [{'identifier': str(i), 'title': 'Dataset %d' % i} for i in range(500)]})
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = []
+    requests = []
+    busy = set()
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        Handler.connections.append(self.client_address)
+
+    def do_GET(self):
+        Handler.requests.append((self.path, dict(self.headers)))
+        accepted = self.headers.get('Accept-Encoding', '')
+        if self.path == '/catalog' and 'gzip' in accepted:
+            body = StringIO()
+            with gzip.GzipFile(fileobj=body, mode='wb') as f:
+                f.write(CATALOG)
+            self.respond(200, body.getvalue(), {'Content-Encoding': 'gzip'})
+        elif self.path == '/deflate':
+            self.respond(200, zlib.compress(CATALOG), {'Content-Encoding': 'deflate'})
+        elif self.path in ('/catalog', '/plain'):
+            self.respond(200, CATALOG)
+        elif self.path == '/chunked':
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(0, len(CATALOG), 1000):
+                chunk = CATALOG[i:i + 1000]
+                self.wfile.write('%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write('0\r\n\r\n')
+        elif self.path == '/moved':
+            self.respond(302, '', {'Location': '/catalog'})
+        elif self.path.startswith('/busy') and self.path not in Handler.busy:
+            Handler.busy.add(self.path)
+            self.respond(503, 'Try again', {'Retry-After': '0'})
+        elif self.path.startswith('/busy'):
+            self.respond(200, CATALOG)
+        elif self.path == '/gzip-digest':
+            body = StringIO()
+            with gzip.GzipFile(fileobj=body, mode='wb') as f:
+                f.write(CATALOG)
+            digest = hashlib.sha256(body.getvalue()).digest()
+            self.respond(200, body.getvalue(), {'Content-Encoding': 'gzip',
+                                                'Digest': 'SHA-256=' + base64.b64encode(digest)})
+        elif self.path in ('/digest', '/bad-digest'):
+            digest = hashlib.sha256(CATALOG if self.path == '/digest' else '').digest()
+            self.respond(200, CATALOG, {'Digest': 'SHA-256=' + base64.b64encode(digest)})
+        elif self.path == '/slow':
+            time.sleep(1)
+            self.respond(200, CATALOG)
+        else:
+            self.respond(404, 'Not found')
+
+    def respond(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingServer(BaseHTTPServer.HTTPServer):
+
+    def process_request(self, request, client_address):
+        thread = threading.Thread(target=self.finish_thread, args=(request, client_address))
+        thread.daemon = True
+        thread.start()
+
+    def finish_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except socket.error:
+            # the client closed a connection it did not read to the end
+            pass
+        finally:
+            self.shutdown_request(request)
+
+
+def serve():
+    server = ThreadingServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:%d' % server.server_address[1]
+
+
+class TestHttpClient(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.server, cls.base = serve()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setup(self):
+        self.pool = ConnectionPool()
+        del Handler.connections[:]
+        del Handler.requests[:]
+
+    def teardown(self):
+        self.pool.clear()
+
+    def get(self, path, **kwargs):
+        response = open_url(self.base + path, pool=self.pool, **kwargs)
+        try:
+            return response.read()
+        finally:
+            response.close()
+
+    def test_gzip(self):
+        response = open_url(self.base + '/catalog', pool=self.pool)
+        assert_equal(response.getheader('Content-Encoding'), 'gzip')
+        assert_true(int(response.getheader('Content-Length')) < len(CATALOG) / 5)
+        # streamed in small reads
+        body = ''.join(iter(lambda: response.read(1000), ''))
+        response.close()
+        assert_equal(body, CATALOG)
+        headers = Handler.requests[0][1]
+        assert_equal(headers['accept-encoding'], 'gzip, deflate')
+        assert_equal(headers['user-agent'], 'Data.gov/2.0')
+
+    def test_deflate_and_chunked(self):
+        assert_equal(self.get('/deflate'), CATALOG)
+        assert_equal(self.get('/chunked'), CATALOG)
+
+    def test_keep_alive(self):
+        for path in ('/catalog', '/plain', '/chunked', '/moved', '/catalog'):
+            assert_equal(self.get(path), CATALOG)
+        assert_equal(len(Handler.requests), 6)
+        assert_equal(len(Handler.connections), 1)
+
+    def test_unread_body_closes_connection(self):
+        response = open_url(self.base + '/chunked', pool=self.pool)
+        response.read(10)
+        response.close()
+        assert_equal(self.get('/plain'), CATALOG)
+        assert_equal(len(Handler.connections), 2)
+
+    def test_errors(self):
+        with assert_raises(HTTPError) as context:
+            self.get('/missing')
+        assert_equal(context.exception.code, 404)
+        with assert_raises(URLError):
+            self.get('/slow', timeout=0.2)
+        with assert_raises(URLError):
+            open_url('http://127.0.0.1:1/', pool=self.pool)
+
+
+class TestDownload(object):
+
+    @classmethod
+    def setup_class(cls):
+        mock_datajson_source.serve()
+        cls.base = 'http://127.0.0.1:%d' % mock_datajson_source.PORT
+        with open(pkg_resources.resource_filename(mock_datajson_source.__name__,
+                                                  'datajson-samples/arm.data.json'), 'rb') as f:
+            cls.arm = f.read()
+        cls.server, cls.local = serve()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setup(self):
+        self.pool = ConnectionPool()
+        self.file = tempfile.TemporaryFile()
+
+    def teardown(self):
+        self.file.close()
+        self.pool.clear()
+
+    def download(self, url, **kwargs):
+        kwargs.setdefault('backoff', 0)
+        response, digest = download(url, self.file, pool=self.pool, **kwargs)
+        self.file.seek(0)
+        body = self.file.read()
+        assert_equal(digest, hashlib.sha1(body).hexdigest())
+        return response, body
+
+    def test_dropped_connection_resumes(self):
+        response, body = self.download(self.base + '/arm-dropped?resume')
+        assert_equal(body, self.arm)
+        assert_equal(response.getheader('ETag'), mock_datajson_source.ETAG)
+        # the second request only asked for what was missing
+        assert_equal(mock_datajson_source.MockDataJSONHandler.attempts['/arm-dropped?resume'],
+                     [None, 'bytes=%d-' % (len(self.arm) // 2)])
+
+    def test_stalled_connection_resumes(self):
+        response, body = self.download(self.base + '/arm-stalled?resume', timeout=0.5)
+        assert_equal(body, self.arm)
+        assert_equal(len(mock_datajson_source.MockDataJSONHandler.attempts['/arm-stalled?resume']), 2)
+
+    def test_slow_connection(self):
+        response, body = self.download(self.base + '/arm-slow?once', timeout=0.5)
+        assert_equal(body, self.arm)
+        assert_equal(len(mock_datajson_source.MockDataJSONHandler.attempts['/arm-slow?once']), 1)
+
+    def test_gives_up(self):
+        with assert_raises(IncompleteDownload):
+            self.download(self.base + '/arm-dropped?give-up', retries=0)
+        with assert_raises(HTTPError):
+            self.download(self.local + '/missing')
+
+    def test_server_busy(self):
+        response, body = self.download(self.local + '/busy')
+        assert_equal(body, CATALOG)
+
+    def test_digest(self):
+        response, body = self.download(self.local + '/digest')
+        assert_equal(body, CATALOG)
+        with assert_raises(IncompleteDownload):
+            self.download(self.local + '/bad-digest', retries=1)
+
+    def test_digest_of_encoded_body(self):
+        # the digest covers the gzip bytes, not the inflated body
+        response, body = self.download(self.local + '/gzip-digest', retries=0)
+        assert_equal(body, CATALOG)
+        assert_equal(response.getheader('Content-Encoding'), 'gzip')
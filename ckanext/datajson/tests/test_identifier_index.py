@@ -0,0 +1,93 @@
+from mock import patch
+from nose.tools import assert_equal, assert_in, assert_not_in, assert_true
+
+try:
+    from ckan.tests.helpers import reset_db, call_action
+    from ckan.tests.factories import Dataset, Organization
+except ImportError:
+    from ckan.new_tests.helpers import reset_db, call_action
+    from ckan.new_tests.factories import Dataset, Organization
+
+from ckanext.datajson import db
+from ckanext.datajson.db import identifier_owner, identifier_owners
+from ckanext.datajson.package2pod import Package2Pod
+
+POD_DATASET = {
+    "title": "Water Quality", "description": "Samples", "keyword": ["water"], "modified": "2016-01-01",
+    "publisher": {"name": "Agency"}, "contactPoint": {"fn": "Jane", "hasEmail": "mailto:jane@example.gov"},
+    "accessLevel": "public", "bureauCode": ["010:00"], "programCode": ["010:000"],
+}
+
+
+def pod_dataset(identifier):
+    return dict(POD_DATASET, identifier=identifier)
+
+
+def identifier_extra(identifier):
+    return [{'key': 'identifier', 'value': identifier}]
+
+
+def duplicate_messages(errors):
+    return [message for heading, messages in errors for message in messages if 'used more than once' in message]
+
+
+class TestIdentifierIndex(object):
+
+    def setup(self):
+        reset_db()
+        db._initialized = False
+        Package2Pod.seen_identifiers = set()
+        Package2Pod.identifier_owners = None
+
+    def test_create(self):
+        dataset = Dataset(extras=identifier_extra('water-1'))
+        assert_equal(identifier_owner('water-1'), dataset['id'])
+        assert_equal(identifier_owner('water-2'), None)
+
+    def test_update_identifier_changed(self):
+        dataset = Dataset(extras=identifier_extra('water-1'))
+        call_action('package_patch', id=dataset['id'], extras=identifier_extra('water-2'))
+        assert_equal(identifier_owner('water-1'), None)
+        assert_equal(identifier_owner('water-2'), dataset['id'])
+
+    def test_update_keeps_claim(self):
+        first = Dataset(extras=identifier_extra('water-1'))
+        second = Dataset(extras=identifier_extra('water-1'))
+        # saving the first package again does not give the identifier to the second
+        call_action('package_patch', id=first['id'], title='Water Quality Samples')
+        assert_equal(identifier_owner('water-1'), first['id'])
+        assert_equal(identifier_owners(['water-1', 'water-3']), {'water-1': first['id']})
+        call_action('package_delete', id=first['id'])
+        assert_equal(identifier_owner('water-1'), second['id'])
+
+    def test_delete(self):
+        dataset = Dataset(extras=identifier_extra('water-1'))
+        call_action('package_delete', id=dataset['id'])
+        assert_equal(identifier_owner('water-1'), None)
+        assert_equal(identifier_owners(['water-1']), {})
+
+    def test_index_failure_does_not_fail_save(self):
+        with patch('ckanext.datajson.plugin.update_identifier_index', side_effect=Exception('no index')):
+            dataset = Dataset(extras=identifier_extra('water-1'))
+        assert_equal(call_action('package_show', id=dataset['id'])['id'], dataset['id'])
+
+    def test_duplicate_report(self):
+        first = Dataset(owner_org=Organization()['id'], extras=identifier_extra('water-1'))
+        second = Dataset(owner_org=Organization()['id'], extras=identifier_extra('water-1'))
+        for owners in (None, identifier_owners(['water-1'])):
+            # once with the owners loaded for the export, once looked up per package
+            Package2Pod.seen_identifiers = set()
+            Package2Pod.identifier_owners = owners
+            # the duplicate is reported even when it is exported first, or alone
+            result = Package2Pod.validate(second, pod_dataset('water-1'))
+            assert_true(duplicate_messages(result['errors']))
+            result = Package2Pod.validate(first, pod_dataset('water-1'))
+            assert_equal(duplicate_messages(result.get('errors', [])), [])
+
+    def test_duplicate_in_export_without_index(self):
+        # identifiers the index does not know are compared within the export
+        first = {'id': 'pkg-1', 'name': 'first', 'title': 'First'}
+        second = {'id': 'pkg-2', 'name': 'second', 'title': 'Second'}
+        Package2Pod.identifier_owners = {}
+        assert_not_in('errors', Package2Pod.validate(first, pod_dataset('water-9')))
+        assert_in('errors', Package2Pod.validate(second, pod_dataset('water-9')))
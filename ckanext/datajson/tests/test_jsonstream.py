@@ -0,0 +1,105 @@
+from codecs import BOM_UTF8
+import gzip
+import json
+from StringIO import StringIO
+import zlib
+
+from nose.tools import assert_equal, assert_raises, assert_true
+
+from ckanext.datajson.datajsonvalidator import do_validation, do_stream_validation
+from ckanext.datajson.jsonstream import CHUNK_SIZE, DecompressingReader, JsonStreamParser, detect_encoding
+
+DATASET = {
+    "title": "Water Quality", "description": "Samples", "keyword": ["water"], "modified": "2016-01-01",
+    "publisher": {"name": "Agency"}, "contactPoint": {"fn": "Jane", "hasEmail": "mailto:jane@example.gov"},
+    "identifier": "water-1", "accessLevel": "public", "bureauCode": ["010:00"], "programCode": ["010:000"],
+}
+
+
+def parse(content, encoding):
+    return list(JsonStreamParser(StringIO(content), encoding).events())
+
+
+def test_detect_encoding():
+    for content, encoding, title in [
+            ('[{"title": "caf\xc3\xa9"}]', 'utf-8', u'caf\xe9'),
+            (BOM_UTF8 + '[{"title": "caf\xc3\xa9"}]', 'utf-8', u'caf\xe9'),
+            ('[{"title": "\x93quoted\x94"}]', 'cp1252', u'\u201cquoted\u201d'),
+            ('[{"title": "\x81"}]', 'iso-8859-1', u'\x81')]:
+        f = StringIO(content)
+        assert_equal(detect_encoding(f), encoding)
+        assert_equal(f.tell(), 0)
+        assert_equal(parse(content, encoding), [('dataset', {u'title': title})])
+
+
+def test_detect_encoding_across_chunks():
+    # a multi-byte character split between two reads is still UTF-8
+    content = '[{"title": "' + 'x' * (64 * 1024 - 12) + '\xc3\xa9"}]'
+    assert_equal(detect_encoding(StringIO(content)), 'utf-8')
+
+
+def gzipped(content):
+    f = StringIO()
+    with gzip.GzipFile(fileobj=f, mode='wb') as g:
+        g.write(content)
+    return f.getvalue()
+
+
+def test_events():
+    assert_equal(parse('[{"a": 1}, {"b": [2.5, null]}]', 'utf-8'),
+                 [('dataset', {u'a': 1}), ('dataset', {u'b': [2.5, None]})])
+    assert_equal(parse('{"conformsTo": "x", "dataset": [{"a": 1}]}', 'utf-8'),
+                 [('header', (u'conformsTo', u'x')), ('dataset', {u'a': 1})])
+    assert_equal(parse('"text"', 'utf-8'), [('value', u'text')])
+
+
+def test_events_across_chunks():
+    datasets = [{"title": "dataset %d" % i, "size": i * 1000.5} for i in range(2000)]
+    parser = JsonStreamParser(StringIO(json.dumps(datasets)), chunk_size=512)
+    assert_equal([value for kind, value in parser.events()], datasets)
+
+
+def test_gzip_body():
+    content = json.dumps([DATASET] * 50)
+    reader = DecompressingReader(StringIO(gzipped(content)), 'gzip')
+    assert_equal([value for kind, value in JsonStreamParser(reader).events()], [DATASET] * 50)
+
+
+def test_deflate_body():
+    content = json.dumps([DATASET])
+    for compressed in (zlib.compress(content), zlib.compress(content)[2:-4]):
+        assert_equal(DecompressingReader(StringIO(compressed), 'deflate').read(), content)
+
+
+def test_gzip_bomb():
+    # a few hundred kB inflating to 256 MB are inflated as they are read
+    reader = DecompressingReader(StringIO(gzipped('[' + ' ' * (256 * 1024 * 1024))), 'gzip')
+    assert_equal(reader.read(10), '[' + ' ' * 9)
+    assert_true(len(reader._buffer) <= CHUNK_SIZE)
+    assert_equal(len(reader.read(CHUNK_SIZE)), CHUNK_SIZE)
+    assert_true(len(reader._buffer) <= CHUNK_SIZE)
+
+
+def test_malformed():
+    for content in ('[{"a": 1},, {"b": 2}]', '[{"a": 1}', '{"dataset": [1] "x": 2}', '[1] 2', '', '[{"a": tru}]'):
+        assert_raises(ValueError, parse, content, 'utf-8')
+
+
+def test_validation_parity():
+    invalid = dict(DATASET, accessLevel="secret", identifier="water-2")
+    del invalid['title']
+    for doc in ([DATASET], [DATASET, DATASET], [DATASET, invalid, invalid], [], {}, {"dataset": [DATASET]},
+                {"dataset": []}, "text", 5):
+        expected = []
+        do_validation(json.loads(json.dumps(doc)), expected, set())
+        for content in (json.dumps(doc), json.dumps(doc, indent=2)):
+            errors = []
+            do_stream_validation(StringIO(content), errors, set())
+            assert_equal(errors, expected)
+
+
+def test_validation_invalid_json():
+    for content in ('[{"title": "x"},]', '{"dataset": [', ''):
+        errors = []
+        do_stream_validation(StringIO(content), errors, set())
+        assert_equal([heading for heading, messages in errors], ["Invalid JSON"])
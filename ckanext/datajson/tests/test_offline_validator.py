@@ -0,0 +1,81 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+from nose.tools import assert_equal, assert_in, assert_true, assert_false
+
+from ckanext.datajson.offline_validator import validate_file, validate_files, find_files, format_text_report
+
+SAMPLE = os.path.join(os.path.dirname(__file__), 'datajson-samples', 'arm.data.json')
+
+
+class TestOfflineValidator(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.directory = tempfile.mkdtemp()
+        with open(SAMPLE) as f:
+            catalog = json.load(f)
+        catalog['dataset'] = catalog['dataset'][:20]
+        cls.catalog = catalog
+
+        cls.write('catalog.json', json.dumps(catalog))
+        with gzip.open(os.path.join(cls.directory, 'catalog.json.gz'), 'wb') as f:
+            f.write(json.dumps(catalog))
+        broken = dict(catalog, dataset=[dict(d) for d in catalog['dataset']])
+        del broken['dataset'][3]['title']
+        cls.write('broken.json', json.dumps(broken))
+        cls.write('invalid.json', json.dumps(catalog)[:-20])
+        cls.write('notes.txt', 'not a data.json file')
+
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(cls.directory)
+
+    @classmethod
+    def write(cls, name, content):
+        with open(os.path.join(cls.directory, name), 'wb') as f:
+            f.write(content)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def test_find_files(self):
+        assert_equal(find_files([self.directory]),
+                     [self.path(name) for name in ('broken.json', 'catalog.json', 'catalog.json.gz', 'invalid.json')])
+
+    def test_catalog(self):
+        result = validate_file(self.path('catalog.json'))
+        assert_equal(result['datasets'], 20)
+        assert_equal(result['schema'], 'federal-v1.1')
+        # same report for the compressed copy
+        gz_result = validate_file(self.path('catalog.json.gz'))
+        assert_equal(gz_result['errors'], result['errors'])
+        assert_equal(gz_result['schema_errors'], result['schema_errors'])
+
+    def test_missing_field(self):
+        result = validate_file(self.path('broken.json'))
+        assert_false(result['valid'])
+        assert_in(("Missing Required Fields", ["The 'title' field is missing. (1 locations)"]), result['errors'])
+        assert_in("'title' is a required property",
+                  [e for error in result['schema_errors'] for e in error['errors']])
+
+    def test_invalid_json(self):
+        result = validate_file(self.path('invalid.json'))
+        assert_false(result['valid'])
+        assert_equal(result['errors'][0][0], "Invalid JSON")
+
+    def test_missing_file(self):
+        result = validate_file(self.path('nothing.json'))
+        assert_equal(result['errors'][0][0], "Error Loading File")
+
+    def test_validate_files(self):
+        paths = find_files([self.directory])
+        report = validate_files(paths, processes=2)
+        assert_equal([r['file'] for r in report['results']], paths)
+        assert_equal(report['files'], 4)
+        assert_false(report['valid'])
+        assert_true(report['seconds'] >= 0)
+        assert_in('4 files', format_text_report(report))
@@ -0,0 +1,66 @@
+import hashlib
+
+from nose.tools import assert_equal, assert_not_equal
+
+try:
+    from ckan.tests.helpers import reset_db
+    from ckan.tests.factories import Dataset
+except ImportError:
+    from ckan.new_tests.helpers import reset_db
+    from ckan.new_tests.factories import Dataset
+
+from ckanext.datajson import db
+from ckanext.datajson.package_names import PackageNameAllocator, package_slug
+
+
+def suffix(package_id):
+    return hashlib.sha1(package_id).hexdigest()[:5]
+
+
+class TestPackageNameAllocator(object):
+
+    def setup(self):
+        reset_db()
+        db._initialized = False
+
+    def test_slug(self):
+        assert_equal(package_slug(u'Water -- Quality_Data'), 'water-quality-data')
+        assert_equal(len(package_slug('x' * 200)), 90)
+
+    def test_batch(self):
+        Dataset(name='water-quality')
+        names = PackageNameAllocator()
+        names.allocate_all([('Water Quality', 'pkg-1'), ('Water Quality', 'pkg-2'), ('Air Quality', 'pkg-3')])
+        assert_equal(names.allocate('Water Quality', 'pkg-1'), 'water-quality-' + suffix('pkg-1'))
+        assert_equal(names.allocate('Water Quality', 'pkg-2'), 'water-quality-' + suffix('pkg-2'))
+        assert_equal(names.allocate('Air Quality', 'pkg-3'), 'air-quality')
+
+    def test_reserved_by_other_worker(self):
+        # another worker reserves a name first
+        other = PackageNameAllocator()
+        assert_equal(other.allocate('Soil Survey', 'pkg-1'), 'soil-survey')
+        names = PackageNameAllocator()
+        assert_equal(names.allocate('Soil Survey', 'pkg-2'), 'soil-survey-' + suffix('pkg-2'))
+        # the reservation stays with its package
+        assert_equal(PackageNameAllocator().allocate('Soil Survey', 'pkg-1'), 'soil-survey')
+
+    def test_existing_package_keeps_name(self):
+        Dataset(name='census')
+        existing = Dataset(name='census-abcde')
+        assert_equal(PackageNameAllocator().allocate('Census', existing['id']), 'census-abcde')
+        assert_not_equal(PackageNameAllocator().allocate('Census', 'pkg-1'), 'census-abcde')
+
+    def test_many_slugs(self):
+        # more slugs than one query looks up
+        Dataset(name='survey-150')
+        names = PackageNameAllocator()
+        names.allocate_all([('Survey %d' % i, 'pkg-%d' % i) for i in range(250)])
+        assert_equal(names.allocate('Survey 150', 'pkg-150'), 'survey-150-' + suffix('pkg-150'))
+        assert_equal(names.allocate('Survey 249', 'pkg-249'), 'survey-249')
+
+    def test_release(self):
+        assert_equal(PackageNameAllocator().allocate('Soil Survey', 'pkg-1'), 'soil-survey')
+        db.release_package_names(['pkg-1'])
+        db.Session.commit()
+        # the package was not created after all, the name is free again
+        assert_equal(PackageNameAllocator().allocate('Soil Survey', 'pkg-2'), 'soil-survey')
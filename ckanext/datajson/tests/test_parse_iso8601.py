@@ -0,0 +1,134 @@
+import random
+
+from nose.tools import assert_equal, assert_raises
+
+from ckanext.datajson import parse_iso8601
+from ckanext.datajson.datajsonvalidator import (ISSUED_REGEX, MODIFIED_REGEX_1, MODIFIED_REGEX_2, MODIFIED_REGEX_3,
+                                                TEMPORAL_REGEX_1, TEMPORAL_REGEX_2, TEMPORAL_REGEX_3)
+
+# every recognizer and the regex it replaces
+PAIRS = [
+    (ISSUED_REGEX, parse_iso8601.is_date),
+    (MODIFIED_REGEX_1, parse_iso8601.is_date),
+    (MODIFIED_REGEX_2, parse_iso8601.is_duration),
+    (MODIFIED_REGEX_3, parse_iso8601.is_date_duration),
+    (TEMPORAL_REGEX_1, parse_iso8601.is_date_range),
+    (TEMPORAL_REGEX_2, parse_iso8601.is_date_duration),
+    (TEMPORAL_REGEX_3, parse_iso8601.is_duration_date),
+]
+
+# the field checks, which try the common shapes first, and the regexes they replace
+FIELDS = [
+    ((ISSUED_REGEX,), parse_iso8601.is_issued),
+    ((MODIFIED_REGEX_1, MODIFIED_REGEX_2, MODIFIED_REGEX_3), parse_iso8601.is_modified),
+    ((TEMPORAL_REGEX_1, TEMPORAL_REGEX_2, TEMPORAL_REGEX_3), parse_iso8601.is_temporal),
+]
+
+ALPHABET = '0123456789-:.,/+TZzWPRYMDHS \n_x'
+
+
+def random_date(rnd):
+    c = rnd.choice
+    s = c(['', '', '+', '-']) + c(['2015', '1999', '0000', '201', '20155', '201501'])
+    if rnd.random() < 0.85:
+        sep = c(['-', '-', '', ':'])
+        s += sep + c([c(['01', '12', '13', '00', '1']) + c(['', sep + c(['01', '31', '32', '00']), '-15', '15']),
+                      'W' + c(['00', '52', '53', '1']) + c(['', '-3', '3', '-8', '-']),
+                      c(['001', '366', '360', '361', '367', '123'])])
+        if rnd.random() < 0.7:
+            s += c(['T', ' ', 't', '\n', '\t'])
+            if rnd.random() < 0.9:
+                minute_sep = c([':', ':', '', '-'])
+                s += c(['10', '23', '24', '25', '00']) + c(['', minute_sep + c(['00', '59', '60', '5'])])
+                if rnd.random() < 0.3:
+                    s += c(['.', ',']) + c(['5', '123', '', '1:', '1234'])
+                if rnd.random() < 0.6:
+                    s += c([minute_sep, ':', '']) + c(['30', '59', '61']) + c(['', '.5', ',123', '.'])
+            s += c(['', '', 'Z', 'z', '+05:00', '-0500', '+05', '+05:', '+24', '-23:59', '+05:60'])
+    return s
+
+
+def random_duration(rnd):
+    c = rnd.choice
+    s = c(['', '', 'R/', 'R5/', 'R', 'R5']) + 'P'
+    for unit in 'YMWD':
+        if rnd.random() < 0.4:
+            s += c(['1', '10', '1.5', '1.', '.5']) + unit
+    if rnd.random() < 0.5:
+        s += 'T'
+        for unit in 'HMS':
+            if rnd.random() < 0.4:
+                s += c(['1', '10', '1.5']) + unit
+    if rnd.random() < 0.1:
+        s += c(['Y', 'D', 'T', 'M1'])
+    return s
+
+
+def random_value(rnd):
+    r = rnd.random()
+    if r < 0.1:
+        s = ''.join(rnd.choice(ALPHABET) for _ in range(rnd.randint(0, 25)))
+    elif r < 0.3:
+        s = random_date(rnd)
+    elif r < 0.45:
+        s = random_duration(rnd)
+    elif r < 0.7:
+        s = random_date(rnd) + '/' + random_date(rnd)
+    elif r < 0.85:
+        s = rnd.choice(['', 'R/', 'R2/']) + random_date(rnd) + '/' + random_duration(rnd)
+    else:
+        s = random_duration(rnd) + '/' + random_date(rnd)
+    if rnd.random() < 0.05:
+        s += '\n'
+    if rnd.random() < 0.3:
+        # a few random edits
+        chars = list(s)
+        for _ in range(rnd.randint(1, 3)):
+            pos = rnd.randint(0, len(chars))
+            op = rnd.random()
+            if op < 0.5:
+                chars.insert(pos, rnd.choice(ALPHABET))
+            elif chars:
+                del chars[min(pos, len(chars) - 1)]
+        s = ''.join(chars)
+    if rnd.random() < 0.3:
+        s = unicode(s)
+    return s
+
+
+def assert_same_as_regexes(value):
+    for regex, recognizer in PAIRS:
+        assert_equal(recognizer(value), bool(regex.match(value)),
+                     '%s(%r) differs from its regex' % (recognizer.__name__, value))
+    for regexes, check in FIELDS:
+        assert_equal(check(value), any(regex.match(value) for regex in regexes),
+                     '%s(%r) differs from its regexes' % (check.__name__, value))
+
+
+def test_examples():
+    for value in ['2015-01-01', '2015-01-01T10:20:30Z', '2015-01-01T10:20:30.123-05:00', '2015-W05-3',
+                  '2015-123', '2015-360', '201501', '2015-01-01\n', '2015-01-01T', '2015-01-01T1230.545',
+                  '2015-01-01T24:00', '2015-01-01T24:00:00', 'R/P1Y', 'R/PT1H', 'P1M1Y', 'P1.Y', 'R5/P1Y/2015',
+                  '2015-01-01/2015-12-31', '2015-01/2016-01-01', '2015/2016-01-01', '2015-01-01/20160101',
+                  '2015-01-01/2016-01-01T10:00:00', '2015-01-01T1000/2016-01-01T10:00:00',
+                  'R/2015-01-01T13:00:00Z/P1D', 'P1Y2M10DT2H30M/2008-05-11T15:30:00Z', '', 'not a date',
+                  '2015-W05', '2015-W53-1', 'R/2015-01-01/P1Y', 'R2/P1Y/2016-01-01', 'P1Y/2016-01-01',
+                  '2015-13-45', '2015-02-45', '+2015-13-45', '2015-13-45/P1Y', 'garbage/garbage',
+                  'R/P' + '1' * 100 + 'Y', 'R/2015-01-01/P' + '1' * 100 + 'D']:
+        assert_same_as_regexes(value)
+
+
+def test_random_values():
+    rnd = random.Random(8601)
+    for _ in xrange(20000):
+        assert_same_as_regexes(random_value(rnd))
+
+
+def test_long_values():
+    for value in ['P' + '1' * 5000 + 'X', '2015-01-01T10:20:30.' + '1' * 5000 + ':',
+                  '2015-01-01T10.' + '5' * 5000 + '30Z', '2015-01-01/' + '1' * 5000]:
+        assert_same_as_regexes(value)
+
+
+def test_not_a_string():
+    assert_raises(TypeError, parse_iso8601.is_modified, 2015)
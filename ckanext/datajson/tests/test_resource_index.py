@@ -0,0 +1,54 @@
+from nose.tools import assert_equal, assert_true, assert_false
+
+from ckanext.datajson.resource_index import ResourceIndex, normalize_url, resource_unchanged
+
+
+def resource(url, resource_id=None, **fields):
+    fields['url'] = url
+    if resource_id:
+        fields['id'] = resource_id
+    return fields
+
+
+def test_normalize_url():
+    assert_equal(normalize_url(' HTTPS://Data.Example.GOV:443/Files/a.csv '),
+                 'http://data.example.gov/Files/a.csv')
+    assert_equal(normalize_url('http://example.gov/discovery/#v/results/a'), 'http://example.gov/discovery#v/results/a')
+    assert_equal(normalize_url('http://example.gov:80/dir/'), 'http://example.gov/dir')
+    assert_equal(normalize_url('http://example.gov:8080/a?b=1'), 'http://example.gov:8080/a?b=1')
+    assert_equal(normalize_url('http://[::1]/a'), 'http://[::1]/a')
+    assert_equal(normalize_url(None), '')
+
+
+class TestResourceIndex(object):
+
+    def test_match(self):
+        existing = [resource('http://example.gov/a.csv', 'a'), resource('http://example.gov/b.csv', 'b'),
+                    resource('https://example.gov/c.csv', 'c')]
+        matches = ResourceIndex(existing).match([
+            resource('http://example.gov/new.csv'),
+            resource('http://example.gov/b.csv'),
+            resource('http://EXAMPLE.gov/c.csv'),
+            resource('http://example.gov/a.csv'),
+        ])
+        assert_equal([m and m['id'] for m in matches], [None, 'b', 'c', 'a'])
+
+    def test_duplicate_urls(self):
+        existing = [resource('http://example.gov/x', 'x1'), resource('http://example.gov/x', 'x2')]
+        matches = ResourceIndex(existing).match([resource('http://example.gov/x')] * 3)
+        assert_equal([m and m['id'] for m in matches], ['x1', 'x2', None])
+
+    def test_exact_before_normalized(self):
+        existing = [resource('http://example.gov/x', 'exact'), resource('https://example.gov/x/', 'other')]
+        matches = ResourceIndex(existing).match([resource('https://example.gov/x'), resource('http://example.gov/x')])
+        assert_equal([m['id'] for m in matches], ['other', 'exact'])
+
+    def test_unchanged(self):
+        existing = resource('http://example.gov/a.csv', 'a', name='A', format='CSV', mimetype='',
+                            description='', created='2016-01-01', conformsTo=None)
+        assert_true(resource_unchanged(resource('http://example.gov/a.csv', name='A', format='CSV',
+                                                mimetype=None, description=''), existing))
+        assert_false(resource_unchanged(resource('http://example.gov/a.csv', name='B', format='CSV'), existing))
+        # a field the distribution no longer has
+        existing['describedBy'] = 'http://example.gov/a.json'
+        assert_false(resource_unchanged(resource('http://example.gov/a.csv', name='A', format='CSV'), existing))
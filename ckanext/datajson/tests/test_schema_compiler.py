@@ -0,0 +1,80 @@
+import copy
+import json
+import os
+import random
+
+from jsonschema import Draft4Validator
+from jsonschema.exceptions import best_match
+from nose.tools import assert_equal, assert_true, assert_false, assert_raises
+
+from ckanext.datajson.schema_compiler import compile_schema, CompileError
+from ckanext.datajson.schema_validators import SCHEMA_FILES, get_schema_validator
+
+SAMPLE = os.path.join(os.path.dirname(__file__), 'datajson-samples', 'arm.data.json')
+
+VALUES = [None, 1, True, 2.5, u'', u'x', u'not a uri', u'http://example.gov/x', u'a@b', u'2015-01-01',
+          [], [1], [{}], [u'a', u'a'], {}, {u'fn': u'x'}, {u'@type': u'vcard:Contact'}]
+
+
+def error_details(error):
+    return (error.message, list(error.path), list(error.schema_path), error.validator, error.validator_value,
+            error.instance, error.schema, repr(error.cause), [error_details(e) for e in error.context])
+
+
+def mutations(dataset, count, rnd):
+    # copies of dataset with a few fields removed or replaced, at any depth
+    for _ in range(count):
+        mutated = copy.deepcopy(dataset)
+        for _ in range(rnd.randint(1, 4)):
+            target = mutated
+            while target and rnd.random() < 0.6:
+                key = rnd.choice(list(target.keys()) if isinstance(target, dict) else range(len(target)))
+                if not isinstance(target[key], (dict, list)):
+                    break
+                target = target[key]
+            if isinstance(target, dict) and target:
+                key = rnd.choice(list(target.keys()))
+                if rnd.random() < 0.3:
+                    del target[key]
+                else:
+                    target[key] = copy.deepcopy(rnd.choice(VALUES))
+            elif isinstance(target, list) and target:
+                target[rnd.randrange(len(target))] = copy.deepcopy(rnd.choice(VALUES))
+        yield mutated
+
+
+def test_same_errors_as_jsonschema():
+    with open(SAMPLE) as f:
+        datasets = json.load(f)['dataset'][:10]
+    rnd = random.Random(32)
+    for variant in sorted(SCHEMA_FILES):
+        compiled = get_schema_validator(variant)
+        interpreted = get_schema_validator(variant, compiled=False)
+        assert_true(hasattr(compiled, 'source'), variant)
+        for dataset in datasets:
+            for instance in [dataset] + list(mutations(dataset, 20, rnd)) + VALUES:
+                assert_equal([error_details(e) for e in compiled.iter_errors(instance)],
+                             [error_details(e) for e in interpreted.iter_errors(instance)])
+                assert_equal(compiled.is_valid(instance), interpreted.is_valid(instance))
+                expected = best_match(interpreted.iter_errors(instance))
+                if expected is not None:
+                    assert_equal(error_details(best_match(compiled.iter_errors(instance))), error_details(expected))
+
+
+def test_recursive_reference():
+    schema = {
+        'type': 'object',
+        'properties': {'name': {'type': 'string'}, 'parent': {'$ref': '#'}},
+        'required': ['name'],
+    }
+    compiled = compile_schema(Draft4Validator(schema))
+    instance = {'name': 'a', 'parent': {'name': 'b', 'parent': {'parent': 1}}}
+    assert_equal([error_details(e) for e in compiled.iter_errors(instance)],
+                 [error_details(e) for e in Draft4Validator(schema).iter_errors(instance)])
+    assert_false(compiled.is_valid(instance))
+    assert_true(compiled.is_valid({'name': 'a', 'parent': {'name': 'b'}}))
+
+
+def test_unsupported_keyword():
+    assert_raises(CompileError, compile_schema, Draft4Validator({'type': 'integer', 'minimum': 1}))
+    assert_raises(CompileError, compile_schema, Draft4Validator({'type': 'decimal'}))
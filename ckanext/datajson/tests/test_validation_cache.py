@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+
+from nose.tools import assert_equal, assert_raises
+
+from ckanext.datajson import validation_cache
+from ckanext.datajson.validation_cache import ValidationCache, cached_result
+
+
+class TestValidationCache(object):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        validation_cache._cache = ValidationCache(os.path.join(self.directory, 'cache.sqlite'))
+
+    def teardown(self):
+        validation_cache._cache = None
+        shutil.rmtree(self.directory)
+
+    def test_cached(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return ['error']
+
+        assert_equal(cached_result({'b': 1, 'a': 2}, 'v1', compute), ['error'])
+        assert_equal(cached_result({'a': 2, 'b': 1}, 'v1', compute), ['error'])
+        assert_equal(len(calls), 1)
+        cached_result({'a': 2, 'b': 1}, 'v2', compute)
+        assert_equal(len(calls), 2)
+
+    def test_exception_not_cached(self):
+        def fail():
+            raise IOError('schema not readable')
+
+        assert_raises(IOError, cached_result, {'a': 1}, 'v1', fail)
+        assert_equal(cached_result({'a': 1}, 'v1', lambda: []), [])
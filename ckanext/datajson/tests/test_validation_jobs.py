@@ -0,0 +1,162 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import urllib2
+from StringIO import StringIO
+
+from mock import patch
+from nose.tools import assert_equal, assert_not_equal, assert_true
+
+from ckanext.datajson.validation_jobs import ReportStore, STATUS_DONE, STATUS_ERROR, STATUS_PENDING, \
+    run_validation_job, submit_validation
+
+URL = 'http://example.gov/data.json'
+DATASET = {
+    "title": "Water Quality", "description": "Samples", "keyword": ["water"], "modified": "2016-01-01",
+    "publisher": {"name": "Agency"}, "contactPoint": {"fn": "Jane", "hasEmail": "mailto:jane@example.gov"},
+    "identifier": "water-1", "accessLevel": "public", "bureauCode": ["010:00"], "programCode": ["010:000"],
+}
+
+
+class Response(object):
+    # what urllib2.urlopen returns, as far as the validation reads it
+
+    def __init__(self, body, etag=None):
+        self.body = StringIO(body)
+        self.headers = {'ETag': etag} if etag else {}
+        self.reads = 0
+
+    def info(self):
+        return self
+
+    def getheader(self, name):
+        return self.headers.get(name)
+
+    def read(self, size=-1):
+        self.reads += 1
+        return self.body.read(size)
+
+    def close(self):
+        pass
+
+
+class TestReportStore(object):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = ReportStore(self.directory, max_reports=2, max_age=3600)
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def age(self, key, seconds):
+        path = os.path.join(self.directory, 'reports', key + '.json')
+        then = time.time() - seconds
+        os.utime(path, (then, then))
+
+    def test_report_key(self):
+        assert_equal(ReportStore.report_key(URL, etag='"a"'), ReportStore.report_key(URL, etag='"a"'))
+        assert_not_equal(ReportStore.report_key(URL, etag='"a"'), ReportStore.report_key(URL, content_hash='"a"'))
+        assert_not_equal(ReportStore.report_key(URL, etag='"a"'),
+                         ReportStore.report_key(URL + '?x', etag='"a"'))
+
+    def test_max_age(self):
+        self.store.put_report({'errors': []}, 'old', 'new')
+        self.age('old', 7200)
+        assert_equal(self.store.get_report('old'), None)
+        assert_equal(self.store.get_report('new'), {'errors': []})
+        assert_equal(sorted(os.listdir(os.path.join(self.directory, 'reports'))), ['new.json'])
+
+    def test_least_recently_used(self):
+        self.store.put_report({'n': 1}, 'first')
+        self.store.put_report({'n': 2}, 'second')
+        self.age('first', 20)
+        self.age('second', 10)
+        # reading a report makes it the most recently used one
+        self.store.get_report('first')
+        self.store.put_report({'n': 3}, 'third')
+        assert_equal(self.store.get_report('second'), None)
+        assert_equal(self.store.get_report('first'), {'n': 1})
+        assert_equal(self.store.get_report('third'), {'n': 3})
+
+    def test_job_ids(self):
+        self.store.put_job({'id': 'abc123', 'status': STATUS_PENDING})
+        assert_equal(self.store.get_job('abc123')['status'], STATUS_PENDING)
+        for job_id in ('', None, '../reports/abc123', 'abc123.json', 'missing'):
+            assert_equal(self.store.get_job(job_id), None)
+
+
+class TestValidationJobs(object):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = ReportStore(self.directory)
+        self.patches = [patch('ckanext.datajson.validation_jobs.get_report_store', return_value=self.store)]
+        for p in self.patches:
+            p.start()
+
+    def teardown(self):
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.directory)
+
+    def run_job(self, *responses):
+        with patch('ckanext.datajson.validation_jobs.enqueue_job') as enqueue_job, \
+                patch('ckanext.datajson.validation_jobs.urllib2.urlopen') as urlopen:
+            job = submit_validation(URL)
+            # the web request only records the job
+            assert_equal(urlopen.call_count, 0)
+            assert_equal(job['status'], STATUS_PENDING)
+            assert_equal(enqueue_job.call_args[0][1], [job['id']])
+            urlopen.side_effect = list(responses)
+            run_validation_job(job['id'])
+        return self.store.get_job(job['id'])
+
+    def test_validate(self):
+        job = self.run_job(Response(json.dumps([DATASET]), etag='"v1"'))
+        assert_equal(job['status'], STATUS_DONE)
+        report = self.store.get_report(job['report'])
+        assert_equal(report['errors'], [["No Errors", ["Great job!"]]])
+        assert_equal(report['etag'], '"v1"')
+
+    def test_errors(self):
+        job = self.run_job(Response(json.dumps({"dataset": [DATASET]})))
+        assert_equal(self.store.get_report(job['report'])['errors'][0][0], "Bad JSON Structure")
+        job = self.run_job(Response('[{"title": '))
+        assert_equal(self.store.get_report(job['report'])['errors'][0][0], "Invalid JSON")
+
+    def test_etag_hit(self):
+        first = self.run_job(Response(json.dumps([DATASET]), etag='"v1"'))
+        response = Response(json.dumps([DATASET]), etag='"v1"')
+        second = self.run_job(response)
+        assert_equal(second['report'], ReportStore.report_key(URL, etag='"v1"'))
+        assert_equal(self.store.get_report(second['report']), self.store.get_report(first['report']))
+        # the report of the ETag is used without reading the file
+        assert_equal(response.reads, 0)
+
+    def test_content_hit(self):
+        first = self.run_job(Response(json.dumps([DATASET])))
+        with patch('ckanext.datajson.validation_jobs._validate_file') as validate_file:
+            second = self.run_job(Response(json.dumps([DATASET]), etag='"v2"'))
+            assert_equal(validate_file.call_count, 0)
+        assert_equal(second['report'], first['report'])
+        # the ETag now leads to the report too
+        assert_true(self.store.get_report(ReportStore.report_key(URL, etag='"v2"')) is not None)
+
+    def test_load_error(self):
+        job = self.run_job(urllib2.URLError('timed out'))
+        assert_equal(job['status'], STATUS_DONE)
+        report = self.store.get_report(job['report'])
+        assert_equal(report['errors'][0][0], "Error Loading File")
+        # a failed download is not cached for the file
+        job = self.run_job(Response(json.dumps([DATASET])))
+        assert_equal(self.store.get_report(job['report'])['errors'], [["No Errors", ["Great job!"]]])
+
+    def test_job_error(self):
+        with patch('ckanext.datajson.validation_jobs._validate_url', side_effect=Exception('disk full')):
+            job = self.run_job()
+        assert_equal(job['status'], STATUS_ERROR)
+        assert_equal(job['error'], 'disk full')
+        assert_true(job['finished'] >= job['submitted'])
@@ -0,0 +1,67 @@
+import gzip
+import json
+from StringIO import StringIO
+
+from nose.tools import assert_equal, assert_true, assert_false
+
+try:
+    from ckan.tests.helpers import _get_test_app
+except ImportError:
+    from ckan.new_tests.helpers import _get_test_app
+
+from ckanext.datajson.datajsonvalidator import do_validation
+
+DATASET = {
+    "title": "Water Quality", "description": "Samples", "keyword": ["water"], "modified": "2016-01-01",
+    "publisher": {"name": "Agency"}, "contactPoint": {"fn": "Jane", "hasEmail": "mailto:jane@example.gov"},
+    "identifier": "water-1", "accessLevel": "public", "bureauCode": ["010:00"], "programCode": ["010:000"],
+}
+
+
+class TestValidatorApi(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.app = _get_test_app()
+
+    def post(self, body, **headers):
+        response = self.app.post('/api/pod/validate', params=body, headers=headers,
+                                 content_type='application/json')
+        assert_equal(response.content_type, 'application/json')
+        return json.loads(response.body)
+
+    def expected_errors(self, doc):
+        errors = []
+        do_validation(doc, errors, set())
+        return [[heading, messages] for heading, messages in errors]
+
+    def test_plain_body(self):
+        doc = [DATASET, dict(DATASET, identifier='water-2', accessLevel='secret')]
+        result = self.post(json.dumps(doc))
+        assert_false(result['valid'])
+        assert_equal(result['datasets'], 2)
+        assert_equal(result['errors'], self.expected_errors(json.loads(json.dumps(doc))))
+
+    def test_gzip_body(self):
+        doc = [dict(DATASET, identifier='water-%d' % i) for i in range(100)]
+        f = StringIO()
+        with gzip.GzipFile(fileobj=f, mode='wb') as g:
+            g.write(json.dumps(doc))
+        result = self.post(f.getvalue(), **{'Content-Encoding': 'gzip'})
+        assert_equal(result['datasets'], 100)
+        assert_equal(result['errors'], self.expected_errors(json.loads(json.dumps(doc))))
+
+    def test_malformed_json(self):
+        result = self.post('[{"title": "Water Quality"},')
+        assert_false(result['valid'])
+        assert_equal([heading for heading, messages in result['errors']], ["Invalid JSON"])
+
+    def test_structure(self):
+        for doc in ([], {}, {"dataset": [DATASET]}):
+            result = self.post(json.dumps(doc))
+            assert_false(result['valid'])
+            assert_equal(result['errors'], self.expected_errors(doc))
+
+    def test_get(self):
+        response = self.app.get('/api/pod/validate', status=405)
+        assert_true('error' in json.loads(response.body))
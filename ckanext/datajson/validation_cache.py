@@ -0,0 +1,131 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+try:
+    from pylons import config
+except ImportError:
+    # used outside of a CKAN process, e.g. by the offline validator
+    config = {}
+
+log = logging.getLogger(__name__)
+
+# forget results stored this many seconds ago, whether or not they are
+# still asked for; hits are not written back so reads stay read-only
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+# how often (in writes) old results are pruned
+PRUNE_EVERY = 1000
+
+_MISSING = object()
+
+
+class ValidationCache:
+    """
+    Validation results keyed by the canonical hash of a POD entry and the
+    validator variant that produced them, kept in a local SQLite file so the
+    harvester, the /data.json exporter and the inventory exports can share them.
+    """
+
+    def __init__(self, path, max_age=DEFAULT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._writes = 0
+
+    def _connection(self):
+        # sqlite connections must not be shared with forked children
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    if not os.path.isdir(directory):
+                        raise
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute('CREATE TABLE IF NOT EXISTS validation_result ('
+                               'entry_hash TEXT NOT NULL, variant TEXT NOT NULL, '
+                               'result TEXT NOT NULL, created REAL NOT NULL, '
+                               'PRIMARY KEY (entry_hash, variant))')
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, entry_hash, variant, default=None):
+        try:
+            with self._lock:
+                row = self._connection().execute(
+                    'SELECT result FROM validation_result WHERE entry_hash = ? AND variant = ?',
+                    (entry_hash, variant)).fetchone()
+        except sqlite3.Error as e:
+            log.warn('Validation cache %s is not readable: %s', self.path, e)
+            return default
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def set(self, entry_hash, variant, result):
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute('INSERT OR REPLACE INTO validation_result VALUES (?, ?, ?, ?)',
+                             (entry_hash, variant, json.dumps(result), time.time()))
+                self._writes += 1
+                if self._writes % PRUNE_EVERY == 0:
+                    conn.execute('DELETE FROM validation_result WHERE created < ?', (time.time() - self.max_age,))
+                conn.commit()
+        except sqlite3.Error as e:
+            log.warn('Validation cache %s is not writable: %s', self.path, e)
+
+
+def entry_hash(entry):
+    """
+    Canonical hash of a POD entry, independent of its key order
+    :param entry: dict
+    :return: str
+    """
+    return hashlib.sha1(json.dumps(entry, sort_keys=True, separators=(',', ':'))).hexdigest()
+
+
+_cache = None
+
+
+def get_validation_cache():
+    """
+    Process wide cache, stored at ckanext.datajson.validation_cache_path
+    :return: ValidationCache
+    """
+    global _cache
+    if _cache is None:
+        path = config.get('ckanext.datajson.validation_cache_path') or \
+            os.path.join(tempfile.gettempdir(), 'ckanext-datajson', 'validation-cache.sqlite')
+        _cache = ValidationCache(path)
+    return _cache
+
+
+def cached_result(entry, variant, compute):
+    """
+    Returns the cached validation result of entry for variant, calling
+    compute() and storing its (json-able) result when there is none yet.
+    compute() must raise rather than return a failure that may not happen
+    again, e.g. an internal error; an exception is passed on and nothing is
+    stored, so the entry is validated again next time.
+    :param entry: dict
+    :param variant: str, identifies the validator and its version
+    :param compute: callable
+    :return: result of compute()
+    """
+    cache = get_validation_cache()
+    key = entry_hash(entry)
+    result = cache.get(key, variant, _MISSING)
+    if result is _MISSING:
+        result = compute()
+        cache.set(key, variant, result)
+    return result
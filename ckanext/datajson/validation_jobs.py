@@ -0,0 +1,292 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import urllib2
+import uuid
+
+from pylons import config
+
+from datajsonvalidator import do_validation
+
+try:
+    # CKAN 2.7+ ships an RQ based background job queue
+    from ckan.lib.jobs import enqueue as enqueue_job
+except ImportError:
+    enqueue_job = None
+
+log = logging.getLogger(__name__)
+
+USER_AGENT = 'Data.gov/2.0'
+CHUNK_SIZE = 64 * 1024
+# seconds a download may wait for the server
+TIMEOUT = 60
+
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_ERROR = 'error'
+
+
+class ReportStore:
+    """
+    Keeps validation jobs and their reports as small json files on local disk.
+
+    Reports are stored under a key derived from the source URL and either its
+    ETag or the sha1 of its body, so an unchanged file is only validated once.
+    Least recently used reports are evicted once there are more than
+    max_reports of them, and anything not used for max_age seconds is
+    dropped. Both go by the modification time of the files, which reading a
+    report updates.
+    """
+
+    def __init__(self, directory, max_reports=200, max_age=7 * 24 * 3600):
+        self.directory = directory
+        self.max_reports = max_reports
+        self.max_age = max_age
+        self.jobs_dir = os.path.join(directory, 'jobs')
+        self.reports_dir = os.path.join(directory, 'reports')
+        for path in (self.jobs_dir, self.reports_dir):
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError:
+                    # another worker created it in the meantime
+                    if not os.path.isdir(path):
+                        raise
+
+    @staticmethod
+    def report_key(url, etag=None, content_hash=None):
+        """
+        Cache key of a report
+        :param url: str
+        :param etag: str|None
+        :param content_hash: str|None
+        :return: str
+        """
+        if etag:
+            marker = 'etag:' + etag
+        else:
+            marker = 'sha1:' + content_hash
+        return hashlib.sha1(url.encode('utf8') + '\n' + marker.encode('utf8')).hexdigest()
+
+    def get_report(self, key):
+        path = os.path.join(self.reports_dir, key + '.json')
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                self._remove(path)
+                return None
+        except OSError:
+            return None
+        report = self._read(path)
+        if report is not None:
+            # touch the file so eviction is least-recently-used
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+        return report
+
+    def put_report(self, report, *keys):
+        for key in keys:
+            self._write(os.path.join(self.reports_dir, key + '.json'), report)
+        self.evict()
+
+    def get_job(self, job_id):
+        # job ids come from the URL, never let them walk the file system
+        if not job_id or not job_id.isalnum():
+            return None
+        return self._read(os.path.join(self.jobs_dir, job_id + '.json'))
+
+    def put_job(self, job):
+        self._write(os.path.join(self.jobs_dir, job['id'] + '.json'), job)
+
+    def evict(self):
+        now = time.time()
+        for directory, limit in ((self.reports_dir, self.max_reports), (self.jobs_dir, None)):
+            entries = []
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                try:
+                    mtime = os.path.getmtime(path)
+                except OSError:
+                    continue
+                if now - mtime > self.max_age:
+                    self._remove(path)
+                else:
+                    entries.append((mtime, path))
+            if limit is not None and len(entries) > limit:
+                entries.sort()
+                for mtime, path in entries[:len(entries) - limit]:
+                    self._remove(path)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def _write(self, path, obj):
+        # write to a temporary file first so readers never see half a report
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(obj, f)
+        os.rename(tmp_path, path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def get_report_store():
+    """
+    Report store configured by the ckanext.datajson.validation.* options
+    :return: ReportStore
+    """
+    directory = config.get('ckanext.datajson.validation.report_dir') or \
+        os.path.join(tempfile.gettempdir(), 'ckanext-datajson', 'validation')
+    return ReportStore(directory,
+                       max_reports=int(config.get('ckanext.datajson.validation.max_reports', 200)),
+                       max_age=int(config.get('ckanext.datajson.validation.max_age', 7 * 24 * 3600)))
+
+
+def submit_validation(url):
+    """
+    Creates a validation job for a remote data.json file and hands it to the
+    background queue. The request makes no request to the remote server, the
+    job finds out whether the file has a report already, see _validate_url.
+    :param url: str
+    :return: dict, the job
+    """
+    store = get_report_store()
+    job = {
+        'id': uuid.uuid4().hex,
+        'url': url,
+        'status': STATUS_PENDING,
+        'submitted': time.time(),
+    }
+
+    store.put_job(job)
+    if enqueue_job is not None:
+        enqueue_job(run_validation_job, [job['id']], title='data.json validation of %s' % url)
+    else:
+        worker = threading.Thread(target=run_validation_job, args=(job['id'],))
+        worker.setDaemon(True)
+        worker.start()
+    return job
+
+
+def run_validation_job(job_id):
+    """
+    Background job: fetches the file, validates it and stores the report.
+    :param job_id: str
+    """
+    store = get_report_store()
+    job = store.get_job(job_id)
+    if job is None:
+        log.warn('Validation job %s not found', job_id)
+        return
+
+    job['status'] = STATUS_RUNNING
+    store.put_job(job)
+
+    try:
+        job['report'] = _validate_url(store, job['url'])
+        job['status'] = STATUS_DONE
+    except Exception as e:
+        log.error('Validation job %s for %s failed: %s', job_id, job['url'], unicode(e))
+        job['status'] = STATUS_ERROR
+        job['error'] = unicode(e)
+    job['finished'] = time.time()
+    store.put_job(job)
+
+
+def _validate_url(store, url):
+    # A file whose ETag or content has a report already is not validated
+    # again; with a known ETag the body is not even read.
+    req = urllib2.Request(url)
+    req.add_header('User-agent', USER_AGENT)
+
+    errors = []
+    etag = None
+    spool = tempfile.TemporaryFile()
+    try:
+        sha1 = hashlib.sha1()
+        try:
+            f = urllib2.urlopen(req, timeout=TIMEOUT)
+            etag = f.info().getheader('ETag')
+            if etag:
+                key = ReportStore.report_key(url, etag=etag)
+                if store.get_report(key) is not None:
+                    f.close()
+                    return key
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha1.update(chunk)
+                spool.write(chunk)
+            f.close()
+        except IOError as e:
+            errors.append(("Error Loading File", ["The address could not be loaded: " + unicode(e)]))
+
+        content_hash = sha1.hexdigest()
+        keys = [ReportStore.report_key(url, content_hash=content_hash)]
+        if not errors:
+            if store.get_report(keys[0]) is not None:
+                if etag:
+                    store.put_report(store.get_report(keys[0]), ReportStore.report_key(url, etag=etag))
+                return keys[0]
+            spool.seek(0)
+            errors = _validate_file(spool)
+        if etag:
+            keys.append(ReportStore.report_key(url, etag=etag))
+    finally:
+        spool.close()
+
+    report = {
+        'url': url,
+        'etag': etag,
+        'content_hash': content_hash,
+        'created': time.time(),
+        'errors': errors,
+    }
+    if errors and errors[0][0] == "Error Loading File":
+        # nothing was downloaded, so there is nothing worth caching
+        key = uuid.uuid4().hex
+        store.put_report(report, key)
+        return key
+    store.put_report(report, *keys)
+    return keys[0]
+
+
+def _validate_file(f):
+    errors = []
+    body = None
+    try:
+        body = json.load(f)
+    except ValueError as e:
+        errors.append(("Invalid JSON", ["The file does not meet basic JSON syntax requirements: " + unicode(
+            e) + ". Try using JSONLint.com."]))
+    except Exception as e:
+        errors.append((
+            "Internal Error",
+            ["Something bad happened while trying to load and parse the file: " + unicode(e)]))
+
+    if body:
+        try:
+            do_validation(body, errors, set())
+        except Exception as e:
+            errors.append(("Internal Error", ["Something bad happened: " + unicode(e)]))
+        if len(errors) == 0:
+            errors.append(("No Errors", ["Great job!"]))
+    return errors
+
@@ -28,5 +28,11 @@ setup(
     datajson=ckanext.datajson.plugin:DataJsonPlugin
     datajson_harvest=ckanext.datajson.harvester_datajson:DataJsonHarvester
     cmsdatanav_harvest=ckanext.datajson.harvester_cmsdatanavigator:CmsDataNavigatorHarvester
+
+        [paste.paster_command]
+    datajson=ckanext.datajson.commands:DatajsonCommand
+
+        [console_scripts]
+    datajson-validate=ckanext.datajson.offline_validator:main
 	""",
 )